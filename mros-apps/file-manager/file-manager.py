@@ -15,6 +15,11 @@ import shutil
 import mimetypes
 from pathlib import Path
 import json
+import threading
+import sys
+
+# Where the upload daemon's thin client is installed
+UPLOAD_SERVICE_DIR = '/usr/share/mros/services/upload-service'
 
 class MrosFileManager(Gtk.ApplicationWindow):
     def __init__(self, app):
@@ -433,8 +438,40 @@ class MrosFileManager(Gtk.ApplicationWindow):
             self.show_info("Please select files to upload")
             return
         
-        # Launch upload service
-        subprocess.Popen(['mros-upload-service'] + [str(f) for f in self.selected_files])
+        # Submit to the upload daemon from a background thread
+        file_paths = [str(f) for f in self.selected_files]
+        self.status_label.set_text(f"Uploading {len(file_paths)} file(s)...")
+        threading.Thread(
+            target=self.upload_files_background,
+            args=(file_paths,),
+            daemon=True
+        ).start()
+    
+    def upload_files_background(self, file_paths):
+        """Upload files in background thread"""
+        if UPLOAD_SERVICE_DIR not in sys.path:
+            sys.path.append(UPLOAD_SERVICE_DIR)
+        try:
+            from upload_client import ensure_daemon, DaemonUnavailable
+        except ImportError:
+            self.launch_upload_service(file_paths)
+            return
+        
+        try:
+            results = ensure_daemon().upload_files(file_paths)
+        except (DaemonUnavailable, OSError):
+            self.launch_upload_service(file_paths)
+            return
+        successful = sum(1 for r in results if r['success'])
+        GLib.idle_add(
+            self.status_label.set_text,
+            f"Upload complete: {successful}/{len(results)} files uploaded successfully"
+        )
+    
+    def launch_upload_service(self, file_paths):
+        """No daemon to talk to: leave the upload to the upload service"""
+        subprocess.Popen(['mros-upload-service'] + file_paths)
+        GLib.idle_add(self.status_label.set_text, f"Uploading {len(file_paths)} file(s) in the background...")
     
     def show_error(self, message):
         """Show error dialog"""
@@ -10,15 +10,18 @@ gi.require_version('Gdk', '4.0')
 
 from gi.repository import Gtk, Gdk, GLib, Gio
 import subprocess
+import asyncio
 import json
 import os
-import threading
 import time
 from pathlib import Path
 from datetime import datetime
 import sys
 sys.path.append('/usr/share/mros/services/upload-service')
 from upload_service import MrosUploadService
+from upload_async import AsyncMrosUploadService, GLibAsyncBridge
+from upload_client import ensure_daemon, DaemonUnavailable
+from upload_bandwidth import format_rate
 
 class MrosUploadManager(Gtk.ApplicationWindow):
     def __init__(self, app):
@@ -31,6 +34,19 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         # Upload service
         self.upload_service = MrosUploadService()
         
+        # Uploads go to the upload daemon, or run in-process when it is
+        # unavailable; either way as coroutines on one event loop thread
+        self.async_service = AsyncMrosUploadService()
+        self.async_bridge = GLibAsyncBridge()
+        self.running_uploads = set()
+        
+        # Durable upload queue shared with the daemon, shown in the Active tab
+        self.job_queue = self.upload_service.queue
+        
+        # Active upload rows keyed by file path, updated from progress events
+        self.active_rows = {}
+        self.active_batches = 0
+        
         # Create main layout
         self.create_layout()
         
@@ -105,9 +121,25 @@ class MrosUploadManager(Gtk.ApplicationWindow):
     
     def create_history_tab(self):
         """Create upload history tab"""
+        history_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        
+        # Search and status filter, applied by the history query
+        filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        self.history_search = Gtk.SearchEntry()
+        self.history_search.set_placeholder_text("Search file names and URLs")
+        self.history_search.set_hexpand(True)
+        self.history_search.connect('search-changed', lambda entry: self.load_history())
+        filter_box.append(self.history_search)
+        
+        self.history_status = Gtk.DropDown.new_from_strings(["All", "Completed", "Failed"])
+        self.history_status.connect('notify::selected', lambda dropdown, param: self.load_history())
+        filter_box.append(self.history_status)
+        history_box.append(filter_box)
+        
         # Scrolled window for history
         scrolled = Gtk.ScrolledWindow()
         scrolled.set_policy(Gtk.PolicyType.AUTOMATIC, Gtk.PolicyType.AUTOMATIC)
+        scrolled.set_vexpand(True)
         
         # History list
         self.history_list = Gtk.ListBox()
@@ -115,10 +147,18 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         self.history_list.set_selection_mode(Gtk.SelectionMode.NONE)
         
         scrolled.set_child(self.history_list)
+        history_box.append(scrolled)
+        
+        # Next page of the current query
+        self.history_cursor = None
+        self.load_more_btn = Gtk.Button(label="Load More")
+        self.load_more_btn.set_halign(Gtk.Align.CENTER)
+        self.load_more_btn.connect('clicked', lambda btn: self.load_history_page())
+        history_box.append(self.load_more_btn)
         
         # Add tab
         tab_label = Gtk.Label(label="History")
-        self.notebook.append_page(scrolled, tab_label)
+        self.notebook.append_page(history_box, tab_label)
     
     def create_active_tab(self):
         """Create active uploads tab"""
@@ -134,8 +174,32 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         # Active uploads list
         self.active_list = Gtk.ListBox()
         self.active_list.set_css_classes(['active-list'])
+        self.active_list.set_selection_mode(Gtk.SelectionMode.NONE)
         active_box.append(self.active_list)
         
+        # Cancel everything still in flight
+        cancel_btn = Gtk.Button(label="Cancel Uploads")
+        cancel_btn.set_halign(Gtk.Align.END)
+        cancel_btn.connect('clicked', self.on_cancel_uploads_clicked)
+        active_box.append(cancel_btn)
+        
+        # Upload queue, in the order jobs will run
+        queue_label = Gtk.Label(label="Queue")
+        queue_label.set_css_classes(['section-title'])
+        queue_label.set_halign(Gtk.Align.START)
+        active_box.append(queue_label)
+        
+        queue_scroll = Gtk.ScrolledWindow()
+        queue_scroll.set_vexpand(True)
+        self.queue_list = Gtk.ListBox()
+        self.queue_list.set_css_classes(['active-list'])
+        self.queue_list.set_selection_mode(Gtk.SelectionMode.NONE)
+        queue_scroll.set_child(self.queue_list)
+        active_box.append(queue_scroll)
+        
+        # Refresh while the tab is shown; cheap indexed query
+        GLib.timeout_add_seconds(2, self.refresh_queue)
+        
         # Add tab
         tab_label = Gtk.Label(label="Active")
         self.notebook.append_page(active_box, tab_label)
@@ -185,6 +249,68 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         
         settings_box.append(upload_group)
         
+        # Bandwidth settings, applied to the daemon and every running upload
+        bandwidth = self.upload_service.bandwidth.state()
+        bandwidth_group = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
+        
+        bandwidth_title = Gtk.Label(label="Bandwidth")
+        bandwidth_title.set_css_classes(['settings-group-title'])
+        bandwidth_title.set_halign(Gtk.Align.START)
+        bandwidth_group.append(bandwidth_title)
+        
+        # Pause switch
+        pause_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        pause_label = Gtk.Label(label="Pause all uploads")
+        pause_label.set_hexpand(True)
+        pause_label.set_halign(Gtk.Align.START)
+        pause_box.append(pause_label)
+        
+        self.pause_switch = Gtk.Switch()
+        self.pause_switch.set_active(bandwidth['paused'])
+        self.pause_switch.connect('notify::active', self.on_pause_toggled)
+        pause_box.append(self.pause_switch)
+        
+        bandwidth_group.append(pause_box)
+        
+        # Global limit
+        limit_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        limit_label = Gtk.Label(label="Upload limit (bytes/s)")
+        limit_label.set_hexpand(True)
+        limit_label.set_halign(Gtk.Align.START)
+        limit_box.append(limit_label)
+        
+        self.limit_entry = Gtk.Entry()
+        self.limit_entry.set_placeholder_text("unlimited, e.g. 2M")
+        if bandwidth['limit']:
+            self.limit_entry.set_text(format_rate(bandwidth['limit']))
+        self.limit_entry.connect('activate', self.on_bandwidth_changed)
+        limit_box.append(self.limit_entry)
+        
+        bandwidth_group.append(limit_box)
+        
+        # Time-of-day schedule
+        schedule_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
+        schedule_label = Gtk.Label(label="Schedule")
+        schedule_label.set_hexpand(True)
+        schedule_label.set_halign(Gtk.Align.START)
+        schedule_box.append(schedule_label)
+        
+        self.schedule_entry = Gtk.Entry()
+        self.schedule_entry.set_placeholder_text("mon-fri 09:00-18:00=2M")
+        self.schedule_entry.set_width_chars(28)
+        self.schedule_entry.set_text(bandwidth['schedule'])
+        self.schedule_entry.connect('activate', self.on_bandwidth_changed)
+        schedule_box.append(self.schedule_entry)
+        
+        bandwidth_group.append(schedule_box)
+        
+        apply_btn = Gtk.Button(label="Apply Bandwidth Settings")
+        apply_btn.set_halign(Gtk.Align.END)
+        apply_btn.connect('clicked', self.on_bandwidth_changed)
+        bandwidth_group.append(apply_btn)
+        
+        settings_box.append(bandwidth_group)
+        
         # History settings
         history_group = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=8)
         
@@ -222,9 +348,7 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         parent.append(self.status_bar)
     
     def load_history(self):
-        """Load upload history"""
-        history = self.upload_service.get_upload_history()
-        
+        """Load the first page of upload history matching the filters"""
         # Clear existing items
         child = self.history_list.get_first_child()
         while child:
@@ -232,12 +356,27 @@ class MrosUploadManager(Gtk.ApplicationWindow):
             self.history_list.remove(child)
             child = next_child
         
+        self.history_cursor = None
+        self.load_history_page()
+        
+        # Update count
+        self.upload_count_label.set_text(f"{self.upload_service.history_store.count()} uploads")
+    
+    def load_history_page(self):
+        """Append the next page of upload history"""
+        status = (None, 'completed', 'failed')[self.history_status.get_selected()]
+        history, self.history_cursor = self.upload_service.query_history(
+            50,
+            self.history_cursor,
+            status=status,
+            search=self.history_search.get_text() or None
+        )
+        
         # Add history items
         for item in history:
             self.add_history_item(item)
         
-        # Update count
-        self.upload_count_label.set_text(f"{len(history)} uploads")
+        self.load_more_btn.set_visible(self.history_cursor is not None)
     
     def add_history_item(self, item):
         """Add item to history list"""
@@ -315,11 +454,167 @@ class MrosUploadManager(Gtk.ApplicationWindow):
             open_btn.connect('clicked', lambda btn, url=item['download_url']: self.open_url(url))
             actions_box.append(open_btn)
             
+            # Open a local copy, fetched once and then served from the object cache
+            if 'encryption' not in item:
+                fetch_btn = Gtk.Button()
+                fetch_btn.set_child(Gtk.Image.new_from_icon_name("document-open"))
+                fetch_btn.set_css_classes(['action-button'])
+                fetch_btn.set_tooltip_text("Open local copy")
+                fetch_btn.connect('clicked', lambda btn, item=item: self.open_local_copy(item))
+                actions_box.append(fetch_btn)
+            
             main_box.append(actions_box)
         
         row.set_child(main_box)
         self.history_list.append(row)
     
+    def refresh_queue(self):
+        """Reload the queue view (running, queued and dead-lettered jobs)"""
+        if self.notebook.get_current_page() != 1:
+            return True
+        
+        jobs = self.job_queue.list(states=('running', 'queued', 'dead'), limit=200)
+        while (row := self.queue_list.get_first_child()) is not None:
+            self.queue_list.remove(row)
+        
+        queued = [job for job in jobs if job['state'] == 'queued']
+        for job in jobs:
+            self.add_queue_item(job, queued)
+        return True
+    
+    def add_queue_item(self, job, queued):
+        """Add a queue row with reorder, cancel and retry actions"""
+        row = Gtk.ListBoxRow()
+        row.set_css_classes(['history-item'])
+        
+        main_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=12)
+        main_box.set_margin_top(4)
+        main_box.set_margin_bottom(4)
+        main_box.set_margin_start(12)
+        main_box.set_margin_end(12)
+        
+        info_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL)
+        info_box.set_hexpand(True)
+        
+        filename_label = Gtk.Label(label=Path(job['path']).name)
+        filename_label.set_css_classes(['filename'])
+        filename_label.set_halign(Gtk.Align.START)
+        filename_label.set_ellipsize(3)  # ELLIPSIZE_END
+        info_box.append(filename_label)
+        
+        details = [job['state']]
+        if job['priority']:
+            details.append(f"priority {job['priority']}")
+        if job['attempts'] > 1 or job['state'] == 'dead':
+            details.append(f"{job['attempts']} attempts")
+        if job['state'] == 'queued' and job['next_attempt'] > time.time():
+            details.append(f"retry in {int(job['next_attempt'] - time.time())}s")
+        if job['last_error']:
+            details.append(f"Error: {job['last_error']}")
+        details_label = Gtk.Label(label=" • ".join(details))
+        details_label.set_css_classes(['details'])
+        details_label.set_halign(Gtk.Align.START)
+        details_label.set_ellipsize(3)  # ELLIPSIZE_END
+        info_box.append(details_label)
+        main_box.append(info_box)
+        
+        actions_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=4)
+        buttons = []
+        if job['state'] == 'queued':
+            position = next(i for i, other in enumerate(queued) if other['id'] == job['id'])
+            if position > 0:
+                buttons.append(("go-top", "Upload next",
+                                lambda: self.job_queue.move(job['id'], queued[0]['id'])))
+                buttons.append(("go-up", "Move up",
+                                lambda: self.job_queue.move(job['id'], queued[position - 1]['id'])))
+            if position < len(queued) - 1:
+                after = queued[position + 2]['id'] if position + 2 < len(queued) else None
+                buttons.append(("go-down", "Move down", lambda: self.job_queue.move(job['id'], after)))
+            buttons.append(("process-stop", "Cancel", lambda: self.job_queue.cancel(job_id=job['id'])))
+        elif job['state'] == 'dead':
+            buttons.append(("view-refresh", "Retry", lambda: self.retry_job(job)))
+        
+        for icon, tooltip, action in buttons:
+            button = Gtk.Button()
+            button.set_child(Gtk.Image.new_from_icon_name(icon))
+            button.set_css_classes(['action-button'])
+            button.set_tooltip_text(tooltip)
+            button.connect('clicked', lambda btn, action=action: (action(), self.refresh_queue()))
+            actions_box.append(button)
+        main_box.append(actions_box)
+        
+        row.set_child(main_box)
+        self.queue_list.append(row)
+    
+    def retry_job(self, job):
+        """Hand a dead-lettered job back to the upload daemon"""
+        try:
+            owner = ensure_daemon().ping()['pid']
+        except (DaemonUnavailable, TypeError):
+            self.status_label.set_text("Upload daemon not available")
+            return
+        self.job_queue.retry(job['id'], owner=owner)
+    
+    def on_upload_progress(self, progress):
+        """Update the Active tab from a progress event (main thread)"""
+        entry = self.active_rows.get(progress['filepath'])
+        if entry is None:
+            entry = self.add_active_item(progress['filename'])
+            self.active_rows[progress['filepath']] = entry
+        
+        total = progress['total']
+        fraction = progress['bytes_sent'] / total if total else 1.0
+        entry['bar'].set_fraction(min(fraction, 1.0))
+        
+        details = [f"{self.format_file_size(progress['bytes_sent'])} of {self.format_file_size(total)}"]
+        if progress['rate']:
+            details.append(f"{self.format_file_size(progress['rate'])}/s")
+        if progress['eta'] is not None:
+            details.append(f"{int(progress['eta'])}s left")
+        entry['details'].set_text(" • ".join(details))
+        
+        return False
+    
+    def add_active_item(self, filename):
+        """Add a progress row to the Active tab"""
+        row = Gtk.ListBoxRow()
+        row.set_css_classes(['history-item'])
+        
+        info_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=4)
+        info_box.set_margin_top(8)
+        info_box.set_margin_bottom(8)
+        info_box.set_margin_start(12)
+        info_box.set_margin_end(12)
+        
+        filename_label = Gtk.Label(label=filename)
+        filename_label.set_css_classes(['filename'])
+        filename_label.set_halign(Gtk.Align.START)
+        filename_label.set_ellipsize(3)  # ELLIPSIZE_END
+        info_box.append(filename_label)
+        
+        progress_bar = Gtk.ProgressBar()
+        info_box.append(progress_bar)
+        
+        details_label = Gtk.Label()
+        details_label.set_css_classes(['details'])
+        details_label.set_halign(Gtk.Align.START)
+        info_box.append(details_label)
+        
+        row.set_child(info_box)
+        self.active_list.append(row)
+        
+        return {'row': row, 'bar': progress_bar, 'details': details_label}
+    
+    def clear_active_items(self):
+        """Remove all rows from the Active tab"""
+        for entry in self.active_rows.values():
+            self.active_list.remove(entry['row'])
+        self.active_rows = {}
+    
+    def report_progress(self, progress):
+        """Progress callback invoked off the GTK thread"""
+        GLib.idle_add(self.on_upload_progress, progress)
+    
     def format_file_size(self, size_bytes):
         """Format file size in human readable format"""
         if size_bytes == 0:
@@ -348,6 +643,24 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         except Exception as e:
             self.status_label.set_text(f"Failed to open URL: {e}")
     
+    def open_local_copy(self, item):
+        """Fetch an upload (instant when cached) and open it with the default application"""
+        self.status_label.set_text(f"Fetching {item['filename']}...")
+        
+        async def fetch():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, self.upload_service.fetch, str(item['id']))
+        
+        def opened(path):
+            self.status_label.set_text("Ready")
+            self.open_url(Path(path).as_uri())
+        
+        self.async_bridge.submit(
+            fetch(),
+            on_done=opened,
+            on_error=lambda error: self.status_label.set_text(f"Failed to fetch {item['filename']}: {error}")
+        )
+    
     def on_upload_files_clicked(self, button):
         """Handle upload files button click"""
         dialog = Gtk.FileChooserDialog(
@@ -385,12 +698,9 @@ class MrosUploadManager(Gtk.ApplicationWindow):
             files = dialog.get_files()
             file_paths = [f.get_path() for f in files]
             
-            # Start upload in background thread
-            threading.Thread(
-                target=self.upload_files_background,
-                args=(file_paths,),
-                daemon=True
-            ).start()
+            self.start_batch()
+            self.status_label.set_text(f"Uploading {len(file_paths)} files...")
+            self.run_upload(self.upload_files_job(file_paths))
         
         dialog.destroy()
     
@@ -400,35 +710,81 @@ class MrosUploadManager(Gtk.ApplicationWindow):
             folder = dialog.get_file()
             folder_path = folder.get_path()
             
-            # Start upload in background thread
-            threading.Thread(
-                target=self.upload_folder_background,
-                args=(folder_path,),
-                daemon=True
-            ).start()
+            self.start_batch()
+            self.status_label.set_text(f"Uploading folder: {Path(folder_path).name}")
+            self.run_upload(self.upload_folder_job(folder_path))
         
         dialog.destroy()
     
-    def upload_files_background(self, file_paths):
-        """Upload files in background thread"""
-        GLib.idle_add(lambda: self.status_label.set_text(f"Uploading {len(file_paths)} files..."))
-        
-        results = self.upload_service.upload_multiple_files(file_paths, show_progress=False)
-        
-        # Update UI in main thread
-        GLib.idle_add(self.on_upload_complete, results)
+    async def upload_client(self):
+        """Client for the shared upload daemon, None to upload in-process"""
+        try:
+            return await asyncio.get_running_loop().run_in_executor(None, ensure_daemon)
+        except DaemonUnavailable:
+            return None
     
-    def upload_folder_background(self, folder_path):
-        """Upload folder in background thread"""
-        GLib.idle_add(lambda: self.status_label.set_text(f"Uploading folder: {Path(folder_path).name}"))
-        
-        results = self.upload_service.upload_folder(folder_path, show_progress=False)
-        
-        # Update UI in main thread
-        GLib.idle_add(self.on_upload_complete, results)
+    async def upload_files_job(self, file_paths):
+        client = await self.upload_client()
+        if client is not None:
+            return await client.async_upload_files(
+                file_paths,
+                show_progress=False,
+                progress_callback=self.report_progress
+            )
+        return await self.async_service.upload_multiple_files(
+            file_paths,
+            show_progress=False,
+            progress_callback=self.report_progress
+        )
+    
+    async def upload_folder_job(self, folder_path):
+        client = await self.upload_client()
+        if client is not None:
+            return await client.async_upload_folder(
+                folder_path,
+                show_progress=False,
+                progress_callback=self.report_progress
+            )
+        return await self.async_service.upload_folder(
+            folder_path,
+            show_progress=False,
+            progress_callback=self.report_progress
+        )
+    
+    def run_upload(self, coroutine):
+        """Hand an upload coroutine to the background event loop"""
+        future = self.async_bridge.submit(
+            coroutine,
+            on_done=lambda results: self.finish_upload(future, results),
+            on_error=lambda error: self.finish_upload(future, [
+                {'success': False, 'error': str(error), 'filename': 'upload'}
+            ])
+        )
+        self.running_uploads.add(future)
+    
+    def finish_upload(self, future, results):
+        self.running_uploads.discard(future)
+        self.on_upload_complete(results)
+    
+    def cancel_uploads(self):
+        """Cancel every upload still running"""
+        for future in list(self.running_uploads):
+            future.cancel()
+        self.running_uploads = set()
+        self.active_batches = 0
+        self.clear_active_items()
+    
+    def start_batch(self):
+        """Switch to the Active tab when a new upload batch starts"""
+        self.active_batches += 1
+        self.notebook.set_current_page(1)
     
     def on_upload_complete(self, results):
         """Handle upload completion"""
+        self.active_batches -= 1
+        if self.active_batches == 0:
+            self.clear_active_items()
+        
         successful = sum(1 for r in results if r['success'])
         total = len(results)
         
@@ -444,10 +800,37 @@ class MrosUploadManager(Gtk.ApplicationWindow):
         # Switch to history tab
         self.notebook.set_current_page(0)
     
+    def on_cancel_uploads_clicked(self, button):
+        """Handle cancel uploads button click"""
+        if self.running_uploads:
+            self.cancel_uploads()
+            self.status_label.set_text("Uploads cancelled")
+            self.load_history()
+    
     def on_settings_clicked(self, button):
         """Handle settings button click"""
         self.notebook.set_current_page(2)  # Switch to settings tab
     
+    def on_pause_toggled(self, switch, param):
+        """Pause or resume uploads in every process"""
+        if switch.get_active():
+            self.upload_service.bandwidth.pause()
+            self.status_label.set_text("Uploads paused")
+        else:
+            self.upload_service.bandwidth.resume()
+            self.status_label.set_text("Uploads resumed")
+    
+    def on_bandwidth_changed(self, widget):
+        """Save the limit and schedule entries"""
+        try:
+            self.upload_service.bandwidth.set_limit(self.limit_entry.get_text())
+            self.upload_service.bandwidth.set_schedule(self.schedule_entry.get_text())
+        except ValueError as e:
+            self.status_label.set_text(str(e))
+            return
+        rate = self.upload_service.bandwidth.state()['rate']
+        self.status_label.set_text(f"Upload limit now {format_rate(rate)}")
+    
     def on_clear_history_clicked(self, button):
         """Handle clear history button click"""
         dialog = Gtk.MessageDialog(
@@ -8,206 +8,472 @@ import sys
 import os
 import requests
 import json
-import subprocess
 import threading
+import signal
 import time
 from pathlib import Path
-import hashlib
-import mimetypes
+from datetime import datetime
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
 
-class MrosUploadService:
-    def __init__(self):
-        self.upload_url = "https://bashupload.com"
-        self.config_dir = Path.home() / '.config' / 'mros-upload'
-        self.config_dir.mkdir(parents=True, exist_ok=True)
-        self.history_file = self.config_dir / 'upload_history.json'
-        self.load_history()
-    
-    def load_history(self):
-        """Load upload history"""
-        try:
-            if self.history_file.exists():
-                with open(self.history_file, 'r') as f:
-                    self.history = json.load(f)
-            else:
-                self.history = []
-        except:
-            self.history = []
+from upload_engine import UploadEngine
+from upload_session import get_shared_pool
+from upload_stream import DEFAULT_CHUNK_SIZE
+from upload_resume import DEFAULT_RESUMABLE_CHUNK_SIZE
+from upload_parts import DEFAULT_PART_SIZE, DEFAULT_PART_WORKERS
+from upload_fetch import ObjectCache, RangeFetcher, copy_out, default_cache_dir, DEFAULT_CACHE_SIZE, DEFAULT_FETCH_WORKERS
+from upload_dedup import same_algorithm
+from upload_codecs import check_codec
+from upload_walker import walk_files
+from upload_crypto import Decryptor, DecryptionError, ENCRYPTED_SUFFIX
+from upload_daemon import UploadDaemon
+from upload_queue import UploadQueue, QueueRunner
+from upload_bandwidth import format_rate, parse_rate
+from upload_client import UploadClient, DaemonUnavailable
+from upload_report import ReportWriter, write_manifest, load_manifest
+from upload_records import error_result, print_results
+from upload_pipeline import UploadPipeline
+from upload_watch import FolderWatcher, WatchState, DEFAULT_DEBOUNCE
+
+class MrosUploadService(UploadPipeline):
+    def __init__(self, max_workers=4, per_host_limit=4, requests_per_second=2.0,
+                 pool_size=16, session_pool=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 resumable_url=None, resumable_threshold=16 * 1024 * 1024,
+                 resumable_chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE, dedup=True,
+                 compression=None, bandwidth_limit=None, bandwidth_schedule=None, backend=None,
+                 trace_log=None, verify=None, part_size=DEFAULT_PART_SIZE,
+                 part_workers=DEFAULT_PART_WORKERS, parts_threshold=64 * 1024 * 1024,
+                 encryption_key=None, cache_size=DEFAULT_CACHE_SIZE, fetch_workers=DEFAULT_FETCH_WORKERS):
+        # Keep-alive connection pool shared by every service in this process
+        super().__init__(
+            backend=backend,
+            session_pool=session_pool or get_shared_pool(pool_maxsize=max(pool_size, max_workers)),
+            resumable_url=resumable_url,
+            chunk_size=chunk_size,
+            resumable_threshold=resumable_threshold,
+            resumable_chunk_size=resumable_chunk_size,
+            dedup=dedup,
+            compression=compression,
+            bandwidth_limit=bandwidth_limit,
+            bandwidth_schedule=bandwidth_schedule,
+            trace_log=trace_log,
+            verify=verify,
+            part_size=part_size,
+            part_workers=part_workers,
+            parts_threshold=parts_threshold,
+            encryption_key=encryption_key
+        )
+        
+        # Fetched uploads, kept by content hash up to cache_size bytes
+        self.object_cache = ObjectCache(default_cache_dir(), cache_size)
+        self.fetcher = RangeFetcher(workers=fetch_workers)
+        
+        # Durable job queue, so queued uploads survive crashes and restarts
+        self.queue = UploadQueue(self.config_dir / 'queue.db')
+        self.metrics.registry.add_collector(self.collect_metrics)
+        
+        # Concurrent upload engine replaces the fixed delay between files
+        self.engine = UploadEngine(
+            max_workers=max_workers,
+            per_host_limit=per_host_limit,
+            rate=requests_per_second
+        )
+    
+    def collect_metrics(self, registry):
+        """Refresh the queue and bandwidth gauges before an export"""
+        counts = self.queue.counts()
+        for state in ('queued', 'running', 'dead'):
+            registry.set('mros_upload_queue_jobs', counts.get(state, 0), state=state)
+        bandwidth = self.bandwidth.state()
+        registry.set('mros_upload_bandwidth_cap_bytes', bandwidth['rate'])
+        registry.set('mros_upload_paused', int(bandwidth['paused']))
     
-    def save_history(self):
-        """Save upload history"""
+    def decrypt_download(self, source, output=None, range_size=8 * 1024 * 1024):
+        """Fetch an encrypted upload (URL or local file) and decrypt it as it streams in
+        
+        The plaintext goes to output, by default the upload's name without
+        .mrosenc in the current directory, and only gets that name once the
+        last chunk was authenticated.  Returns the output path.
+        """
+        if '://' in source:
+            backend = self.backend_for_url(source)
+            name = Path(urlparse(source).path).name
+            chunks = backend.read_stream(source, range_size)
+        else:
+            name = Path(source).name
+            f = open(source, 'rb')
+            chunks = iter(lambda: f.read(range_size), b'')
+        
+        if output is None:
+            output = name[:-len(ENCRYPTED_SUFFIX)] if name.endswith(ENCRYPTED_SUFFIX) else name + '.decrypted'
+        output = Path(output)
+        temp_path = output.with_name(f'.{output.name}.part')
+        decryptor = Decryptor(self.keys)
         try:
-            with open(self.history_file, 'w') as f:
-                json.dump(self.history, f, indent=2)
-        except Exception as e:
-            print(f"Failed to save history: {e}")
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as out:
+                for data in chunks:
+                    out.write(decryptor.feed(data))
+                out.write(decryptor.finish())
+            os.replace(temp_path, output)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            if '://' not in source:
+                f.close()
+        return output
+    
+    def fetch(self, target, output=None, progress_callback=None):
+        """Download an upload named by history id, upload id or URL, returns the local path
+        
+        The object comes from the cache when its content is there, from
+        the uploaded file itself while that is unchanged, or else from the
+        backend in parallel ranges, checked against the digest recorded
+        at upload time.  Without output the cached copy's path is returned,
+        which callers must not modify.
+        """
+        record = self.history_store.find_upload(target)
+        if record is None and '://' not in target:
+            raise ValueError(f"No completed upload {target} in history")
+        download_url = record['download_url'] if record else target
+        # What the backend stores; older records only have the hash of plain uploads
+        expected = record and (record.get('digest') or (
+            record.get('content_hash') if not (record.get('compression') or record.get('encryption')
+                                               or record.get('packed')) else None
+        ))
+        
+        path = self.object_cache.get(expected) if expected else None
+        if path is None and expected and self.dedup_index is not None and record.get('content_hash') == expected:
+            path = self.unchanged_original(record)
+        if path is None:
+            temp_path = self.object_cache.temp_path()
+            try:
+                with self.metrics.span('fetch', url=download_url) as span:
+                    digest = self.fetcher.fetch(self.backend_for_url(download_url), download_url,
+                                                temp_path, progress_callback=progress_callback)
+                    span.set(size=digest.position)
+                    span.status = 'ok'
+                fetched = digest.content_hash()
+                if same_algorithm(expected, fetched) and fetched != expected:
+                    raise IOError(f"Fetched {download_url} does not match its upload "
+                                  f"({digest.position} bytes read)")
+                path = self.object_cache.add(fetched, temp_path)
+            except BaseException:
+                temp_path.unlink(missing_ok=True)
+                raise
+        
+        if output is None:
+            return path
+        if Path(output).is_dir():
+            output = Path(output) / Path(urlparse(download_url).path).name
+        return copy_out(path, output)
     
-    def upload_file(self, file_path, show_progress=True):
-        """Upload a single file to bashupload.com"""
+    def unchanged_original(self, record):
+        """The uploaded file itself, if it still holds what was uploaded"""
+        filepath = record.get('filepath')
         try:
-            file_path = Path(file_path)
-            if not file_path.exists():
-                raise FileNotFoundError(f"File not found: {file_path}")
-            
-            if not file_path.is_file():
-                raise ValueError(f"Not a file: {file_path}")
-            
-            # Show notification
-            if show_progress:
-                self.show_notification(f"Uploading {file_path.name}...", "upload-start")
-            
-            # Prepare file for upload
-            file_size = file_path.stat().st_size
-            mime_type, _ = mimetypes.guess_type(str(file_path))
-            
-            # Create upload record
-            upload_record = {
-                'filename': file_path.name,
-                'filepath': str(file_path),
-                'size': file_size,
-                'mime_type': mime_type,
-                'timestamp': time.time(),
-                'status': 'uploading'
-            }
-            
-            # Upload file
-            with open(file_path, 'rb') as f:
-                files = {'file': (file_path.name, f, mime_type)}
-                
-                # Make request with progress tracking
-                response = requests.post(
-                    self.upload_url,
-                    files=files,
-                    timeout=300,  # 5 minutes timeout
-                    stream=True
-                )
-            
-            if response.status_code == 200:
-                # Parse response to get download URL
-                response_text = response.text.strip()
-                
-                # bashupload.com typically returns the URL directly
-                if response_text.startswith('http'):
-                    download_url = response_text
-                else:
-                    # Try to extract URL from response
-                    lines = response_text.split('\\n')
-                    download_url = None
-                    for line in lines:
-                        if line.startswith('http'):
-                            download_url = line.strip()
-                            break
-                    
-                    if not download_url:
-                        download_url = f"{self.upload_url}/{file_path.name}"
-                
-                # Update record
-                upload_record.update({
-                    'status': 'completed',
-                    'download_url': download_url,
-                    'upload_id': hashlib.md5(download_url.encode()).hexdigest()[:8]
-                })
-                
-                # Add to history
-                self.history.insert(0, upload_record)
-                if len(self.history) > 100:  # Keep only last 100 uploads
-                    self.history = self.history[:100]
-                self.save_history()
-                
-                # Copy URL to clipboard
-                self.copy_to_clipboard(download_url)
-                
-                # Show success notification
-                if show_progress:
-                    self.show_notification(
-                        f"Upload complete! URL copied to clipboard\\n{download_url}",
-                        "upload-success"
-                    )
-                
-                return {
-                    'success': True,
-                    'url': download_url,
-                    'filename': file_path.name,
-                    'size': file_size
-                }
-            
+            stat = os.stat(filepath)
+            if stat.st_size == record.get('size') and self.dedup_index.content_hash(filepath, stat) == record['content_hash']:
+                return Path(filepath).absolute()
+        except (TypeError, OSError):
+            pass
+        return None
+    
+    def url_is_valid(self, url):
+        """Check that a previously returned download URL still serves"""
+        return self.backend_for_url(url).is_valid(url)
+    
+    def delete_upload(self, download_url):
+        """Delete an uploaded object from its backend and forget it for dedup
+        
+        Returns False when the backend cannot delete uploads.
+        """
+        backend = self.backend_for_url(download_url)
+        if not backend.can_delete or not backend.delete(download_url):
+            return False
+        if self.dedup_index is not None:
+            self.dedup_index.forget_url(download_url)
+        return True
+    
+    def verify_uploads(self, records, on_result=None):
+        """Read uploads listed in a manifest back and compare them with their digests
+        
+        Returns upload-style results in manifest order; on_result(index,
+        path, result) is called as each one is known.  Records of failed
+        uploads are skipped.
+        """
+        records = [record for record in records if record.get('success') and record.get('url')]
+        
+        def verify(index, record):
+            started = time.perf_counter()
+            if not record.get('digest'):
+                problem = "no digest recorded"
             else:
-                error_msg = f"Upload failed: HTTP {response.status_code}"
-                upload_record.update({
-                    'status': 'failed',
-                    'error': error_msg
-                })
-                self.history.insert(0, upload_record)
-                self.save_history()
-                
-                if show_progress:
-                    self.show_notification(f"Upload failed: {error_msg}", "upload-error")
-                
-                return {
-                    'success': False,
-                    'error': error_msg,
-                    'filename': file_path.name
-                }
+                problem = self.backend_for_url(record['url']).verify(record['url'], record['digest'], 'full')
+            result = {
+                'success': problem is None,
+                'url': record['url'],
+                'filename': record.get('filename') or Path(record['path']).name,
+                'size': record.get('size'),
+                'digest': record['digest'],
+                'timings': {'verify': round(time.perf_counter() - started, 6)}
+            }
+            if problem:
+                result['error'] = f"Verification failed: {problem}"
+            if on_result:
+                on_result(index, record['path'], result)
+            return result
+        
+        with ThreadPoolExecutor(max_workers=self.engine.max_workers, thread_name_prefix='mros-verify') as pool:
+            return list(pool.map(verify, range(len(records)), records))
+    
+    def upload_file(self, file_path, show_progress=True, progress_callback=None, resumable=None,
+                    throttle=None, backend=None):
+        """Upload a single file to bashupload.com
+        
+        progress_callback receives dicts with filename, bytes_sent, total,
+        rate (bytes/s) and eta (seconds) while the body is streamed.
+        resumable forces (True) or disables (False) the resumable transfer;
+        by default it is used for files above resumable_threshold.
+        throttle defaults to the bandwidth governor's global cap.  backend
+        is a backend or spec string, the service's default when None.
+        Every call is traced as an 'upload' span.
+        """
+        backend = self.get_backend(backend)
+        with self.metrics.span('upload', file=str(file_path), backend=backend.describe()) as span:
+            result = self.transfer_file(file_path, show_progress, progress_callback, resumable,
+                                        throttle or self.bandwidth.throttle, backend)
+            span.finish(result)
+            result['timings'] = span.timings()
+        return result
+    
+    def transfer_file(self, file_path, show_progress, progress_callback, resumable, throttle, backend):
+        """Body of upload_file, timing its stages into the current span"""
+        try:
+            upload = self.start_upload(file_path, backend, resumable, show_progress)
+            if upload.result is not None:
+                return upload.result
+            download_url, error_msg, status_code = self.send_upload(upload, progress_callback, throttle)
+            return self.finish_upload(upload, download_url, error_msg, status_code, show_progress)
         
         except Exception as e:
-            error_msg = f"Upload error: {str(e)}"
+            result = error_result(e, Path(file_path).name if isinstance(file_path, (str, Path)) else str(file_path))
             if show_progress:
-                self.show_notification(error_msg, "upload-error")
-            
-            return {
-                'success': False,
-                'error': error_msg,
-                'filename': file_path.name if 'file_path' in locals() else 'unknown'
-            }
+                self.show_notification(result['error'], "upload-error")
+            return result
     
-    def upload_multiple_files(self, file_paths, show_progress=True):
-        """Upload multiple files"""
-        results = []
-        total_files = len(file_paths)
+    def upload_multiple_files(self, file_paths, show_progress=True, progress_callback=None, priority=0,
+                              limit=None, backend=None, on_result=None):
+        """Upload multiple files concurrently, results keep input order
         
-        if show_progress and total_files > 1:
-            self.show_notification(f"Starting upload of {total_files} files...", "upload-start")
+        file_paths may also be a generator (e.g. from upload_folder), in
+        which case uploads start while it is still producing paths.  The
+        files go through the durable job queue: failed attempts with a
+        retryable status are retried with backoff, and if this process
+        dies the remaining files are picked up by resume_queue() or the
+        daemon instead of being lost.  limit caps the byte rate of the
+        whole batch (e.g. '2M'), on top of the global bandwidth cap.
+        backend selects where the batch goes, see upload_file.
+        on_result(index, path, result) is called with each file's final
+        result as soon as it is known, from a worker thread.
+        """
+        total_files = len(file_paths) if hasattr(file_paths, '__len__') else None
+        single_file = total_files == 1
+        batch = self.queue.new_batch()
         
-        for i, file_path in enumerate(file_paths, 1):
-            if show_progress and total_files > 1:
-                self.show_notification(f"Uploading file {i}/{total_files}: {Path(file_path).name}", "upload-progress")
-            
-            result = self.upload_file(file_path, show_progress=(total_files == 1))
-            results.append(result)
-            
-            # Small delay between uploads to be respectful
-            if i < total_files:
-                time.sleep(1)
+        # The whole batch shares one notification that is updated in place
+        batch_key = f"batch-{batch}"
+        
+        if show_progress and not single_file:
+            if total_files:
+                self.show_notification(f"Starting upload of {total_files} files...", "upload-start", batch_key)
+            else:
+                self.show_notification("Starting upload...", "upload-start", batch_key)
+        
+        finished = threading.Event()
+        feeding = [True]
+        done_count = [0]
+        count_lock = threading.Lock()
+        
+        def on_job_result(job, result, final):
+            if not final:
+                return
+            if on_result:
+                on_result(job['seq'], job['path'], result)
+            with count_lock:
+                done_count[0] += 1
+                position = f"{done_count[0]}/{total_files}" if total_files else f"{done_count[0]}"
+            if show_progress and not single_file:
+                self.show_notification(f"Uploaded file {position}: {Path(job['path']).name}", "upload-progress", batch_key)
+            if not feeding[0] and not self.queue.batch_active(batch):
+                finished.set()
+        
+        options = {'limit': limit, 'backend': self.backend_spec(backend)}
+        runner = QueueRunner(
+            self.queue,
+            lambda job: self.run_job(job, show_progress=single_file, progress_callback=progress_callback),
+            workers=self.engine.max_workers,
+            batch=batch,
+            on_result=on_job_result
+        ).start()
+        try:
+            self.enqueue_paths(
+                batch,
+                file_paths,
+                priority,
+                options={name: value for name, value in options.items() if value} or None,
+                on_enqueued=runner.wake
+            )
+            feeding[0] = False
+            while self.queue.batch_active(batch):
+                finished.wait(1.0)
+        finally:
+            runner.stop()
         
+        results = self.queue.batch_results(batch)
+        # Forget old jobs here too, not every user runs the daemon
+        self.queue.purge()
+        total_files = len(results)
         if show_progress and total_files > 1:
             successful = sum(1 for r in results if r['success'])
             if successful == total_files:
-                self.show_notification(f"All {total_files} files uploaded successfully!", "upload-success")
+                self.show_notification(f"All {total_files} files uploaded successfully!", "upload-success", batch_key)
             else:
                 failed = total_files - successful
-                self.show_notification(f"{successful} files uploaded, {failed} failed", "upload-warning")
+                self.show_notification(f"{successful} files uploaded, {failed} failed", "upload-warning", batch_key)
+        
+        return results
+    
+    def enqueue_paths(self, batch, file_paths, priority=0, kind='file', options=None, owner=None,
+                      on_enqueued=None):
+        """Stream paths into the job queue in growing transactions
+        
+        The first path is committed on its own so uploads start at once;
+        later commits take up to 256 paths to keep fsyncs rare.
+        """
+        chunk = []
+        chunk_size = 1
+        for file_path in file_paths:
+            chunk.append(str(file_path))
+            if len(chunk) >= chunk_size:
+                self.queue.enqueue(batch, chunk, priority, kind, options, owner)
+                chunk = []
+                chunk_size = min(chunk_size * 2, 256)
+                if on_enqueued:
+                    on_enqueued()
+        if chunk:
+            self.queue.enqueue(batch, chunk, priority, kind, options, owner)
+            if on_enqueued:
+                on_enqueued()
+    
+    def run_job(self, job, show_progress=False, progress_callback=None):
+        """Execute one queued job under the engine's rate and host limits
+        
+        Waits while uploads are paused; the job's transfers share the
+        batch's bandwidth cap when it has one.  The attempt is traced as
+        a 'job' span whose 'wait' stage covers pause, rate limit and
+        host slot.
+        """
+        options = job['options']
+        backend = self.get_backend(options.get('backend'))
+        host = backend.host
+        throttle = self.bandwidth.throttler(self.bandwidth.job_bucket(job['batch'], options.get('limit')))
+        if job['attempts'] > 1:
+            self.metrics.registry.inc('mros_upload_retries_total', backend=backend.describe())
+        
+        with self.metrics.span('job', job=job['id'], batch=job['batch'], kind=job['kind'],
+                               attempt=job['attempts']) as span:
+            queued = time.perf_counter()
+            self.bandwidth.wait_resumed()
+            
+            def transfer(path):
+                span.add_stage('wait', time.perf_counter() - queued)
+                if job['kind'] == 'pack':
+                    return self.upload_folder(
+                        path,
+                        show_progress=show_progress,
+                        progress_callback=progress_callback,
+                        include=options.get('include'),
+                        exclude=options.get('exclude'),
+                        pack=options['pack'],
+                        throttle=throttle,
+                        backend=backend
+                    )[0]
+                return self.upload_file(
+                    path,
+                    show_progress=show_progress,
+                    progress_callback=progress_callback,
+                    resumable=options.get('resumable'),
+                    throttle=throttle,
+                    backend=backend
+                )
+            
+            result = self.engine.run(transfer, job['path'], host)
+            span.finish(result)
+        result['attempts'] = job['attempts']
+        return result
+    
+    def resume_queue(self):
+        """Finish jobs left in the queue by processes that died, returns their results"""
+        if not self.queue.recover(startup=True):
+            return []
+        
+        results = []
+        progressed = threading.Event()
+        
+        def on_result(job, result, final):
+            if final:
+                results.append(result)
+            progressed.set()
         
+        runner = QueueRunner(self.queue, self.run_job, workers=self.engine.max_workers, on_result=on_result).start()
+        try:
+            while self.queue.active(owner=os.getpid()):
+                progressed.wait(1.0)
+                progressed.clear()
+        finally:
+            runner.stop()
         return results
     
-    def upload_folder(self, folder_path, show_progress=True):
-        """Upload all files in a folder"""
+    def upload_folder(self, folder_path, show_progress=True, progress_callback=None,
+                      include=None, exclude=None, pack=None, priority=0, limit=None, throttle=None,
+                      backend=None, on_result=None):
+        """Upload all files in a folder
+        
+        Files are streamed from a parallel scandir walk straight into the
+        upload engine. include/exclude are gitignore-style globs relative
+        to the folder; .gitignore and .mrosignore files are honoured.
+        pack ('tar', 'tar.gz', 'tar.xz' or 'tar.zst') uploads the whole
+        folder as one archive instead of one request per file.  limit,
+        backend and on_result apply to the whole folder, see
+        upload_multiple_files.
+        """
         try:
             folder_path = Path(folder_path)
             if not folder_path.exists() or not folder_path.is_dir():
                 raise ValueError(f"Invalid folder: {folder_path}")
             
-            # Get all files in folder (recursively)
-            files = []
-            for file_path in folder_path.rglob('*'):
-                if file_path.is_file():
-                    files.append(file_path)
+            files = walk_files(folder_path, include=include, exclude=exclude)
+            if pack:
+                if throttle is None and limit:
+                    throttle = self.bandwidth.throttler(self.bandwidth.job_bucket(str(folder_path), limit))
+                with self.metrics.span('upload', file=str(folder_path), pack=pack,
+                                       backend=self.get_backend(backend).describe()) as span:
+                    result = self.upload_packed(folder_path, files, pack, show_progress, progress_callback,
+                                                throttle, backend)
+                    span.finish(result)
+                    result['timings'] = span.timings()
+                if on_result:
+                    on_result(0, str(folder_path), result)
+                return [result]
             
-            if not files:
-                if show_progress:
-                    self.show_notification("No files found in folder", "upload-warning")
-                return []
+            results = self.upload_multiple_files(files, show_progress, progress_callback, priority, limit,
+                                                 backend, on_result)
             
-            return self.upload_multiple_files(files, show_progress)
+            if not results and show_progress:
+                self.show_notification("No files found in folder", "upload-warning")
+            return results
         
         except Exception as e:
             error_msg = f"Folder upload error: {str(e)}"
@@ -215,123 +481,293 @@ class MrosUploadService:
                 self.show_notification(error_msg, "upload-error")
             return [{'success': False, 'error': error_msg, 'filename': 'folder'}]
     
+    def watch_folder(self, folder_path, show_progress=True, include=None, exclude=None, priority=0,
+                     limit=None, backend=None, debounce=DEFAULT_DEBOUNCE, poll_interval=None,
+                     on_result=None, stop=None):
+        """Upload new and changed files of a folder as they appear, until stop is set
+        
+        Replaces re-running --folder from cron: files are picked up by
+        inotify (or by polling every poll_interval seconds) once their
+        writer closed them, and only versions not uploaded before go into
+        the job queue.  The cursor of uploaded versions lives in
+        watch.db, so a restart only compares stat results.  Jobs still
+        queued when the watch stops are cancelled; their files are picked
+        up again on the next start.  Returns the results of the session.
+        """
+        folder_path = Path(folder_path).resolve()
+        if not folder_path.is_dir():
+            raise ValueError(f"Invalid folder: {folder_path}")
+        stop = stop or threading.Event()
+        
+        state = WatchState(self.config_dir / 'watch.db')
+        watcher = FolderWatcher(folder_path, state, include, exclude, debounce=debounce,
+                                poll_interval=poll_interval)
+        batch = self.queue.new_batch()
+        batch_key = f"watch-{batch}"
+        
+        def on_job_result(job, result, final):
+            if not final:
+                return
+            watcher.uploaded(job['path'], result)
+            if on_result:
+                on_result(job['seq'], job['path'], result)
+            if show_progress:
+                if result['success']:
+                    self.show_notification(f"Uploaded {result['filename']}", "upload-progress", batch_key)
+                else:
+                    self.show_notification(f"Upload failed: {result['error']}", "upload-error")
+        
+        options = {'limit': limit, 'backend': self.backend_spec(backend)}
+        options = {name: value for name, value in options.items() if value} or None
+        runner = QueueRunner(self.queue, self.run_job, workers=self.engine.max_workers, batch=batch,
+                             on_result=on_job_result).start()
+        try:
+            for paths in watcher.batches(stop):
+                self.queue.enqueue(batch, paths, priority, 'file', options)
+                runner.wake()
+        finally:
+            self.queue.cancel(batch=batch)
+            runner.stop()
+            watcher.close()
+            state.close()
+        return self.queue.batch_results(batch)
+    
+    def upload_packed(self, folder_path, files, pack_format='tar', show_progress=True,
+                      progress_callback=None, throttle=None, backend=None):
+        """Stream files into a single tar archive upload
+        
+        The archive is built on the fly and sent with chunked transfer
+        encoding, so there is no temp file. The history record carries a
+        manifest with every member's offsets inside the tar stream and
+        the content hash of the archive as sent.
+        """
+        upload = self.start_packed(folder_path, files, pack_format, self.get_backend(backend), show_progress)
+        download_url, error_msg, status_code, error = None, None, None, None
+        try:
+            download_url, error_msg, status_code = upload.backend.upload_chunks(
+                upload.chunks,
+                upload.upload_name,
+                upload.mime_type,
+                progress_callback,
+                throttle or self.bandwidth.throttle
+            )
+        except Exception as e:
+            error = e
+        return self.finish_packed(upload, download_url, error_msg, status_code, error, show_progress)
+    
     def get_upload_history(self, limit=50):
-        """Get upload history"""
-        return self.history[:limit]
+        """Get upload history, newest first (limit=None for all of it)"""
+        return self.history_store.recent(limit)
+    
+    def query_history(self, limit=50, cursor=None, **filters):
+        """One page of matching history records and the next page's cursor, see HistoryStore.query"""
+        return self.history_store.query(limit, cursor, **filters)
     
     def clear_history(self):
         """Clear upload history"""
-        self.history = []
-        self.save_history()
+        self.history_store.clear()
     
-    def copy_to_clipboard(self, text):
-        """Copy text to clipboard"""
-        try:
-            # Try different clipboard methods
-            methods = [
-                ['xclip', '-selection', 'clipboard'],
-                ['xsel', '--clipboard', '--input'],
-                ['wl-copy']  # For Wayland
-            ]
-            
-            for method in methods:
-                try:
-                    process = subprocess.Popen(
-                        method,
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE
-                    )
-                    process.communicate(input=text.encode())
-                    if process.returncode == 0:
-                        return True
-                except FileNotFoundError:
-                    continue
-            
-            # Fallback: try to use Python's tkinter
-            try:
-                import tkinter as tk
-                root = tk.Tk()
-                root.withdraw()
-                root.clipboard_clear()
-                root.clipboard_append(text)
-                root.update()
-                root.destroy()
-                return True
-            except:
-                pass
-            
-            return False
-        
-        except Exception as e:
-            print(f"Failed to copy to clipboard: {e}")
-            return False
+    def flush_notifications(self, timeout=5):
+        """Wait for queued notifications and clipboard copies"""
+        return self.notifier.flush(timeout)
+
+def pop_option(args, name, default=None, cast=str):
+    """Remove '--name value' from args and return the converted value"""
+    if name not in args:
+        return default
     
-    def show_notification(self, message, notification_type="info"):
-        """Show desktop notification"""
-        try:
-            # Map notification types to icons
-            icons = {
-                'info': 'dialog-information',
-                'upload-start': 'cloud-upload',
-                'upload-progress': 'cloud-upload',
-                'upload-success': 'dialog-ok-apply',
-                'upload-error': 'dialog-error',
-                'upload-warning': 'dialog-warning'
-            }
-            
-            icon = icons.get(notification_type, 'dialog-information')
-            
-            # Try notify-send first
-            try:
-                subprocess.run([
-                    'notify-send',
-                    '-i', icon,
-                    '-a', 'mros Upload Service',
-                    'File Upload',
-                    message
-                ], check=True, timeout=5)
-                return
-            except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                pass
-            
-            # Fallback: try zenity
-            try:
-                subprocess.run([
-                    'zenity',
-                    '--info',
-                    '--text', f"File Upload\\n{message}",
-                    '--title', 'mros Upload Service'
-                ], check=True, timeout=10)
-                return
-            except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-                pass
-            
-            # Last resort: print to console
-            print(f"NOTIFICATION: {message}")
-        
-        except Exception as e:
-            print(f"Failed to show notification: {e}")
+    index = args.index(name)
+    if index + 1 >= len(args):
+        print(f"Error: {name} requires a value")
+        sys.exit(1)
+    
+    value = args[index + 1]
+    del args[index:index + 2]
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"Error: invalid value for {name}: {value}")
+        sys.exit(1)
+
+def pop_options(args, name):
+    """Remove every '--name value' from args and return the values"""
+    values = []
+    while name in args:
+        values.append(pop_option(args, name))
+    return values
+
+def parse_time(text):
+    """'2026-03-01' or '2026-03-01 14:30' (local time) into a timestamp"""
+    return datetime.fromisoformat(text).timestamp()
+
+def pop_flag(args, name):
+    """Remove '--name' from args and return whether it was present"""
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
 
 def main():
     """Main function for command line usage"""
-    if len(sys.argv) < 2:
-        print("Usage: mros-upload-service <file1> [file2] [file3] ...")
-        print("       mros-upload-service --folder <folder_path>")
-        print("       mros-upload-service --history")
+    args = sys.argv[1:]
+    dedup = not pop_flag(args, '--no-dedup')
+    include = pop_options(args, '--include')
+    exclude = pop_options(args, '--exclude')
+    pack = pop_option(args, '--pack')
+    compression = pop_option(args, '--compress')
+    max_workers = pop_option(args, '--workers', 4, int)
+    per_host_limit = pop_option(args, '--per-host', 4, int)
+    requests_per_second = pop_option(args, '--rate', 2.0, float)
+    pool_size = pop_option(args, '--pool-size', 16, int)
+    resumable_url = pop_option(args, '--resumable-url')
+    daemon = pop_flag(args, '--daemon')
+    socket_path = pop_option(args, '--socket')
+    idle_timeout = pop_option(args, '--idle-timeout', None, float)
+    priority = pop_option(args, '--priority', 0, int)
+    limit = pop_option(args, '--limit')
+    backend = pop_option(args, '--backend')
+    trace_log = pop_option(args, '--trace-log')
+    metrics_file = pop_option(args, '--metrics-file')
+    verify = pop_option(args, '--verify')
+    encrypt = pop_flag(args, '--encrypt')
+    key_name = pop_option(args, '--key')
+    output = pop_option(args, '--output')
+    history_filters = {
+        'status': pop_option(args, '--status'),
+        'since': pop_option(args, '--since', None, parse_time),
+        'until': pop_option(args, '--until', None, parse_time),
+        'min_size': pop_option(args, '--min-size', None, parse_rate),
+        'max_size': pop_option(args, '--max-size', None, parse_rate),
+        'mime_type': pop_option(args, '--type'),
+        'name': pop_option(args, '--name'),
+        'search': pop_option(args, '--search')
+    }
+    page_size = pop_option(args, '--page-size', 50, int)
+    after = pop_option(args, '--after')
+    report_path = pop_option(args, '--report')
+    manifest_path = pop_option(args, '--manifest')
+    debounce = pop_option(args, '--debounce', DEFAULT_DEBOUNCE, float)
+    poll_interval = pop_option(args, '--poll', None, float)
+    part_workers = pop_option(args, '--parts', DEFAULT_PART_WORKERS, int)
+    part_size = pop_option(args, '--part-size', DEFAULT_PART_SIZE, parse_rate)
+    sys.argv[1:] = args
+    
+    if len(sys.argv) < 2 and not daemon:
+        print("Usage: mros-upload-service [options] <file1> [file2] [file3] ...")
+        print("       mros-upload-service [options] --folder <folder_path>")
+        print("       mros-upload-service [options] --watch <folder_path> [--debounce <s>] [--poll <s>]")
+        print("       mros-upload-service --history [filters] [--page-size <n>] [--after <cursor>]")
+        print("       mros-upload-service [options] --replay <manifest> [upload|failed|verify]")
         print("       mros-upload-service --clear-history")
+        print("       mros-upload-service --queue | --resume | --retry <job_id>")
+        print("       mros-upload-service --bandwidth [limit <rate> | schedule <spec> | pause | resume]")
+        print("       mros-upload-service --delete <url>")
+        print("       mros-upload-service --fetch <id|upload_id|url> [--output <file|dir>]")
+        print("       mros-upload-service --decrypt <url|file> [--output <file>]")
+        print("       mros-upload-service --keys | --keygen <name>")
+        print("       mros-upload-service --metrics [prometheus|json]")
+        print("       mros-upload-service [options] --daemon [--socket <path>] [--idle-timeout <s>]")
+        print("")
+        print("Options:")
+        print("  --workers <n>     Number of concurrent uploads (default: 4)")
+        print("  --per-host <n>    Concurrent uploads per host (default: 4)")
+        print("  --rate <n>        Upload requests started per second, 0 = unlimited (default: 2)")
+        print("  --pool-size <n>   Keep-alive connections kept per host (default: 16)")
+        print("  --backend <spec>  Upload destination: bashupload (default), an http(s) upload URL,")
+        print("                    local[:<dir>] for a built-in stand-in server, or a directory")
+        print("  --resumable-url <url>  Resumable (tus) endpoint used for files over 16 MB")
+        print("  --parts <n>       Parts sent at once for files over 64 MB, 1 = off (default: 4)")
+        print("  --part-size <size>  Size of those parts, e.g. 8M or 64M (default: 16M)")
+        print("  --no-dedup        Upload files even if identical content was uploaded before")
+        print("  --include <glob>  Only upload matching files from --folder (repeatable)")
+        print("  --exclude <glob>  Skip matching files and directories in --folder (repeatable)")
+        print("  --pack <format>   Upload --folder as one archive: tar, tar.gz, tar.xz or tar.zst")
+        print("  --debounce <s>    --watch: upload files once closed and unchanged this long (default: 1)")
+        print("  --poll <s>        --watch: rescan every s seconds instead of using inotify")
+        print("  --compress <codec>  Compress uploads on the fly: auto, gzip, xz or zstd")
+        print("  --verify <mode>   Read uploads back: sample (a few ranges) or full (whole object)")
+        print("  --encrypt         Encrypt uploads on the fly (AES-256-GCM) with the default key")
+        print("  --key <name>      Encrypt with this key from ~/.config/mros-upload/keys instead")
+        print("  --priority <n>    Queue priority, higher uploads first (default: 0)")
+        print("  --limit <rate>    Bandwidth cap for this upload, e.g. 500K or 2M (bytes/s)")
+        print("  --trace-log <file>  Append a JSON line per traced upload and job span to file")
+        print("  --metrics-file <file>  Write Prometheus metrics to file (on exit, every 5 s as daemon)")
+        print("  --daemon          Serve uploads for all clients on a local socket")
+        print("  --report <file>   Append a JSON line per finished file to file ('-' for stdout)")
+        print("  --manifest <file> Write all results and a summary to file.json or file.csv at the end")
+        print("History filters:")
+        print("  --status <s>      completed or failed")
+        print("  --since <date>    Uploaded at or after a date, e.g. 2026-03-01 or '2026-03-01 14:30'")
+        print("  --until <date>    Uploaded before a date")
+        print("  --min-size <size> --max-size <size>  Size range, e.g. 10M")
+        print("  --type <mime>     MIME type, e.g. application/pdf or image/*")
+        print("  --name <text>     Text anywhere in the file name")
+        print("  --search <words>  Words anywhere in the file name or download URL")
+        sys.exit(1)
+    
+    if verify not in (None, 'sample', 'full'):
+        print(f"Error: unknown verify mode: {verify}")
         sys.exit(1)
     
-    service = MrosUploadService()
+    if compression not in (None, 'none', 'auto'):
+        try:
+            check_codec(compression)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    
+    if part_size <= 0:
+        print("Error: --part-size must be positive")
+        sys.exit(1)
+    
+    try:
+        service = MrosUploadService(
+            max_workers=max_workers,
+            per_host_limit=per_host_limit,
+            requests_per_second=requests_per_second,
+            pool_size=pool_size,
+            resumable_url=resumable_url,
+            dedup=dedup,
+            compression=compression,
+            backend=backend,
+            trace_log=trace_log,
+            verify=verify,
+            part_size=part_size,
+            part_workers=part_workers,
+            encryption_key=key_name or ('default' if encrypt else None)
+        )
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    
+    if daemon:
+        upload_daemon = UploadDaemon(service, socket_path, idle_timeout=idle_timeout, metrics_file=metrics_file)
+        try:
+            upload_daemon.bind()
+        except RuntimeError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Upload daemon listening on {upload_daemon.socket_path}")
+        try:
+            upload_daemon.serve()
+        except KeyboardInterrupt:
+            pass
+        return
     
     if sys.argv[1] == '--history':
-        history = service.get_upload_history()
+        try:
+            history, cursor = service.query_history(page_size, after, **history_filters)
+        except ValueError:
+            print(f"Error: invalid cursor: {after}")
+            sys.exit(1)
         if history:
             print("Upload History:")
             print("-" * 80)
             for item in history:
                 status = "✓" if item['status'] == 'completed' else "✗"
                 print(f"{status} {item['filename']} - {item.get('download_url', 'N/A')}")
+            if cursor:
+                print(f"More: --history --after {cursor} (with the same filters)")
         else:
             print("No upload history found.")
         return
@@ -341,41 +777,219 @@ def main():
         print("Upload history cleared.")
         return
     
-    elif sys.argv[1] == '--folder':
+    elif sys.argv[1] == '--queue':
+        jobs = service.queue.list(states=('running', 'queued', 'dead'))
+        if not jobs:
+            print("Upload queue is empty.")
+        for job in jobs:
+            line = f"{job['id']:>6} {job['state']:<8} p{job['priority']:<3} {job['path']}"
+            if job['last_error']:
+                line += f" ({job['attempts']} attempts, last error: {job['last_error']})"
+            print(line)
+        return
+    
+    elif sys.argv[1] == '--retry':
         if len(sys.argv) < 3:
-            print("Error: Please specify folder path")
+            print("Error: Please specify a job id")
+            sys.exit(1)
+        if service.queue.retry(int(sys.argv[2])):
+            print(f"Job {sys.argv[2]} queued again, run --resume to upload it.")
+        else:
+            print(f"Job {sys.argv[2]} is not in the dead-letter list.")
+        return
+    
+    elif sys.argv[1] == '--delete':
+        if len(sys.argv) < 3:
+            print("Error: Please specify the download URL")
+            sys.exit(1)
+        if service.delete_upload(sys.argv[2]):
+            print(f"Deleted {sys.argv[2]}")
+        else:
+            print(f"Could not delete {sys.argv[2]}: the backend does not support deleting")
+            sys.exit(1)
+        return
+    
+    elif sys.argv[1] == '--keys':
+        keys = service.keys.keys()
+        if not keys:
+            print("No encryption keys yet; --encrypt creates the default key.")
+        for key in keys:
+            created = time.strftime('%Y-%m-%d %H:%M', time.localtime(key.created)) if key.created else '-'
+            print(f"{key.name:<20} {key.fingerprint}  created {created}")
+        return
+    
+    elif sys.argv[1] == '--keygen':
+        if len(sys.argv) < 3:
+            print("Error: Please specify a key name")
+            sys.exit(1)
+        try:
+            key = service.keys.generate(sys.argv[2])
+        except FileExistsError:
+            print(f"Error: a key named {sys.argv[2]} already exists")
+            sys.exit(1)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Created key {key.name} ({key.fingerprint}); back up {service.keys.path_for(key.name)}")
+        return
+    
+    elif sys.argv[1] == '--fetch':
+        if len(sys.argv) < 3:
+            print("Error: Please specify the upload id or download URL")
+            sys.exit(1)
+        try:
+            path = service.fetch(sys.argv[2], output or '.')
+        except (ValueError, OSError, requests.RequestException) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Fetched to {path}")
+        return
+    
+    elif sys.argv[1] == '--decrypt':
+        if len(sys.argv) < 3:
+            print("Error: Please specify the download URL or file")
+            sys.exit(1)
+        try:
+            path = service.decrypt_download(sys.argv[2], output)
+        except (DecryptionError, ValueError, OSError, requests.RequestException) as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        print(f"Decrypted to {path}")
+        return
+    
+    elif sys.argv[1] == '--metrics':
+        # Metrics live in the daemon; a CLI run only sees its own uploads
+        try:
+            text, snapshot = UploadClient(socket_path).metrics()
+        except DaemonUnavailable:
+            print("Upload daemon is not running; use --metrics-file to export metrics of a CLI upload")
+            sys.exit(1)
+        if sys.argv[2:3] == ['json']:
+            print(json.dumps(snapshot, indent=2))
+        else:
+            print(text, end='')
+        return
+    
+    elif sys.argv[1] == '--bandwidth':
+        command = sys.argv[2:4]
+        try:
+            if command[:1] == ['pause']:
+                service.bandwidth.pause()
+            elif command[:1] == ['resume']:
+                service.bandwidth.resume()
+            elif command[:1] == ['limit'] and len(command) == 2:
+                service.bandwidth.set_limit(command[1])
+            elif command[:1] == ['schedule']:
+                service.bandwidth.set_schedule(command[1] if len(command) == 2 else '')
+            elif command:
+                print("Error: Unknown bandwidth command")
+                sys.exit(1)
+        except ValueError as e:
+            print(f"Error: {e}")
             sys.exit(1)
         
-        folder_path = sys.argv[2]
-        print(f"Uploading folder: {folder_path}")
-        results = service.upload_folder(folder_path)
+        state = service.bandwidth.state()
+        print(f"Uploads: {'paused' if state['paused'] else 'running'}")
+        print(f"Limit: {format_rate(state['limit'])}")
+        print(f"Schedule: {state['schedule'] or 'none'}")
+        print(f"Current cap: {format_rate(state['rate'])}")
+        return
+    
+    # Per-file results stream to the report as they come and end up in the manifest
+    report = ReportWriter(report_path) if report_path or manifest_path else None
+    on_result = report.add if report else None
+    if report_path == '-':
+        # stdout carries the report now; messages and notifications go to stderr
+        sys.stdout = sys.stderr
+    
+    if sys.argv[1] == '--resume':
+        results = service.resume_queue()
+        if not results:
+            print("No interrupted uploads to resume.")
+        else:
+            print_results(results)
+    
+    elif sys.argv[1] == '--replay':
+        if len(sys.argv) < 3:
+            print("Error: Please specify the manifest or report to replay")
+            sys.exit(1)
+        mode = sys.argv[3] if len(sys.argv) > 3 else 'upload'
+        if mode not in ('upload', 'failed', 'verify'):
+            print(f"Error: unknown replay mode: {mode}")
+            sys.exit(1)
+        try:
+            records = load_manifest(sys.argv[2])
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read {sys.argv[2]}: {e}")
+            sys.exit(1)
         
-        successful = sum(1 for r in results if r['success'])
-        total = len(results)
-        print(f"Upload complete: {successful}/{total} files uploaded successfully")
+        if mode == 'verify':
+            print(f"Verifying {sum(1 for r in records if r.get('success'))} upload(s)...")
+            results = service.verify_uploads(records, on_result)
+            print_results(results, 'verified')
+        else:
+            file_paths = [r['path'] for r in records if mode == 'upload' or not r.get('success')]
+            print(f"Uploading {len(file_paths)} file(s)...")
+            results = service.upload_multiple_files(file_paths, priority=priority, limit=limit,
+                                                    on_result=on_result)
+            print_results(results)
+    
+    elif sys.argv[1] == '--watch':
+        if len(sys.argv) < 3:
+            print("Error: Please specify folder path")
+            sys.exit(1)
         
-        for result in results:
+        def print_result(index, path, result):
+            if on_result:
+                on_result(index, path, result)
             if result['success']:
-                print(f"✓ {result['filename']}: {result['url']}")
+                print(f"✓ {result['filename']}: {result['url']}", flush=True)
             else:
-                print(f"✗ {result['filename']}: {result['error']}")
+                print(f"✗ {result['filename']}: {result['error']}", flush=True)
+        
+        print(f"Watching folder: {sys.argv[2]} (Ctrl+C to stop)", flush=True)
+        # Stopping a watch run as a service (SIGTERM) finishes running uploads like Ctrl+C
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        try:
+            service.watch_folder(sys.argv[2], include=include, exclude=exclude, priority=priority,
+                                 limit=limit, debounce=debounce, poll_interval=poll_interval,
+                                 on_result=print_result)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        except KeyboardInterrupt:
+            pass
+        print("Stopped watching.")
+    
+    elif sys.argv[1] == '--folder':
+        if len(sys.argv) < 3:
+            print("Error: Please specify folder path")
+            sys.exit(1)
+        
+        folder_path = sys.argv[2]
+        print(f"Uploading folder: {folder_path}")
+        results = service.upload_folder(folder_path, include=include, exclude=exclude, pack=pack,
+                                        priority=priority, limit=limit, on_result=on_result)
+        print_results(results)
     
     else:
         # Upload individual files
         file_paths = sys.argv[1:]
         print(f"Uploading {len(file_paths)} file(s)...")
         
-        results = service.upload_multiple_files(file_paths)
-        
-        successful = sum(1 for r in results if r['success'])
-        total = len(results)
-        print(f"Upload complete: {successful}/{total} files uploaded successfully")
-        
-        for result in results:
-            if result['success']:
-                print(f"✓ {result['filename']}: {result['url']}")
-            else:
-                print(f"✗ {result['filename']}: {result['error']}")
+        results = service.upload_multiple_files(file_paths, priority=priority, limit=limit,
+                                                on_result=on_result)
+        print_results(results)
+    
+    if report:
+        report.close()
+        if manifest_path:
+            write_manifest(manifest_path, report.records, report.summary())
+    
+    # Let queued notifications and clipboard copies finish before exiting
+    service.flush_notifications()
+    if metrics_file:
+        service.metrics.write_prometheus(metrics_file)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,624 @@
+#!/usr/bin/env python3
+"""
+mros-linux Async Upload Service
+asyncio upload client with the same operations as MrosUploadService
+"""
+
+import asyncio
+import contextvars
+import itertools
+import ssl
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import urlparse, urljoin
+
+from upload_engine import TokenBucket
+from upload_stream import MultipartFileStream, MultipartChunkStream, DEFAULT_CHUNK_SIZE
+from upload_resume import DEFAULT_RESUMABLE_CHUNK_SIZE
+from upload_parts import DEFAULT_PART_SIZE, DEFAULT_PART_WORKERS
+from upload_walker import walk_files
+from upload_metrics import stage
+from upload_records import error_result
+from upload_pipeline import UploadPipeline
+
+class AsyncResponse:
+    """Status, lower-cased headers and body of a finished request"""
+    
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+    
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP/1.1 connections over asyncio streams
+    
+    At most per_host_limit requests run against one host at a time; the
+    rest wait on a semaphore without holding a socket.  Idle connections
+    are kept per host and reused.
+    """
+    
+    def __init__(self, per_host_limit=8, max_idle=8, ssl_context=None):
+        self.per_host_limit = max(1, int(per_host_limit))
+        self.max_idle = max_idle
+        self.ssl_context = ssl_context
+        self.semaphores = {}
+        self.idle = {}
+    
+    def semaphore(self, key):
+        semaphore = self.semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.per_host_limit)
+            self.semaphores[key] = semaphore
+        return semaphore
+    
+    async def connect(self, key):
+        scheme, host, port = key
+        idle = self.idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+        
+        context = None
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            context = self.ssl_context
+        reader, writer = await asyncio.open_connection(host, port, ssl=context)
+        return reader, writer, False
+    
+    def release(self, key, reader, writer, reusable):
+        idle = self.idle.setdefault(key, [])
+        if reusable and len(idle) < self.max_idle:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+    
+    async def request(self, method, url, headers=None, body=None, length=None, timeout=300):
+        """Send one request and return an AsyncResponse
+        
+        body is None, bytes or an async iterable of bytes.  An iterable
+        with a known length is sent with Content-Length, otherwise with
+        chunked transfer encoding.  timeout is an idle timeout: it bounds
+        connecting and every single read and drain, not the whole request,
+        so long uploads run as long as data keeps moving.  Cancelling the
+        caller closes the connection instead of returning it to the pool.
+        """
+        parsed = urlparse(url)
+        scheme = parsed.scheme or 'http'
+        port = parsed.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parsed.hostname, port)
+        
+        async with self.semaphore(key):
+            # A stale keep-alive connection is retried once when the body can be replayed
+            replayable = body is None or isinstance(body, bytes)
+            for attempt in range(2):
+                reader, writer, reused = await asyncio.wait_for(self.connect(key), timeout)
+                reusable = False
+                try:
+                    response, reusable = await self.exchange(
+                        reader, writer, method, parsed, headers or {}, body, length, timeout
+                    )
+                    return response
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    if not (reused and replayable and attempt == 0):
+                        raise
+                finally:
+                    self.release(key, reader, writer, reusable)
+    
+    async def exchange(self, reader, writer, method, parsed, headers, body, length, timeout):
+        def idle(awaitable):
+            return asyncio.wait_for(awaitable, timeout)
+        
+        async def read_body(size=None):
+            # Every read is timed on its own, so a slow but moving body is fine
+            parts = []
+            remaining = size
+            while remaining is None or remaining > 0:
+                data = await idle(reader.read(65536 if remaining is None else min(remaining, 65536)))
+                if not data:
+                    if remaining:
+                        raise asyncio.IncompleteReadError(b''.join(parts), size)
+                    break
+                parts.append(data)
+                if remaining is not None:
+                    remaining -= len(data)
+            return b''.join(parts)
+        
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        
+        lines = [
+            f'{method} {path} HTTP/1.1',
+            f'Host: {parsed.netloc}',
+            'User-Agent: mros-upload-service',
+            'Accept-Encoding: identity'
+        ]
+        chunked = False
+        if isinstance(body, bytes):
+            length = len(body)
+        if body is not None:
+            if length is None:
+                chunked = True
+                lines.append('Transfer-Encoding: chunked')
+            else:
+                lines.append(f'Content-Length: {length}')
+        lines += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        
+        if isinstance(body, bytes):
+            writer.write(body)
+        elif body is not None:
+            async for chunk in body:
+                if not chunk:
+                    continue
+                if chunked:
+                    writer.write(f'{len(chunk):x}\r\n'.encode() + chunk + b'\r\n')
+                else:
+                    writer.write(chunk)
+                await idle(writer.drain())
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        await idle(writer.drain())
+        
+        # Skip interim 1xx responses
+        while True:
+            status_line = await idle(reader.readline())
+            if not status_line:
+                raise ConnectionError("Connection closed by server")
+            version, status, _ = (status_line.decode('latin-1').rstrip('\r\n') + '  ').split(' ', 2)
+            status_code = int(status)
+            response_headers = {}
+            while True:
+                line = await idle(reader.readline())
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                response_headers[name.strip().lower()] = value.strip()
+            if status_code >= 200:
+                break
+        
+        reusable = version == 'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        if method == 'HEAD' or status_code in (204, 304):
+            content = b''
+        elif 'chunked' in response_headers.get('transfer-encoding', '').lower():
+            parts = []
+            while True:
+                size = int((await idle(reader.readline())).split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    # Trailers end with an empty line
+                    while (await idle(reader.readline())) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                parts.append(await read_body(size))
+                await idle(reader.readexactly(2))
+            content = b''.join(parts)
+        elif 'content-length' in response_headers:
+            content = await read_body(int(response_headers['content-length']))
+        else:
+            content = await read_body()
+            reusable = False
+        
+        return AsyncResponse(status_code, response_headers, content), reusable
+    
+    def close(self):
+        for idle in self.idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self.idle = {}
+
+class AsyncMrosUploadService(UploadPipeline):
+    """asyncio counterpart of MrosUploadService
+    
+    Transfers are coroutines on one event loop, so thousands can be in
+    flight from a single thread; max_in_flight bounds how many jobs are
+    started ahead (and how many files are open).  The pipeline steps it
+    shares with the threaded service (hashing, dedup, compression,
+    SQLite, verification) run on a small shared executor.  HTTP backends
+    are spoken to directly on the loop; resumable and multi-part
+    transfers and non-HTTP backends (directories) run the backend's
+    blocking methods on the executor.
+    """
+    
+    def __init__(self, max_in_flight=256, per_host_limit=8, requests_per_second=2.0,
+                 chunk_size=DEFAULT_CHUNK_SIZE, blocking_workers=4,
+                 resumable_url=None, resumable_threshold=16 * 1024 * 1024,
+                 resumable_chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE, dedup=True,
+                 compression=None, bandwidth_limit=None, bandwidth_schedule=None, backend=None,
+                 trace_log=None, verify=None, part_size=DEFAULT_PART_SIZE, part_workers=DEFAULT_PART_WORKERS,
+                 parts_threshold=64 * 1024 * 1024, encryption_key=None):
+        super().__init__(
+            backend=backend,
+            resumable_url=resumable_url,
+            chunk_size=chunk_size,
+            resumable_threshold=resumable_threshold,
+            resumable_chunk_size=resumable_chunk_size,
+            dedup=dedup,
+            compression=compression,
+            bandwidth_limit=bandwidth_limit,
+            bandwidth_schedule=bandwidth_schedule,
+            trace_log=trace_log,
+            verify=verify,
+            part_size=part_size,
+            part_workers=part_workers,
+            parts_threshold=parts_threshold,
+            encryption_key=encryption_key
+        )
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.rate_limiter = TokenBucket(requests_per_second, per_host_limit)
+        self.pool = AsyncConnectionPool(per_host_limit=per_host_limit)
+        self.executor = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='mros-async-io')
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+    
+    async def aclose(self):
+        self.pool.close()
+        self.executor.shutdown(wait=False)
+    
+    # Helpers
+    
+    async def run_blocking(self, func, *args):
+        """Run a blocking call on the executor, in the caller's context so stages reach its span"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(self.executor, context.run, func, *args)
+    
+    async def iterate_blocking(self, iterable, batch_size=1):
+        """Async iterator over a blocking iterable, pulled batch_size at a time"""
+        iterator = iter(iterable)
+        lock = threading.Lock()
+        
+        def next_batch():
+            with lock:
+                return list(itertools.islice(iterator, batch_size))
+        
+        def close():
+            with lock:
+                getattr(iterator, 'close', lambda: None)()
+        
+        try:
+            while True:
+                batch = await self.run_blocking(next_batch)
+                if not batch:
+                    return
+                for item in batch:
+                    yield item
+        finally:
+            # Let a generator such as TarStream clean up without blocking the loop
+            self.executor.submit(close)
+    
+    def loop_callback(self, callback):
+        """Wrap a progress callback so it always runs on the event loop thread"""
+        if callback is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return lambda event: loop.call_soon_threadsafe(callback, event)
+    
+    async def throttled(self, body, job_bucket=None):
+        """Pass body chunks through the bandwidth governor"""
+        async for chunk in body:
+            await self.bandwidth.athrottle(len(chunk), job_bucket)
+            yield chunk
+    
+    async def post(self, backend, body, content_type, length=None, job_bucket=None):
+        delay = self.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await self.pool.request(
+            'POST',
+            backend.upload_url,
+            headers={'Content-Type': content_type},
+            body=self.throttled(body, job_bucket),
+            length=length
+        )
+    
+    async def send(self, upload, progress_callback=None, job_bucket=None):
+        """Send a file started with start_upload, returns (download_url, error, status_code)"""
+        backend = upload.backend
+        if upload.route != 'post' or backend.upload_url is None:
+            return await self.run_blocking(
+                self.send_upload, upload, progress_callback, self.bandwidth.throttler(job_bucket)
+            )
+        
+        with stage('send'):
+            if upload.source is not None or upload.codec:
+                chunks, upload_name, mime_type, progress_callback, total = self.upload_body(upload, progress_callback)
+                body = MultipartChunkStream(chunks, upload_name, mime_type=mime_type,
+                                            progress_callback=progress_callback, total=total)
+                response = await self.post(backend, self.iterate_blocking(body), body.content_type,
+                                           job_bucket=job_bucket)
+                return backend.parse_response(response, upload_name) + (response.status_code,)
+            
+            stream = await self.run_blocking(lambda: MultipartFileStream(
+                upload.file_path,
+                mime_type=upload.mime_type,
+                chunk_size=self.chunk_size,
+                progress_callback=progress_callback,
+                digest=upload.send_digest
+            ))
+            
+            async def body():
+                while True:
+                    data = await self.run_blocking(stream.read, self.chunk_size)
+                    if not data:
+                        return
+                    yield data
+            
+            try:
+                response = await self.post(backend, body(), stream.content_type, len(stream), job_bucket)
+            finally:
+                stream.close()
+            return backend.parse_response(response, upload.file_path.name) + (response.status_code,)
+    
+    async def url_is_valid(self, url):
+        """Check that a previously returned download URL still serves"""
+        if not url.startswith(('http://', 'https://')):
+            return await self.run_blocking(lambda: self.backend_for_url(url).is_valid(url))
+        try:
+            for _ in range(5):
+                response = await self.pool.request('HEAD', url, timeout=30)
+                if response.status_code in (301, 302, 303, 307, 308) and 'location' in response.headers:
+                    url = urljoin(url, response.headers['location'])
+                    continue
+                return response.status_code < 400 or response.status_code == 405
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            pass
+        return False
+    
+    # Uploads
+    
+    async def upload_file(self, file_path, show_progress=True, progress_callback=None, resumable=None,
+                          backend=None, job_bucket=None):
+        """Upload a single file, returns the same result dict as MrosUploadService
+        
+        backend is a backend or spec string, the service's default when
+        None.  job_bucket is a bandwidth job bucket the transfer shares
+        with the rest of its batch.  Traced as an 'upload' span like the
+        threaded service.
+        """
+        backend = await self.run_blocking(self.get_backend, backend)
+        with self.metrics.span('upload', file=str(file_path), backend=backend.describe()) as span:
+            result = await self.transfer_file(file_path, show_progress, progress_callback, resumable, backend,
+                                              job_bucket)
+            span.finish(result)
+            result['timings'] = span.timings()
+        return result
+    
+    async def transfer_file(self, file_path, show_progress, progress_callback, resumable, backend, job_bucket):
+        loop = asyncio.get_running_loop()
+        
+        def validate(url):
+            # Called on an executor thread; the HEAD runs on the loop
+            return asyncio.run_coroutine_threadsafe(self.url_is_valid(url), loop).result()
+        
+        try:
+            upload = await self.run_blocking(self.start_upload, file_path, backend, resumable, show_progress,
+                                             validate)
+            if upload.result is not None:
+                return upload.result
+            download_url, error_msg, status_code = await self.send(
+                upload, self.loop_callback(progress_callback), job_bucket
+            )
+            return await self.run_blocking(self.finish_upload, upload, download_url, error_msg, status_code,
+                                           show_progress)
+        
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            result = error_result(e, Path(file_path).name if isinstance(file_path, (str, Path)) else str(file_path))
+            if show_progress:
+                self.show_notification(result['error'], "upload-error")
+            return result
+    
+    async def upload_multiple_files(self, file_paths, show_progress=True, progress_callback=None, limit=None,
+                                    backend=None, on_result=None):
+        """Upload files concurrently, results keep input order
+        
+        file_paths may be a list, any iterable or an async iterable.  At
+        most max_in_flight uploads are started ahead, so a producer is only
+        pulled as fast as uploads finish.  limit caps the byte rate of the
+        whole batch and backend selects where it goes, as for
+        MrosUploadService.  on_result(index, path, result) is called as
+        each upload completes.  Cancelling the awaiting task cancels every
+        upload still running.
+        """
+        total_files = len(file_paths) if hasattr(file_paths, '__len__') else None
+        single_file = total_files == 1
+        batch_key = f"batch-{uuid.uuid4().hex[:8]}"
+        job_bucket = self.bandwidth.job_bucket(batch_key, limit)
+        
+        if show_progress and not single_file:
+            if total_files:
+                self.show_notification(f"Starting upload of {total_files} files...", "upload-start", batch_key)
+            else:
+                self.show_notification("Starting upload...", "upload-start", batch_key)
+        
+        if not hasattr(file_paths, '__aiter__'):
+            file_paths = self.iterate_blocking(file_paths, batch_size=256)
+        
+        results = {}
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        done_count = 0
+        
+        async def run(index, file_path):
+            nonlocal done_count
+            try:
+                result = await self.upload_file(
+                    file_path,
+                    show_progress=single_file,
+                    progress_callback=progress_callback,
+                    backend=backend,
+                    job_bucket=job_bucket
+                )
+                results[index] = result
+                done_count += 1
+                if show_progress and not single_file:
+                    position = f"{done_count}/{total_files}" if total_files else f"{done_count}"
+                    self.show_notification(f"Uploaded file {position}: {Path(file_path).name}", "upload-progress", batch_key)
+                if on_result:
+                    on_result(index, file_path, result)
+            finally:
+                slots.release()
+        
+        try:
+            index = 0
+            async for file_path in file_paths:
+                await slots.acquire()
+                task = asyncio.ensure_future(run(index, file_path))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                index += 1
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        
+        results = [results[i] for i in range(len(results))]
+        total_files = len(results)
+        if show_progress and total_files > 1:
+            successful = sum(1 for r in results if r['success'])
+            if successful == total_files:
+                self.show_notification(f"All {total_files} files uploaded successfully!", "upload-success", batch_key)
+            else:
+                failed = total_files - successful
+                self.show_notification(f"{successful} files uploaded, {failed} failed", "upload-warning", batch_key)
+        
+        return results
+    
+    async def upload_folder(self, folder_path, show_progress=True, progress_callback=None,
+                            include=None, exclude=None, pack=None, limit=None, backend=None):
+        """Upload all files in a folder, see MrosUploadService.upload_folder"""
+        try:
+            folder_path = Path(folder_path)
+            if not folder_path.exists() or not folder_path.is_dir():
+                raise ValueError(f"Invalid folder: {folder_path}")
+            
+            files = walk_files(folder_path, include=include, exclude=exclude)
+            if pack:
+                job_bucket = self.bandwidth.job_bucket(str(folder_path), limit)
+                return [await self.upload_packed(folder_path, files, pack, show_progress, progress_callback,
+                                                 backend, job_bucket)]
+            
+            results = await self.upload_multiple_files(files, show_progress, progress_callback, limit, backend)
+            if not results and show_progress:
+                self.show_notification("No files found in folder", "upload-warning")
+            return results
+        
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error_msg = f"Folder upload error: {str(e)}"
+            if show_progress:
+                self.show_notification(error_msg, "upload-error")
+            return [{'success': False, 'error': error_msg, 'filename': 'folder'}]
+    
+    async def upload_packed(self, folder_path, files, pack_format='tar', show_progress=True,
+                            progress_callback=None, backend=None, job_bucket=None):
+        """Stream files into a single tar archive upload"""
+        backend = await self.run_blocking(self.get_backend, backend)
+        upload = await self.run_blocking(self.start_packed, folder_path, files, pack_format, backend, show_progress)
+        progress_callback = self.loop_callback(progress_callback)
+        download_url, error_msg, status_code, error = None, None, None, None
+        try:
+            if backend.upload_url is None:
+                download_url, error_msg, status_code = await self.run_blocking(
+                    backend.upload_chunks, upload.chunks, upload.upload_name, upload.mime_type,
+                    progress_callback, self.bandwidth.throttler(job_bucket)
+                )
+            else:
+                body = MultipartChunkStream(
+                    upload.chunks,
+                    upload.upload_name,
+                    mime_type=upload.mime_type,
+                    progress_callback=progress_callback
+                )
+                response = await self.post(backend, self.iterate_blocking(body), body.content_type,
+                                           job_bucket=job_bucket)
+                download_url, error_msg = backend.parse_response(response, upload.upload_name)
+                status_code = response.status_code
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = e
+        return await self.run_blocking(self.finish_packed, upload, download_url, error_msg, status_code, error,
+                                       show_progress)
+    
+    # History and notifications
+    
+    async def get_upload_history(self, limit=50):
+        """Get upload history, newest first (limit=None for all of it)"""
+        return await self.run_blocking(self.history_store.recent, limit)
+    
+    async def query_history(self, limit=50, cursor=None, **filters):
+        """One page of matching history records and the next page's cursor"""
+        return await self.run_blocking(lambda: self.history_store.query(limit, cursor, **filters))
+    
+    async def find_uploads_by_hash(self, content_hash):
+        """Completed uploads of the given content, newest first"""
+        return await self.run_blocking(self.history_store.find_by_hash, content_hash)
+    
+    async def clear_history(self):
+        await self.run_blocking(self.history_store.clear)
+    
+    async def flush_notifications(self, timeout=5):
+        return await asyncio.get_running_loop().run_in_executor(None, self.notifier.flush, timeout)
+
+class GLibAsyncBridge:
+    """Runs coroutines for a GTK application on one background event loop
+    
+    The GTK main loop keeps the UI thread; all upload coroutines share a
+    single asyncio loop thread instead of one thread per job.  Completion
+    callbacks are delivered on the UI thread through dispatch (GLib.idle_add
+    by default).  submit() returns a concurrent Future whose cancel()
+    cancels the coroutine.
+    """
+    
+    def __init__(self, dispatch=None):
+        if dispatch is None:
+            from gi.repository import GLib
+            dispatch = GLib.idle_add
+        self.dispatch = dispatch
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='mros-async', daemon=True)
+        self.thread.start()
+    
+    def submit(self, coroutine, on_done=None, on_error=None):
+        """Schedule a coroutine; on_done(result) / on_error(exception) run on the UI thread"""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        
+        def deliver(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    self.dispatch(lambda: on_error(error) and False)
+                else:
+                    print(f"Background upload failed: {error}")
+            elif on_done:
+                result = future.result()
+                self.dispatch(lambda: on_done(result) and False)
+        
+        future.add_done_callback(deliver)
+        return future
+    
+    def call_soon(self, callback):
+        """Wrap callback so that calls from the loop are forwarded to the UI thread"""
+        return lambda *args: self.dispatch(lambda: callback(*args) and False)
+    
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Backends
+Destinations for uploads: bashupload.com, any HTTP upload host, a local stand-in server or a directory
+"""
+
+import os
+import json
+import http.client
+import random
+import hashlib
+import threading
+import uuid
+from pathlib import Path
+from urllib.parse import urlparse, unquote
+
+import requests
+
+from upload_session import get_shared_pool
+from upload_stream import MultipartFileStream, MultipartChunkStream, FileSlice, ProgressTracker, DEFAULT_CHUNK_SIZE
+from upload_resume import ResumableUploader, DEFAULT_RESUMABLE_CHUNK_SIZE, TUS_VERSION
+from upload_parts import PartUploader, TusPartTarget, FilePartTarget, DEFAULT_PART_SIZE, DEFAULT_PART_WORKERS
+from upload_metrics import RequestClock, stage
+from upload_codecs import Decompressor
+from upload_dedup import StreamDigest
+from upload_sendfile import SendfileConnections, sendfile_supported, copy_file
+
+class RangeNotSupported(Exception):
+    """Raised by read_range when the server answers ranged reads with the whole object"""
+
+class UploadBackend:
+    """Where uploads go and how their download URLs behave
+    
+    A backend sends a file or a stream of chunks and returns
+    (download_url, error, status_code); it can also resume large files,
+    send them as concurrent parts, check, read back and delete the URLs it handed out and tell whether
+    a URL is one of its own.  upload_url is the multipart endpoint for
+    HTTP backends and None otherwise.  File transfers feed an optional
+    StreamDigest with the bytes they send.
+    """
+    
+    name = None
+    upload_url = None
+    can_delete = False
+    
+    @property
+    def host(self):
+        """Key for the engine's per-host concurrency limit"""
+        return urlparse(self.upload_url).netloc if self.upload_url else self.name
+    
+    @property
+    def supports_resume(self):
+        return False
+    
+    @property
+    def supports_parts(self):
+        return False
+    
+    def describe(self):
+        """Spec string that make_backend turns back into this backend"""
+        return self.name
+    
+    def upload_file(self, file_path, mime_type=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None):
+        raise NotImplementedError
+    
+    def upload_chunks(self, chunks, filename, mime_type=None, progress_callback=None,
+                      throttle=None, total=None):
+        raise NotImplementedError
+    
+    def resume_file(self, file_path, journal, chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None, source=None):
+        """Resumable transfer of a large file, returns the download URL
+        
+        source, an EncryptedFile, replaces the file's bytes and name.
+        """
+        raise NotImplementedError
+    
+    def part_target(self):
+        """Target that PartUploader sends the parts of one file to"""
+        raise NotImplementedError
+    
+    def upload_parts(self, file_path, journal, part_size=DEFAULT_PART_SIZE, workers=DEFAULT_PART_WORKERS,
+                     progress_callback=None, throttle=None, digest=None, source=None):
+        """Multi-part transfer of a large file, returns the download URL"""
+        uploader = PartUploader(self.part_target(), part_size, workers, journal)
+        return uploader.upload(file_path, progress_callback, throttle, digest, source)
+    
+    def parse_response(self, response, filename):
+        """Extract the download URL from an upload response, returns (url, error)"""
+        raise NotImplementedError
+    
+    def owns(self, download_url):
+        return False
+    
+    def is_valid(self, download_url):
+        return False
+    
+    def delete(self, download_url):
+        """Remove an uploaded object, returns True when it is gone"""
+        return False
+    
+    def read_range(self, download_url, offset, length):
+        """Bytes [offset, offset + length) of an uploaded object, fewer at its end"""
+        raise NotImplementedError
+    
+    def read_stream(self, download_url, chunk_size):
+        """The whole of an uploaded object as chunks, read front to back"""
+        offset = 0
+        while True:
+            data = self.read_range(download_url, offset, chunk_size)
+            offset += len(data)
+            if data:
+                yield data
+            if len(data) < chunk_size:
+                break
+    
+    def object_size(self, download_url):
+        """Size of an uploaded object, None when the backend cannot tell"""
+        return None
+    
+    def verify(self, download_url, content_hash, mode='full', local_path=None, codec=None,
+               range_size=8 * 1024 * 1024, sample_size=64 * 1024):
+        """Read an upload back and compare it, returns None or the mismatch
+        
+        'full' downloads the object in ranges and compares its hash (of
+        the decompressed data for codec uploads) with content_hash.
+        'sample' compares the first, last and two random ranges with
+        local_path byte for byte; compressed or local-less uploads are
+        always verified in full.
+        """
+        try:
+            if mode == 'sample' and local_path is not None and codec is None:
+                try:
+                    return self.verify_sample(download_url, local_path, sample_size)
+                except RangeNotSupported:
+                    pass
+            return self.verify_full(download_url, content_hash, codec, range_size)
+        except NotImplementedError:
+            return f"{self.describe()} cannot read uploads back"
+        except (OSError, ValueError, requests.RequestException) as e:
+            return f"could not read the upload back: {e}"
+    
+    def verify_full(self, download_url, content_hash, codec, range_size):
+        digest = StreamDigest()
+        decompressor = Decompressor(codec) if codec else None
+        offset = 0
+        for data in self.read_stream(download_url, range_size):
+            offset += len(data)
+            digest.update(decompressor.decompress(data) if decompressor else data)
+        if digest.content_hash() != content_hash:
+            return f"content hash mismatch after reading back {offset} bytes"
+        return None
+    
+    def verify_sample(self, download_url, local_path, sample_size):
+        size = os.path.getsize(local_path)
+        offsets = {0, max(0, size - sample_size)}
+        if size > 2 * sample_size:
+            offsets.update(random.randrange(0, size - sample_size) for _ in range(2))
+        with open(local_path, 'rb') as f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                expected = f.read(sample_size)
+                if self.read_range(download_url, offset, sample_size) != expected:
+                    return f"bytes at offset {offset} differ from the local file"
+        # Nothing may follow the end of the file
+        if size and self.read_range(download_url, size, 1):
+            return "upload is larger than the local file"
+        return None
+
+class HttpBackend(UploadBackend):
+    """Multipart POST to an HTTP upload host that answers with the download URL
+    
+    The reply may be the URL on a line of its own or JSON with a 'url'
+    key.  resumable_url enables tus transfers for large files, and
+    multi-part transfers when the server supports tus concatenation;
+    objects are deleted with HTTP DELETE on their URL.  Files go to
+    plain http:// hosts with sendfile on Linux.
+    """
+    
+    name = 'http'
+    can_delete = True
+    
+    def __init__(self, url, session_pool=None, resumable_url=None, timeout=300):
+        self.upload_url = url.rstrip('/')
+        self.session_pool = session_pool or get_shared_pool()
+        self.resumable_url = resumable_url
+        self.timeout = timeout
+        self.concatenation = None
+        # None until a ranged read shows whether the server honours Range
+        self.accepts_ranges = None
+        self.sendfile = SendfileConnections(timeout, self.session_pool.user_agent) \
+            if sendfile_supported(self.upload_url) else None
+    
+    @property
+    def supports_resume(self):
+        return bool(self.resumable_url)
+    
+    @property
+    def supports_parts(self):
+        """Whether the tus server has the concatenation extension, asked once"""
+        if not self.resumable_url:
+            return False
+        if self.concatenation is None:
+            try:
+                response = self.session_pool.session().options(
+                    self.resumable_url,
+                    headers={'Tus-Resumable': TUS_VERSION},
+                    timeout=30
+                )
+            except requests.RequestException:
+                return False
+            extensions = response.headers.get('Tus-Extension', '')
+            self.concatenation = 'concatenation' in (name.strip() for name in extensions.split(','))
+        return self.concatenation
+    
+    def describe(self):
+        return self.upload_url
+    
+    def post(self, body, content_type, filename):
+        clock = RequestClock()
+        response = self.session_pool.session().post(
+            self.upload_url,
+            data=clock.wrap(body),
+            headers={'Content-Type': content_type},
+            timeout=self.timeout
+        )
+        clock.finish()
+        return self.parse_response(response, filename) + (response.status_code,)
+    
+    def post_sendfile(self, stream, filename):
+        """post() for a MultipartFileStream, with the file sent by the kernel"""
+        try:
+            response = self.sendfile.post(self.upload_url, stream)
+        except TimeoutError as e:
+            raise requests.Timeout(f"Upload timed out: {e}")
+        except (ConnectionError, http.client.HTTPException) as e:
+            # Same exception types as requests, so callers know to retry
+            raise requests.ConnectionError(f"Upload connection failed: {e}")
+        return self.parse_response(response, filename) + (response.status_code,)
+    
+    def upload_file(self, file_path, mime_type=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None):
+        # Stream the multipart body chunk by chunk so memory stays flat
+        with MultipartFileStream(
+            file_path,
+            mime_type=mime_type,
+            chunk_size=chunk_size,
+            progress_callback=progress_callback,
+            throttle=throttle,
+            digest=digest
+        ) as body:
+            if self.sendfile is not None:
+                return self.post_sendfile(body, Path(file_path).name)
+            return self.post(body, body.content_type, Path(file_path).name)
+    
+    def upload_chunks(self, chunks, filename, mime_type=None, progress_callback=None,
+                      throttle=None, total=None):
+        # No length, so the body goes out with chunked transfer encoding
+        body = MultipartChunkStream(
+            chunks,
+            filename,
+            mime_type=mime_type,
+            progress_callback=progress_callback,
+            total=total,
+            throttle=throttle
+        )
+        return self.post(iter(body), body.content_type, filename)
+    
+    def resume_file(self, file_path, journal, chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None, source=None):
+        uploader = ResumableUploader(self.session_pool, self.resumable_url, journal, chunk_size=chunk_size)
+        return uploader.upload(file_path, progress_callback, throttle, digest, source)
+    
+    def part_target(self):
+        return TusPartTarget(self.session_pool, self.resumable_url, self.timeout)
+    
+    def parse_response(self, response, filename):
+        if response.status_code not in (200, 201):
+            return None, f"Upload failed: HTTP {response.status_code}"
+        
+        response_text = response.text.strip()
+        for line in response_text.split('\n'):
+            if line.startswith('http'):
+                return line.strip(), None
+        try:
+            return json.loads(response_text)['url'], None
+        except (ValueError, KeyError, TypeError):
+            return None, "Upload failed: no download URL in the response"
+    
+    def owns(self, download_url):
+        return urlparse(download_url).netloc == urlparse(self.upload_url).netloc
+    
+    def is_valid(self, download_url):
+        """Check that a previously returned download URL still serves"""
+        try:
+            response = self.session_pool.session().head(download_url, allow_redirects=True, timeout=30)
+            return response.status_code < 400 or response.status_code == 405
+        except requests.RequestException:
+            return False
+    
+    def delete(self, download_url):
+        response = self.session_pool.session().delete(download_url, timeout=30)
+        return response.status_code < 300 or response.status_code in (404, 410)
+    
+    def read_range(self, download_url, offset, length):
+        """Bytes of a ranged GET; raises RangeNotSupported once the server ignored Range"""
+        if self.accepts_ranges is False:
+            raise RangeNotSupported(f"{urlparse(download_url).netloc} does not serve byte ranges")
+        with self.session_pool.session().get(
+            download_url,
+            headers={'Range': f'bytes={offset}-{offset + length - 1}'},
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            if response.status_code == 416:
+                return b''
+            if response.status_code == 200:
+                # Range ignored: the body is the whole object, so leave it unread
+                self.accepts_ranges = False
+                raise RangeNotSupported(f"{urlparse(download_url).netloc} does not serve byte ranges")
+            if response.status_code != 206:
+                raise OSError(f"HTTP {response.status_code} reading {download_url}")
+            content_range = response.headers.get('Content-Range', '')
+            unit, _, spec = content_range.partition(' ')
+            if unit != 'bytes' or spec.partition('-')[0] != str(offset):
+                raise OSError(f"Range at {offset} of {download_url} answered with "
+                              f"Content-Range '{content_range}'")
+            self.accepts_ranges = True
+            return response.content
+    
+    def read_stream(self, download_url, chunk_size):
+        """The whole object in one streamed GET"""
+        with self.session_pool.session().get(download_url, stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise OSError(f"HTTP {response.status_code} reading {download_url}")
+            yield from response.iter_content(chunk_size)
+    
+    def object_size(self, download_url):
+        response = self.session_pool.session().head(download_url, allow_redirects=True, timeout=30,
+                                                    headers={'Accept-Encoding': 'identity'})
+        if response.status_code >= 400:
+            raise OSError(f"HTTP {response.status_code} reading {download_url}")
+        length = response.headers.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+
+class BashuploadBackend(HttpBackend):
+    """bashupload.com, the default public upload host"""
+    
+    name = 'bashupload'
+    # bashupload.com offers no way to delete an upload
+    can_delete = False
+    
+    def __init__(self, url='https://bashupload.com', session_pool=None, resumable_url=None, timeout=300):
+        super().__init__(url, session_pool, resumable_url, timeout)
+    
+    def describe(self):
+        return self.name
+    
+    def parse_response(self, response, filename):
+        if response.status_code != 200:
+            return None, f"Upload failed: HTTP {response.status_code}"
+        
+        # bashupload.com typically returns the URL directly
+        response_text = response.text.strip()
+        if response_text.startswith('http'):
+            return response_text, None
+        
+        # Try to extract URL from response
+        for line in response_text.split('\n'):
+            if line.startswith('http'):
+                return line.strip(), None
+        
+        return f"{self.upload_url}/{filename}", None
+    
+    def delete(self, download_url):
+        return False
+
+class StandinBackend(HttpBackend):
+    """HttpBackend against an in-process stand-in server
+    
+    The server (upload_standin) listens on a free loopback port and
+    stores objects in storage_dir (a temporary directory by default),
+    so uploads, resumable transfers and deletes work without any
+    network.  Meant for hermetic tests and offline benchmarks.
+    """
+    
+    name = 'local'
+    
+    def __init__(self, storage_dir=None, session_pool=None, timeout=300):
+        from upload_standin import UploadStandinServer
+        self.server = UploadStandinServer(('127.0.0.1', 0), storage_dir)
+        threading.Thread(target=self.server.serve_forever, name='mros-standin', daemon=True).start()
+        self.storage_dir = str(self.server.storage_dir)
+        super().__init__(self.server.url, session_pool, f'{self.server.url}/files', timeout)
+    
+    def describe(self):
+        return f'local:{self.storage_dir}'
+    
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FileSystemBackend(UploadBackend):
+    """Stores uploads in a local or mounted directory
+    
+    Download URLs are file:// URLs, or base_url plus the object name
+    when the directory is served by a web server (on-prem mirrors).
+    Large files resume from a partial file kept in .partial/; multi-part
+    transfers write their parts into one such file concurrently.
+    """
+    
+    name = 'file'
+    can_delete = True
+    
+    def __init__(self, directory, base_url=None):
+        self.directory = Path(directory).expanduser().resolve()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.base_url = base_url.rstrip('/') if base_url else None
+    
+    @property
+    def supports_resume(self):
+        return True
+    
+    @property
+    def supports_parts(self):
+        return True
+    
+    def describe(self):
+        return f'file://{self.directory}' + (f'#{self.base_url}' if self.base_url else '')
+    
+    def object_url(self, name):
+        if self.base_url:
+            return f'{self.base_url}/{name}'
+        return (self.directory / name).as_uri()
+    
+    def object_path(self, download_url):
+        """Local path of one of our URLs, None for foreign URLs"""
+        if self.base_url and download_url.startswith(self.base_url + '/'):
+            name = unquote(download_url[len(self.base_url) + 1:])
+        elif download_url.startswith('file://'):
+            path = Path(unquote(urlparse(download_url).path))
+            if path.parent != self.directory:
+                return None
+            name = path.name
+        else:
+            return None
+        if not name or '/' in name or name.startswith('.'):
+            return None
+        return self.directory / name
+    
+    def store(self, filename, write):
+        """Write a new object through write(file) and return its URL"""
+        name = f'{uuid.uuid4().hex[:8]}-{Path(filename).name}'
+        temp_path = self.directory / f'.{name}.part'
+        try:
+            with stage('send'), open(temp_path, 'wb') as f:
+                write(f)
+            os.replace(temp_path, self.directory / name)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+        return self.object_url(name)
+    
+    def upload_file(self, file_path, mime_type=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None):
+        file_path = Path(file_path)
+        size = file_path.stat().st_size
+        progress = ProgressTracker(file_path.name, size, progress_callback, filepath=str(file_path))
+        
+        def write(f):
+            if sendfile_supported():
+                with open(file_path, 'rb') as source:
+                    copy_file(source.fileno(), f.fileno(), size, throttle, progress, digest)
+                return
+            with FileSlice(file_path, 0, size, chunk_size, progress=progress, throttle=throttle,
+                           digest=digest) as piece:
+                while data := piece.read():
+                    f.write(data)
+        return self.store(file_path.name, write), None, None
+    
+    def upload_chunks(self, chunks, filename, mime_type=None, progress_callback=None,
+                      throttle=None, total=None):
+        progress = ProgressTracker(filename, total, progress_callback)
+        
+        def write(f):
+            for chunk in chunks:
+                if throttle:
+                    throttle(len(chunk))
+                progress.update(len(chunk))
+                f.write(chunk)
+            if progress.callback:
+                progress.report()
+        return self.store(filename, write), None, None
+    
+    def resume_file(self, file_path, journal, chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE,
+                    progress_callback=None, throttle=None, digest=None, source=None):
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        size = source.size if source else stat.st_size
+        identity = f'{file_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}' + (f':{source.identity}' if source else '')
+        key = hashlib.sha256(identity.encode()).hexdigest()[:32]
+        partial_dir = self.directory / '.partial'
+        partial_dir.mkdir(exist_ok=True)
+        partial_path = partial_dir / f'{key}.part'
+        
+        # Continue after the last whole chunk; a torn tail is rewritten
+        offset = 0
+        if partial_path.exists():
+            offset = min(partial_path.stat().st_size, size) // chunk_size * chunk_size
+        progress = ProgressTracker(file_path.name, size, progress_callback, filepath=str(file_path))
+        progress.bytes_sent = offset
+        if digest is not None:
+            digest.catch_up(file_path, offset, source=source)
+        
+        with open(partial_path, 'r+b' if offset else 'wb') as f:
+            f.truncate(offset)
+            f.seek(offset)
+            with FileSlice(file_path, offset, size - offset, chunk_size,
+                           progress=progress, throttle=throttle, digest=digest, source=source) as piece:
+                while data := piece.read():
+                    f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        
+        name = f'{key[:8]}-{source.name if source else file_path.name}'
+        os.replace(partial_path, self.directory / name)
+        return self.object_url(name)
+    
+    def part_target(self):
+        return FilePartTarget(self)
+    
+    def owns(self, download_url):
+        return self.object_path(download_url) is not None
+    
+    def is_valid(self, download_url):
+        path = self.object_path(download_url)
+        return path is not None and path.is_file()
+    
+    def delete(self, download_url):
+        path = self.object_path(download_url)
+        if path is None:
+            return False
+        path.unlink(missing_ok=True)
+        return True
+    
+    def read_range(self, download_url, offset, length):
+        path = self.object_path(download_url)
+        if path is None:
+            raise OSError(f"Not an upload of {self.describe()}: {download_url}")
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    
+    def object_size(self, download_url):
+        path = self.object_path(download_url)
+        if path is None:
+            raise OSError(f"Not an upload of {self.describe()}: {download_url}")
+        return path.stat().st_size
+
+def make_backend(spec=None, session_pool=None, resumable_url=None):
+    """Create a backend from a spec string
+    
+    'bashupload' (default), an http(s):// upload URL, 'local' or
+    'local:<dir>' for the in-process stand-in, and 'file://<dir>' or a
+    plain directory path, optionally followed by '#<base_url>'.
+    """
+    spec = (spec or 'bashupload').strip()
+    if spec == 'bashupload':
+        return BashuploadBackend(session_pool=session_pool, resumable_url=resumable_url)
+    if spec == 'local' or spec.startswith('local:'):
+        return StandinBackend(spec[6:] or None, session_pool)
+    if spec.startswith(('http://', 'https://')):
+        if urlparse(spec).netloc == 'bashupload.com':
+            return BashuploadBackend(spec, session_pool, resumable_url)
+        return HttpBackend(spec, session_pool, resumable_url)
+    
+    directory, _, base_url = spec.partition('#')
+    if directory.startswith('file://'):
+        directory = unquote(urlparse(directory).path)
+    if directory.startswith(('/', '~', '.')):
+        return FileSystemBackend(directory, base_url or None)
+    raise ValueError(f"Unknown upload backend: {spec}")
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Bandwidth
+Bandwidth governor: global and per-job byte rate caps, time-of-day schedules, pause/resume
+"""
+
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+from upload_engine import TokenBucket
+
+RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def parse_rate(text):
+    """Parse '2M', '500k', '1.5MB/s' or '0'/'unlimited' into bytes per second (0 = no cap)"""
+    if text is None:
+        return 0
+    if isinstance(text, (int, float)):
+        return max(0, int(text))
+    text = text.strip().lower()
+    if text in ('', 'off', 'none', 'unlimited'):
+        return 0
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s|ps)?', text)
+    if not match:
+        raise ValueError(f"Invalid rate: {text}")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+def format_rate(rate):
+    if not rate:
+        return "unlimited"
+    for unit, size in (('G', 1024 ** 3), ('M', 1024 ** 2), ('K', 1024)):
+        if rate >= size:
+            return f"{rate / size:g}{unit}"
+    return str(int(rate))
+
+def parse_days(text):
+    """'mon-fri' or 'sat,sun' into a set of weekday numbers"""
+    days = set()
+    for part in text.split(','):
+        first, _, last = part.partition('-')
+        start = DAY_NAMES.index(first[:3])
+        end = DAY_NAMES.index(last[:3]) if last else start
+        days.update(day % 7 for day in range(start, end + 1 if end >= start else end + 8))
+    return days
+
+def parse_time(text):
+    hours, _, minutes = text.partition(':')
+    value = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= value <= 24 * 60:
+        raise ValueError(f"Invalid time: {text}")
+    return value
+
+class BandwidthSchedule:
+    """Time-of-day rate windows
+    
+    The spec is a semicolon separated list of '[days ]HH:MM-HH:MM=RATE'
+    windows, e.g. 'mon-fri 09:00-18:00=2M; sat,sun 10:00-16:00=5M'.  The first
+    matching window wins; outside every window uploads are unlimited.
+    """
+    
+    def __init__(self, spec=''):
+        self.spec = (spec or '').strip()
+        self.windows = []
+        for entry in filter(None, (part.strip() for part in self.spec.split(';'))):
+            try:
+                when, _, rate = entry.rpartition('=')
+                days, _, span = when.strip().rpartition(' ')
+                start, _, end = span.partition('-')
+                self.windows.append((
+                    parse_days(days.strip().lower()) if days.strip() else set(range(7)),
+                    parse_time(start),
+                    parse_time(end),
+                    parse_rate(rate)
+                ))
+            except (ValueError, IndexError):
+                raise ValueError(f"Invalid schedule window: {entry}")
+    
+    def rate_at(self, moment=None):
+        """Rate cap at the given datetime (bytes/s, 0 = unlimited)"""
+        moment = moment or datetime.now()
+        minute = moment.hour * 60 + moment.minute
+        weekday = moment.weekday()
+        for days, start, end, rate in self.windows:
+            if start <= end:
+                if weekday in days and start <= minute < end:
+                    return rate
+            # Window crossing midnight belongs to the day it starts on
+            elif (weekday in days and minute >= start) or ((weekday - 1) % 7 in days and minute < end):
+                return rate
+        return 0
+    
+    def __bool__(self):
+        return bool(self.windows)
+
+class BandwidthGovernor:
+    """Caps the upload byte rate of every sender in the process
+    
+    Senders call throttle(nbytes) (or await athrottle) before writing a
+    chunk.  The global cap is the lower of the configured limit and the
+    current schedule window; a per-job bucket can lower it further for
+    one batch.  Limit, schedule and the paused flag live in a small JSON
+    settings file that is re-read when it changes, so the Upload Manager
+    can pause or re-limit the daemon and any CLI upload that is running.
+    Explicit constructor arguments override the file.
+    """
+    
+    def __init__(self, settings_file=None, limit=None, schedule=None, poll_interval=1.0):
+        self.settings_file = str(settings_file) if settings_file else None
+        self.override_limit = parse_rate(limit) if limit is not None else None
+        self.override_schedule = BandwidthSchedule(schedule) if schedule is not None else None
+        self.poll_interval = poll_interval
+        self.limit = 0
+        self.schedule = BandwidthSchedule()
+        self.paused = False
+        self.rate = 0
+        self.bucket = TokenBucket(0)
+        self.job_buckets = OrderedDict()
+        self.lock = threading.Lock()
+        self.resumed = threading.Condition(self.lock)
+        self.settings_mtime = None
+        self.next_check = 0.0
+        self.refresh(force=True)
+    
+    # Settings
+    
+    def load_settings(self):
+        if not self.settings_file:
+            return {}
+        try:
+            with open(self.settings_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save_settings(self, **changes):
+        """Merge changes into the settings file, atomically"""
+        settings = self.load_settings()
+        settings.update(changes)
+        if self.settings_file:
+            temp_file = f"{self.settings_file}.tmp"
+            with open(temp_file, 'w') as f:
+                json.dump(settings, f, indent=2)
+            os.replace(temp_file, self.settings_file)
+        self.refresh(force=True, settings=settings)
+    
+    def refresh(self, force=False, settings=None):
+        """Re-read changed settings and apply the current schedule window
+        
+        Without force this happens at most once per poll_interval; the
+        check itself is a single stat() of the settings file.
+        """
+        now = time.monotonic()
+        if not force and now < self.next_check:
+            return
+        with self.lock:
+            self.next_check = now + self.poll_interval
+            if settings is None and self.settings_file:
+                try:
+                    mtime = os.stat(self.settings_file).st_mtime_ns
+                except OSError:
+                    mtime = None
+                if mtime != self.settings_mtime:
+                    self.settings_mtime = mtime
+                    settings = self.load_settings()
+            
+            if settings is not None:
+                self.paused = bool(settings.get('paused', False))
+                try:
+                    self.limit = parse_rate(settings.get('limit'))
+                    self.schedule = BandwidthSchedule(settings.get('schedule'))
+                except ValueError as e:
+                    print(f"Ignoring bandwidth settings: {e}")
+            
+            limit = self.limit if self.override_limit is None else self.override_limit
+            schedule = self.schedule if self.override_schedule is None else self.override_schedule
+            rates = [rate for rate in (limit, schedule.rate_at()) if rate]
+            rate = min(rates) if rates else 0
+            if rate != self.rate:
+                self.rate = rate
+                # A quarter second of burst keeps the cap smooth
+                self.bucket.set_rate(rate, rate / 4 if rate else None)
+            if not self.paused:
+                self.resumed.notify_all()
+    
+    def pause(self):
+        self.save_settings(paused=True)
+    
+    def resume(self):
+        self.save_settings(paused=False)
+    
+    def set_limit(self, limit):
+        self.save_settings(limit=parse_rate(limit))
+    
+    def set_schedule(self, spec):
+        BandwidthSchedule(spec)  # validate before saving
+        self.save_settings(schedule=spec or '')
+    
+    def state(self):
+        self.refresh()
+        return {
+            'paused': self.paused,
+            'limit': self.limit,
+            'schedule': self.schedule.spec,
+            'rate': self.rate
+        }
+    
+    # Senders
+    
+    def job_bucket(self, key, limit):
+        """Shared bucket for all transfers of one job (None without a cap)"""
+        rate = parse_rate(limit)
+        if not rate:
+            return None
+        with self.lock:
+            bucket = self.job_buckets.pop(key, None)
+            if bucket is None or bucket.rate != rate:
+                bucket = TokenBucket(rate, rate / 4)
+            self.job_buckets[key] = bucket
+            while len(self.job_buckets) > 64:
+                self.job_buckets.popitem(last=False)
+        return bucket
+    
+    def reserve(self, nbytes, job_bucket=None):
+        """Take nbytes from the budgets; seconds to wait, or None while paused"""
+        self.refresh()
+        if self.paused:
+            return None
+        delay = self.bucket.reserve(nbytes)
+        if job_bucket is not None:
+            delay = max(delay, job_bucket.reserve(nbytes))
+        return delay
+    
+    def wait_resumed(self):
+        """Block while uploads are paused"""
+        while True:
+            self.refresh(force=True)
+            with self.lock:
+                if not self.paused:
+                    return
+                self.resumed.wait(self.poll_interval)
+    
+    def throttle(self, nbytes, job_bucket=None):
+        """Block until nbytes may be sent"""
+        while True:
+            delay = self.reserve(nbytes, job_bucket)
+            if delay is not None:
+                break
+            self.wait_resumed()
+        if delay > 0:
+            time.sleep(delay)
+    
+    async def athrottle(self, nbytes, job_bucket=None):
+        """Coroutine version of throttle for the asyncio service"""
+        while (delay := self.reserve(nbytes, job_bucket)) is None:
+            await asyncio.sleep(self.poll_interval)
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    def throttler(self, job_bucket=None):
+        """throttle bound to a job bucket, for the body streams"""
+        return lambda nbytes: self.throttle(nbytes, job_bucket)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Benchmark
+Reproducible upload throughput benchmarks against a local stand-in server
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import resource
+import platform
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from pathlib import Path
+
+from upload_standin import UploadStandinServer
+
+SERVICE_SCRIPT = Path(__file__).resolve().with_name('upload-service.py')
+MB = 1024 * 1024
+
+def corpus_files(name, scale):
+    """(relative path, size) of every file in a synthetic corpus"""
+    rng = random.Random(f'{name}-{scale}')
+    if name == 'tiny':
+        return [(f'{i // 250:02d}/tiny-{i:05d}.txt', 1024) for i in range(max(1, int(2000 * scale)))]
+    if name == 'huge':
+        return [(f'huge-{i}.bin', max(MB, int(64 * MB * scale))) for i in range(3)]
+    if name == 'mixed':
+        # Log-normal sizes around 32 KB, a long tail up to 16 MB
+        return [
+            (f'{i // 50:02d}/mixed-{i:04d}.dat',
+             max(1, min(16 * MB, int(rng.lognormvariate(math.log(32 * 1024), 2.0) * scale))))
+            for i in range(max(1, int(400 * scale)))
+        ]
+    raise ValueError(f"Unknown corpus: {name}")
+
+def build_corpus(root, name, scale):
+    """Create the corpus under root once; later runs reuse it"""
+    directory = Path(root) / f'{name}-{scale:g}'
+    marker = directory / '.complete'
+    if marker.exists():
+        return directory
+    
+    shutil.rmtree(directory, ignore_errors=True)
+    rng = random.Random(f'{name}-{scale}-content')
+    for relative_path, size in corpus_files(name, scale):
+        path = directory / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'wb') as f:
+            # Random bytes, so compression and dedup cannot skew results
+            remaining = size
+            while remaining > 0:
+                block = min(remaining, 4 * MB)
+                f.write(rng.randbytes(block))
+                remaining -= block
+    marker.touch()
+    return directory
+
+# Scenarios: which service call runs over which corpus
+SCENARIOS = {
+    'file-huge': {'corpus': 'huge', 'call': 'upload_file'},
+    'files-tiny': {'corpus': 'tiny', 'call': 'upload_multiple_files'},
+    'files-mixed': {'corpus': 'mixed', 'call': 'upload_multiple_files'},
+    'folder-mixed': {'corpus': 'mixed', 'call': 'upload_folder'},
+    'folder-tiny-packed': {'corpus': 'tiny', 'call': 'upload_folder', 'pack': 'tar'}
+}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def load_service_class():
+    spec = importlib.util.spec_from_file_location('upload_service', SERVICE_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.MrosUploadService
+
+def run_scenario(settings):
+    """Run one scenario in this process and return its measurements
+    
+    Called in a fresh child process (with its own HOME) so that peak
+    RSS, CPU time and the service's databases belong to this run only.
+    """
+    scenario = SCENARIOS[settings['scenario']]
+    corpus = Path(settings['corpus'])
+    files = sorted(p for p in corpus.rglob('*') if p.is_file() and p.name != '.complete')
+    
+    service = load_service_class()(
+        max_workers=settings['workers'],
+        per_host_limit=settings['workers'],
+        requests_per_second=settings['rate'],
+        backend=settings['url'],
+        resumable_url=settings['resumable_url'],
+        dedup=False,
+        compression=settings['compression']
+    )
+    # Injected errors should cost retries, not minutes of backoff
+    service.queue.backoff_base = settings['backoff']
+    service.queue.backoff_cap = settings['backoff'] * 8
+    
+    latencies = []
+    upload_file = service.upload_file
+    
+    def timed_upload_file(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return upload_file(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - started)
+    service.upload_file = timed_upload_file
+    
+    cpu_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.perf_counter()
+    if scenario['call'] == 'upload_file':
+        results = [service.upload_file(path, show_progress=False) for path in files]
+    elif scenario['call'] == 'upload_multiple_files':
+        results = service.upload_multiple_files(files, show_progress=False)
+    else:
+        results = service.upload_folder(corpus, show_progress=False, pack=scenario.get('pack'))
+    elapsed = time.perf_counter() - started
+    cpu_after = resource.getrusage(resource.RUSAGE_SELF)
+    service.flush_notifications(timeout=1)
+    
+    if scenario.get('pack'):
+        # One request for the whole folder; its latency is the run time
+        latencies = [elapsed]
+    total_bytes = sum(path.stat().st_size for path in files)
+    return {
+        'scenario': settings['scenario'],
+        'call': scenario['call'],
+        'files': len(files),
+        'bytes': total_bytes,
+        'failed': sum(1 for r in results if not r['success']),
+        'seconds': round(elapsed, 4),
+        'files_per_s': round(len(files) / elapsed, 2),
+        'mb_per_s': round(total_bytes / MB / elapsed, 2),
+        'latency_p50': round(percentile(latencies, 0.50), 5),
+        'latency_p99': round(percentile(latencies, 0.99), 5),
+        'requests': len(latencies),
+        'peak_rss_kb': cpu_after.ru_maxrss,
+        'cpu_user': round(cpu_after.ru_utime - cpu_before.ru_utime, 3),
+        'cpu_system': round(cpu_after.ru_stime - cpu_before.ru_stime, 3)
+    }
+
+def run_child(settings):
+    """Run a scenario in a child process with a throwaway HOME"""
+    with tempfile.TemporaryDirectory(prefix='mros-bench-home-') as home:
+        env = dict(os.environ, HOME=home, XDG_RUNTIME_DIR='')
+        completed = subprocess.run(
+            [sys.executable, __file__, '--child', json.dumps(settings)],
+            env=env,
+            capture_output=True,
+            text=True
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(f"{settings['scenario']} failed:\n{completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=Path(__file__).parent, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+def run_benchmarks(scenarios, corpus_dir, scale=1.0, repeat=1, workers=4, rate=0, compression=None,
+                   latency=0.0, bandwidth=0, error_rate=0.0, backoff=0.05, seed=1, log=print):
+    """Start the stand-in, run every scenario repeat times, return the report dict"""
+    server = UploadStandinServer(
+        ('127.0.0.1', 0),
+        tempfile.mkdtemp(prefix='mros-bench-sink-'),
+        latency=latency,
+        bandwidth=bandwidth,
+        error_rate=error_rate,
+        discard=True,
+        seed=seed
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    
+    report = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'settings': {
+            'scale': scale, 'repeat': repeat, 'workers': workers, 'rate': rate,
+            'compression': compression, 'latency': latency, 'bandwidth': bandwidth,
+            'error_rate': error_rate, 'seed': seed
+        },
+        'results': []
+    }
+    try:
+        for name in scenarios:
+            corpus = build_corpus(corpus_dir, SCENARIOS[name]['corpus'], scale)
+            for run in range(repeat):
+                result = run_child({
+                    'scenario': name,
+                    'corpus': str(corpus),
+                    'url': server.url,
+                    'resumable_url': f'{server.url}/files',
+                    'workers': workers,
+                    'rate': rate,
+                    'compression': compression,
+                    'backoff': backoff
+                })
+                result['run'] = run
+                report['results'].append(result)
+                log(format_result(result))
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(server.storage_dir, ignore_errors=True)
+    return report
+
+def format_result(result):
+    return (f"{result['scenario']:<20} {result['files']:>6} files {result['mb_per_s']:>9.2f} MB/s "
+            f"{result['files_per_s']:>9.1f} files/s  p50 {result['latency_p50'] * 1000:>8.1f} ms  "
+            f"p99 {result['latency_p99'] * 1000:>8.1f} ms  rss {result['peak_rss_kb'] / 1024:>6.1f} MB  "
+            f"cpu {result['cpu_user'] + result['cpu_system']:>6.2f} s"
+            + (f"  {result['failed']} failed" if result['failed'] else ''))
+
+def summarize(report):
+    """Median of the repeated runs per scenario"""
+    by_scenario = {}
+    for result in report['results']:
+        by_scenario.setdefault(result['scenario'], []).append(result)
+    return {
+        name: {key: percentile([r[key] for r in runs], 0.5)
+               for key in ('seconds', 'files_per_s', 'mb_per_s', 'latency_p50', 'latency_p99',
+                           'peak_rss_kb', 'cpu_user', 'cpu_system')}
+        for name, runs in by_scenario.items()
+    }
+
+def compare(baseline, report):
+    """Print the change of every metric against a baseline report"""
+    old, new = summarize(baseline), summarize(report)
+    print(f"Compared with {baseline.get('revision') or 'baseline'} ({baseline.get('created')}):")
+    for name in new:
+        if name not in old:
+            continue
+        changes = []
+        for key, value in new[name].items():
+            before = old[name][key]
+            if before:
+                changes.append(f"{key} {(value - before) / before * 100:+.1f}%")
+        print(f"  {name:<20} " + ', '.join(changes))
+
+def main():
+    args = sys.argv[1:]
+    if args[:1] == ['--child']:
+        print(json.dumps(run_scenario(json.loads(args[1]))))
+        return
+    
+    if '--help' in args or '-h' in args:
+        print("Usage: upload_bench.py [options] [scenario ...]")
+        print("")
+        print(f"Scenarios: {', '.join(SCENARIOS)} (default: all)")
+        print("")
+        print("Options:")
+        print("  --scale <f>       Corpus size factor (default: 1.0)")
+        print("  --repeat <n>      Runs per scenario, the report keeps all of them (default: 1)")
+        print("  --workers <n>     Concurrent uploads (default: 4)")
+        print("  --rate <n>        Requests started per second, 0 = unlimited (default: 0)")
+        print("  --compress <codec>  Compression policy passed to the service")
+        print("  --latency <s>     Stand-in delay per upload request (default: 0)")
+        print("  --bandwidth <n>   Stand-in read rate per request in bytes/s (default: unlimited)")
+        print("  --error-rate <f>  Share of uploads the stand-in fails with 503 (default: 0)")
+        print("  --corpus-dir <dir>  Where synthetic corpora are kept (default: ~/.cache/mros-upload-bench)")
+        print("  --output <file>   Write the JSON report to file")
+        print("  --compare <file>  Print changes against an earlier JSON report")
+        return
+    
+    def option(name, default, cast=str):
+        if name not in args:
+            return default
+        index = args.index(name)
+        value = cast(args[index + 1])
+        del args[index:index + 2]
+        return value
+    
+    scale = option('--scale', 1.0, float)
+    repeat = option('--repeat', 1, int)
+    workers = option('--workers', 4, int)
+    rate = option('--rate', 0.0, float)
+    compression = option('--compress', None)
+    latency = option('--latency', 0.0, float)
+    bandwidth = option('--bandwidth', 0, int)
+    error_rate = option('--error-rate', 0.0, float)
+    corpus_dir = option('--corpus-dir', str(Path.home() / '.cache' / 'mros-upload-bench'))
+    output = option('--output', None)
+    baseline = option('--compare', None)
+    
+    scenarios = args or list(SCENARIOS)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Error: unknown scenario: {', '.join(unknown)}")
+        sys.exit(1)
+    
+    report = run_benchmarks(
+        scenarios, corpus_dir, scale=scale, repeat=repeat, workers=workers, rate=rate,
+        compression=compression, latency=latency, bandwidth=bandwidth, error_rate=error_rate
+    )
+    
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+    if baseline:
+        with open(baseline) as f:
+            compare(json.load(f), report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Client
+Thin client for the upload daemon; only uses the standard library so it starts fast
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import subprocess
+from pathlib import Path
+
+from upload_records import print_results
+
+SERVICE_SCRIPT = Path(__file__).resolve().with_name('upload-service.py')
+
+# Events that end the reply to a request
+TERMINAL_EVENTS = ('done', 'queued', 'pong', 'history', 'status', 'metrics', 'ok', 'error')
+
+def default_socket_path():
+    """Per-user daemon socket, in the runtime dir when there is one"""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return Path(runtime_dir) / 'mros-upload.sock'
+    return Path.home() / '.config' / 'mros-upload' / 'daemon.sock'
+
+class DaemonUnavailable(Exception):
+    """Raised when the upload daemon cannot be reached or started"""
+
+class UploadClient:
+    """Talks newline-delimited JSON to the upload daemon
+    
+    Every request opens its own connection; upload replies stream
+    'progress' and 'result' events before the final 'done'.
+    """
+    
+    def __init__(self, socket_path=None, timeout=5):
+        self.socket_path = str(socket_path or default_socket_path())
+        self.timeout = timeout
+    
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailable(f"Upload daemon not reachable at {self.socket_path}: {e}")
+        return sock
+    
+    def request(self, message, on_event=None):
+        """Send one request and return its terminal event"""
+        with self.connect() as sock:
+            sock.sendall(json.dumps(message).encode() + b'\n')
+            # Uploads may take arbitrarily long between events
+            sock.settimeout(None)
+            with sock.makefile('rb') as reader:
+                for line in reader:
+                    event = json.loads(line)
+                    if on_event and event['event'] not in TERMINAL_EVENTS:
+                        on_event(event)
+                    if event['event'] in TERMINAL_EVENTS:
+                        if event['event'] == 'error':
+                            raise RuntimeError(event['error'])
+                        return event
+        raise DaemonUnavailable("Upload daemon closed the connection")
+    
+    def ping(self):
+        try:
+            return self.request({'op': 'ping'})
+        except (DaemonUnavailable, OSError, ValueError):
+            return None
+    
+    def history(self, limit=50):
+        return self.request({'op': 'history', 'limit': limit})['records']
+    
+    def query_history(self, limit=50, cursor=None, **filters):
+        """One page of matching history records and the next page's cursor"""
+        reply = self.request({'op': 'history', 'limit': limit, 'cursor': cursor, 'filters': filters})
+        return reply['records'], reply['cursor']
+    
+    def clear_history(self):
+        self.request({'op': 'clear_history'})
+    
+    def status(self):
+        return self.request({'op': 'status'})['jobs']
+    
+    def metrics(self):
+        """Prometheus text and a JSON snapshot of the daemon's metrics"""
+        reply = self.request({'op': 'metrics'})
+        return reply['text'], reply['snapshot']
+    
+    def cancel(self, job_id):
+        self.request({'op': 'cancel', 'job': job_id})
+    
+    def shutdown(self):
+        self.request({'op': 'shutdown'})
+    
+    def upload_message(self, files=None, folder=None, show_progress=True, progress_callback=None,
+                       wait=True, **options):
+        message = {
+            'op': 'upload',
+            'show_progress': show_progress,
+            'progress': progress_callback is not None,
+            'wait': wait,
+            'options': options
+        }
+        if folder is not None:
+            message['folder'] = os.path.abspath(folder)
+        else:
+            message['files'] = [os.path.abspath(f) for f in files]
+        return message
+    
+    def handle_upload_event(self, event, progress_callback, on_result):
+        if event['event'] == 'progress' and progress_callback:
+            progress_callback(event['progress'])
+        elif event['event'] == 'result' and on_result:
+            on_result(event['index'], event['item'], event['result'])
+    
+    def upload_files(self, files, show_progress=True, progress_callback=None, on_result=None,
+                     wait=True, **options):
+        """Queue files on the daemon; returns the results in input order
+        
+        With wait=False the call returns the job id as soon as the job
+        is queued and the daemon carries on by itself.
+        """
+        return self.submit(
+            self.upload_message(files, None, show_progress, progress_callback, wait, **options),
+            progress_callback, on_result
+        )
+    
+    def upload_folder(self, folder, show_progress=True, progress_callback=None, on_result=None,
+                      wait=True, include=None, exclude=None, pack=None, priority=0, limit=None,
+                      backend=None):
+        """Queue a folder upload on the daemon, see upload_files"""
+        return self.submit(
+            self.upload_message(None, folder, show_progress, progress_callback, wait,
+                                include=include, exclude=exclude, pack=pack, priority=priority,
+                                limit=limit, backend=backend),
+            progress_callback, on_result
+        )
+    
+    def submit(self, message, progress_callback, on_result):
+        event = self.request(
+            message,
+            lambda event: self.handle_upload_event(event, progress_callback, on_result)
+        )
+        return event['results'] if event['event'] == 'done' else event['job']
+    
+    # asyncio variants for callers running an event loop (Upload Manager)
+    
+    async def async_submit(self, message, progress_callback=None, on_result=None):
+        """Like submit; cancelling the awaiting task cancels the daemon job"""
+        try:
+            reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        except OSError as e:
+            raise DaemonUnavailable(f"Upload daemon not reachable at {self.socket_path}: {e}")
+        
+        job_id = None
+        try:
+            writer.write(json.dumps(message).encode() + b'\n')
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    raise DaemonUnavailable("Upload daemon closed the connection")
+                event = json.loads(line)
+                if event['event'] == 'accepted':
+                    job_id = event['job']
+                elif event['event'] == 'error':
+                    raise RuntimeError(event['error'])
+                elif event['event'] == 'done':
+                    job_id = None
+                    return event['results']
+                elif event['event'] == 'queued':
+                    job_id = None
+                    return event['job']
+                else:
+                    self.handle_upload_event(event, progress_callback, on_result)
+        except asyncio.CancelledError:
+            if job_id is not None:
+                await asyncio.get_running_loop().run_in_executor(None, self.cancel, job_id)
+            raise
+        finally:
+            writer.close()
+    
+    async def async_upload_files(self, files, show_progress=True, progress_callback=None,
+                                 on_result=None, **options):
+        return await self.async_submit(
+            self.upload_message(files, None, show_progress, progress_callback, True, **options),
+            progress_callback, on_result
+        )
+    
+    async def async_upload_folder(self, folder, show_progress=True, progress_callback=None,
+                                  on_result=None, include=None, exclude=None, pack=None, priority=0,
+                                  limit=None, backend=None):
+        return await self.async_submit(
+            self.upload_message(None, folder, show_progress, progress_callback, True,
+                                include=include, exclude=exclude, pack=pack, priority=priority,
+                                limit=limit, backend=backend),
+            progress_callback, on_result
+        )
+
+def ensure_daemon(socket_path=None, timeout=10, idle_timeout=600, daemon_args=()):
+    """Return a client for a running daemon, starting one if needed"""
+    client = UploadClient(socket_path)
+    if client.ping():
+        return client
+    
+    subprocess.Popen(
+        [sys.executable, str(SERVICE_SCRIPT), '--daemon',
+         '--socket', client.socket_path, '--idle-timeout', str(idle_timeout), *daemon_args],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        if client.ping():
+            return client
+    raise DaemonUnavailable("Upload daemon did not start")
+
+# Options that change how the service itself is configured run in-process
+IN_PROCESS_OPTIONS = (
+    '--no-daemon', '--daemon', '--workers', '--per-host', '--rate', '--pool-size',
+    '--resumable-url', '--no-dedup', '--compress', '--queue', '--resume', '--retry', '--bandwidth',
+    '--delete', '--verify', '--parts', '--part-size', '--encrypt', '--key', '--keys',
+    '--keygen', '--decrypt', '--fetch', '--metrics', '--metrics-file', '--trace-log', '--status', '--since',
+    '--until', '--min-size', '--max-size', '--type', '--name', '--search', '--page-size', '--after', '--report',
+    '--manifest', '--replay', '--watch', '--debounce', '--poll', '--help', '-h'
+)
+
+def run_in_process(args):
+    """Hand the command line to the full upload service"""
+    args = [a for a in args if a != '--no-daemon']
+    os.execv(sys.executable, [sys.executable, str(SERVICE_SCRIPT)] + args)
+
+def main():
+    """mros-upload-service entry point: submit to the daemon when possible"""
+    args = sys.argv[1:]
+    if not args or any(a in IN_PROCESS_OPTIONS for a in args):
+        run_in_process(args)
+    
+    try:
+        client = ensure_daemon()
+    except DaemonUnavailable:
+        run_in_process(args)
+    
+    def pop_values(name):
+        values = []
+        while name in args:
+            index = args.index(name)
+            if index + 1 >= len(args):
+                print(f"Error: {name} requires a value")
+                sys.exit(1)
+            values.append(args[index + 1])
+            del args[index:index + 2]
+        return values
+    
+    include = pop_values('--include')
+    exclude = pop_values('--exclude')
+    pack = (pop_values('--pack') or [None])[-1]
+    priority = int((pop_values('--priority') or [0])[-1])
+    limit = (pop_values('--limit') or [None])[-1]
+    backend = (pop_values('--backend') or [None])[-1]
+    if backend and backend.startswith(('.', '~')):
+        # Directory backends are resolved by the daemon, not in our cwd
+        backend = os.path.abspath(os.path.expanduser(backend))
+    
+    if not args:
+        run_in_process(sys.argv[1:])
+    
+    if args[0] == '--history':
+        history = client.history()
+        if history:
+            print("Upload History:")
+            print("-" * 80)
+            for item in history:
+                status = "✓" if item['status'] == 'completed' else "✗"
+                print(f"{status} {item['filename']} - {item.get('download_url', 'N/A')}")
+        else:
+            print("No upload history found.")
+    
+    elif args[0] == '--clear-history':
+        client.clear_history()
+        print("Upload history cleared.")
+    
+    elif args[0] == '--folder':
+        if len(args) < 2:
+            print("Error: Please specify folder path")
+            sys.exit(1)
+        
+        print(f"Uploading folder: {args[1]}")
+        print_results(client.upload_folder(args[1], include=include, exclude=exclude, pack=pack,
+                                           priority=priority, limit=limit, backend=backend))
+    
+    else:
+        print(f"Uploading {len(args)} file(s)...")
+        print_results(client.upload_files(args, priority=priority, limit=limit, backend=backend))
+
+if __name__ == '__main__':
+    main()
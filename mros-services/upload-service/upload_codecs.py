@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Codecs
+Streaming compressors shared by archive packing and upload compression
+"""
+
+import math
+import zlib
+import lzma
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# File extension and Content-Encoding token for every codec
+CODECS = {
+    'gzip': {'extension': '.gz', 'encoding': 'gzip', 'mime_type': 'application/gzip'},
+    'xz': {'extension': '.xz', 'encoding': 'xz', 'mime_type': 'application/x-xz'},
+    'zstd': {'extension': '.zst', 'encoding': 'zstd', 'mime_type': 'application/zstd'},
+}
+
+def available_codecs():
+    """Codecs usable in this environment, best first"""
+    codecs = ['gzip', 'xz']
+    if zstandard is not None:
+        codecs.insert(0, 'zstd')
+    return codecs
+
+def check_codec(codec):
+    """Raise ValueError unless codec is known and usable here"""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+    if codec not in available_codecs():
+        raise ValueError(f"{codec} compression requires the zstandard module (python3-zstandard)")
+
+class Compressor:
+    """Uniform compress()/flush() wrapper around the stdlib and zstandard"""
+    
+    def __init__(self, codec, level=None):
+        check_codec(codec)
+        self.codec = codec
+        
+        if codec == 'gzip':
+            self.compressor = zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+        elif codec == 'xz':
+            self.compressor = lzma.LZMACompressor(preset=6 if level is None else level)
+        else:
+            context = zstandard.ZstdCompressor(level=3 if level is None else level)
+            self.compressor = context.compressobj()
+    
+    def compress(self, data):
+        return self.compressor.compress(data)
+    
+    def flush(self):
+        return self.compressor.flush()
+
+class Decompressor:
+    """Streaming counterpart of Compressor, used to verify compressed uploads"""
+    
+    def __init__(self, codec):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec: {codec}")
+        if codec == 'gzip':
+            self.decompressor = zlib.decompressobj(31)
+        elif codec == 'xz':
+            self.decompressor = lzma.LZMADecompressor()
+        else:
+            if zstandard is None:
+                raise ValueError("zstd decompression requires the zstandard module (python3-zstandard)")
+            self.decompressor = zstandard.ZstdDecompressor().decompressobj()
+    
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+# MIME types whose payload is already compressed
+COMPRESSED_MIME_TYPES = {
+    'application/zip', 'application/gzip', 'application/x-gzip', 'application/x-xz',
+    'application/zstd', 'application/x-bzip2', 'application/x-7z-compressed',
+    'application/x-rar-compressed', 'application/vnd.rar', 'application/x-iso9660-image',
+    'application/pdf', 'application/java-archive', 'application/vnd.debian.binary-package',
+    'application/x-rpm', 'application/epub+zip',
+}
+COMPRESSED_MIME_PREFIXES = ('image/', 'video/', 'audio/', 'font/woff')
+UNCOMPRESSED_MEDIA = {'image/bmp', 'image/svg+xml', 'image/x-ms-bmp', 'audio/x-wav', 'audio/wav', 'image/tiff'}
+
+# MIME types known to compress well
+TEXT_MIME_TYPES = {
+    'application/json', 'application/xml', 'application/javascript', 'application/x-sh',
+    'application/x-yaml', 'application/yaml', 'application/sql', 'application/x-tar',
+    'application/x-ndjson', 'application/toml',
+}
+
+def sample_entropy(data):
+    """Shannon entropy of a byte sample in bits per byte (0-8)"""
+    if not data:
+        return 0.0
+    counts = [0] * 256
+    for byte in data:
+        counts[byte] += 1
+    total = len(data)
+    entropy = 0.0
+    for count in counts:
+        if count:
+            p = count / total
+            entropy -= p * math.log2(p)
+    return entropy
+
+def choose_codec(mime_type, sample, file_size=0, preferred='auto'):
+    """Pick a codec for an upload, or None when compression will not pay off
+    
+    Already-compressed formats and high-entropy samples are skipped.  Very
+    redundant data gets xz (best ratio for a constrained uplink), anything
+    else zstd when available, falling back to gzip.  An explicit codec is
+    always used; ValueError if it is unknown or unavailable.
+    """
+    if not preferred or preferred == 'none':
+        return None
+    if preferred != 'auto':
+        check_codec(preferred)
+        return preferred
+    
+    mime_type = (mime_type or '').lower()
+    if mime_type in COMPRESSED_MIME_TYPES:
+        return None
+    if mime_type.startswith(COMPRESSED_MIME_PREFIXES) and mime_type not in UNCOMPRESSED_MEDIA:
+        return None
+    
+    entropy = sample_entropy(sample[:65536])
+    is_text = mime_type.startswith('text/') or mime_type in TEXT_MIME_TYPES
+    if entropy > 7.5 or (not is_text and entropy > 6.5):
+        return None
+    
+    codecs = available_codecs()
+    if entropy < 3.0 and file_size < 64 * 1024 * 1024:
+        return 'xz'
+    return codecs[0]
+
+def compressed_chunks(file_path, codec, chunk_size=256 * 1024, progress=None, stats=None, digest=None):
+    """Yield the compressed contents of a file one chunk at a time
+    
+    progress is a ProgressTracker fed with uncompressed bytes read; stats,
+    if given, receives bytes_in, bytes_out and the seconds spent in the
+    compressor once the file is done.  digest hashes the uncompressed
+    bytes, so it identifies the file rather than the compressed object.
+    """
+    compressor = Compressor(codec)
+    bytes_in = 0
+    bytes_out = 0
+    seconds = 0.0
+    with open(file_path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            if digest is not None:
+                digest.update(data)
+            bytes_in += len(data)
+            if progress is not None:
+                progress.update(len(data))
+            started = time.perf_counter()
+            out = compressor.compress(data)
+            seconds += time.perf_counter() - started
+            if out:
+                bytes_out += len(out)
+                yield out
+    started = time.perf_counter()
+    out = compressor.flush()
+    seconds += time.perf_counter() - started
+    if out:
+        bytes_out += len(out)
+        yield out
+    if stats is not None:
+        stats.update({'bytes_in': bytes_in, 'bytes_out': bytes_out, 'seconds': seconds})
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Crypto
+Client-side streaming encryption: chunked AES-256-GCM, key store and streaming decryption
+"""
+
+import os
+import hmac
+import json
+import base64
+import struct
+import hashlib
+import time
+from pathlib import Path
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+# File format: header, then chunks sealed one by one
+#   header = MAGIC | key id (8) | salt (16) | plaintext chunk size (4, big endian)
+#   chunk i = AES-256-GCM(file key, nonce = i (11 bytes) | last flag (1), plaintext, aad = header)
+# Every chunk but the last holds chunk size bytes of plaintext; the last
+# one may be empty.  The flag makes truncation at a chunk boundary
+# detectable and the file key is derived from the master key and salt.
+MAGIC = b'MROSENC\x01'
+CIPHER = 'aes-256-gcm'
+HEADER = struct.Struct('>8s8s16sI')
+TAG_SIZE = 16
+DEFAULT_ENCRYPTION_CHUNK_SIZE = 64 * 1024
+ENCRYPTED_SUFFIX = '.mrosenc'
+ENCRYPTED_MIME_TYPE = 'application/octet-stream'
+
+class DecryptionError(Exception):
+    """Raised for data that is not ours, was tampered with or is truncated"""
+
+def require_cipher():
+    if AESGCM is None:
+        raise ValueError("Encryption requires the cryptography module (python3-cryptography)")
+
+def encrypted_size(size, chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE):
+    """Length of the encryption of size bytes of plaintext"""
+    return HEADER.size + size + (size // chunk_size + 1) * TAG_SIZE
+
+def nonce(index, last):
+    return index.to_bytes(11, 'big') + (b'\x01' if last else b'\x00')
+
+def file_signature(stat):
+    """What must stay the same for a file's chunks to be sealed again with its key"""
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns, stat.st_ino)
+
+class EncryptionKey:
+    """A named 256-bit master key; its id is stored in every file it encrypts"""
+    
+    def __init__(self, name, secret, created=None):
+        if len(secret) != 32:
+            raise ValueError("Encryption keys are 32 bytes")
+        self.name = name
+        self.secret = secret
+        self.created = created
+        self.key_id = hashlib.sha256(b'mros-upload key id' + secret).digest()[:8]
+    
+    @property
+    def fingerprint(self):
+        return self.key_id.hex()
+    
+    def describe(self):
+        """What history records say about the encryption of an upload"""
+        return {'cipher': CIPHER, 'key': self.name, 'key_id': self.fingerprint}
+    
+    def file_cipher(self, salt):
+        require_cipher()
+        return AESGCM(hmac.new(self.secret, b'mros-upload file key' + salt, hashlib.sha256).digest())
+
+class KeyStore:
+    """Master keys kept as small JSON files in ~/.config/mros-upload/keys
+    
+    The directory is private to the user (0700) and every key file is
+    0600.  'default' is generated on first use.
+    """
+    
+    def __init__(self, directory):
+        self.directory = Path(directory)
+    
+    def path_for(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            raise ValueError(f"Invalid key name: {name}")
+        return self.directory / f'{name}.key'
+    
+    def load(self, name):
+        """The named key, None if there is none"""
+        try:
+            with open(self.path_for(name)) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        return EncryptionKey(name, base64.b64decode(data['key']), data.get('created'))
+    
+    def generate(self, name='default'):
+        """Create a new random key; an existing one is never replaced"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        os.chmod(self.directory, 0o700)
+        key = EncryptionKey(name, os.urandom(32), time.time())
+        data = json.dumps({'key': base64.b64encode(key.secret).decode(), 'created': key.created})
+        fd = os.open(self.path_for(name), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(data + '\n')
+        return key
+    
+    def get(self, name='default'):
+        """The named key; 'default' is created when missing"""
+        key = self.load(name)
+        if key is None:
+            if name != 'default':
+                raise ValueError(f"No encryption key named {name}, create it with --keygen {name}")
+            try:
+                key = self.generate(name)
+            except FileExistsError:
+                key = self.load(name)
+        return key
+    
+    def keys(self):
+        return [self.load(path.stem) for path in sorted(self.directory.glob('*.key'))]
+    
+    def by_id(self, key_id):
+        for key in self.keys():
+            if key.key_id == key_id:
+                return key
+        return None
+
+class Encryptor:
+    """Encrypts a stream of chunks of unknown total length
+    
+    Used for compressed and packed uploads, which are produced on the
+    fly; every upload gets a random salt and so a key of its own.
+    """
+    
+    def __init__(self, key, chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE, salt=None):
+        self.salt = salt or os.urandom(16)
+        self.chunk_size = chunk_size
+        self.header = HEADER.pack(MAGIC, key.key_id, self.salt, chunk_size)
+        self.cipher = key.file_cipher(self.salt)
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def seal(self, index, data, last):
+        return self.cipher.encrypt(nonce(index, last), bytes(data), self.header)
+    
+    def encrypt_chunks(self, chunks):
+        """Yield the header and the sealed chunks of the concatenated input"""
+        yield self.header
+        self.bytes_out = len(self.header)
+        buffer = bytearray()
+        index = 0
+        for data in chunks:
+            self.bytes_in += len(data)
+            buffer += data
+            while len(buffer) >= self.chunk_size:
+                sealed = self.seal(index, buffer[:self.chunk_size], False)
+                del buffer[:self.chunk_size]
+                index += 1
+                self.bytes_out += len(sealed)
+                yield sealed
+        sealed = self.seal(index, buffer, True)
+        self.bytes_out += len(sealed)
+        yield sealed
+
+class EncryptedFile:
+    """Random-access view of the encryption of a file
+    
+    pread() encrypts just the chunks a range touches, so resumable and
+    multi-part transfers can send any range of the encrypted file
+    without a temporary copy.  The salt is random unless a resumed
+    transfer passes the one from its checkpoint to send the same bytes
+    again.  Chunks are only sealed while the file's signature is the one
+    the salt was chosen for, so a key and nonce never seal two different
+    plaintexts.
+    """
+    
+    def __init__(self, file_path, key, stat=None, chunk_size=DEFAULT_ENCRYPTION_CHUNK_SIZE, salt=None):
+        self.file_path = Path(file_path)
+        stat = stat or self.file_path.stat()
+        self.plain_size = stat.st_size
+        self.signature = file_signature(stat)
+        self.chunk_size = chunk_size
+        self.key_id = key.key_id
+        self.encryptor = Encryptor(key, chunk_size, salt)
+        self.size = encrypted_size(self.plain_size, chunk_size)
+        self.name = self.file_path.name + ENCRYPTED_SUFFIX
+        self.cached = (None, b'')
+    
+    @property
+    def identity(self):
+        """Names key and salt, so checkpoints of other encryptions are not resumed"""
+        return self.encryptor.header.hex()
+    
+    def checkpoint_fields(self):
+        """Checkpoint entries that let a resume encrypt with the same salt"""
+        return {'source': self.identity, 'salt': self.encryptor.salt.hex(), 'signature': list(self.signature)}
+    
+    def sealed_chunk(self, index, fd):
+        # Parts read concurrently, so look at the cache only once
+        cached = self.cached
+        if cached[0] == index:
+            return cached[1]
+        offset = index * self.chunk_size
+        length = max(0, min(self.chunk_size, self.plain_size - offset))
+        data = os.pread(fd, length, offset) if length else b''
+        if len(data) < length:
+            raise IOError(f"File shrank during upload: {self.file_path}")
+        if file_signature(os.fstat(fd)) != self.signature:
+            raise IOError(f"File changed during upload: {self.file_path}")
+        sealed = self.encryptor.seal(index, data, index == self.plain_size // self.chunk_size)
+        self.cached = (index, sealed)
+        return sealed
+    
+    def chunks(self, chunk_size):
+        """Yield the whole encrypted file in chunk_size pieces"""
+        fd = os.open(self.file_path, os.O_RDONLY)
+        try:
+            for offset in range(0, self.size, chunk_size):
+                yield self.pread(offset, chunk_size, fd)
+        finally:
+            os.close(fd)
+    
+    def pread(self, offset, length, fd=None):
+        """Bytes [offset, offset + length) of the encrypted file"""
+        end = min(offset + length, self.size)
+        parts = []
+        if offset < HEADER.size:
+            parts.append(self.encryptor.header[offset:end])
+            offset = HEADER.size
+        if offset < end:
+            own_fd = fd is None
+            if own_fd:
+                fd = os.open(self.file_path, os.O_RDONLY)
+            try:
+                sealed_size = self.chunk_size + TAG_SIZE
+                while offset < end:
+                    index, skip = divmod(offset - HEADER.size, sealed_size)
+                    piece = self.sealed_chunk(index, fd)[skip:skip + end - offset]
+                    parts.append(piece)
+                    offset += len(piece)
+            finally:
+                if own_fd:
+                    os.close(fd)
+        return b''.join(parts)
+
+class Decryptor:
+    """Streaming decryption of data written by Encryptor or EncryptedFile
+    
+    feed() returns the plaintext of every chunk known not to be the
+    last; finish() the rest, after checking that the stream was not cut
+    short.  The key is looked up by the id in the header.
+    """
+    
+    def __init__(self, keystore):
+        self.keystore = keystore
+        self.buffer = bytearray()
+        self.header = None
+        self.cipher = None
+        self.chunk_size = None
+        self.index = 0
+        self.key = None
+    
+    def read_header(self):
+        magic, key_id, salt, chunk_size = HEADER.unpack(bytes(self.buffer[:HEADER.size]))
+        if magic != MAGIC:
+            raise DecryptionError("Not an encrypted upload")
+        self.key = self.keystore.by_id(key_id)
+        if self.key is None:
+            raise DecryptionError(f"No key with id {key_id.hex()} in {self.keystore.directory}")
+        self.header = bytes(self.buffer[:HEADER.size])
+        self.cipher = self.key.file_cipher(salt)
+        self.chunk_size = chunk_size
+        del self.buffer[:HEADER.size]
+    
+    def open(self, sealed, last):
+        try:
+            data = self.cipher.decrypt(nonce(self.index, last), bytes(sealed), self.header)
+        except Exception:
+            raise DecryptionError(f"Chunk {self.index} failed authentication (tampered or truncated)")
+        self.index += 1
+        return data
+    
+    def feed(self, data):
+        self.buffer += data
+        if self.header is None:
+            if len(self.buffer) < HEADER.size:
+                return b''
+            self.read_header()
+        sealed_size = self.chunk_size + TAG_SIZE
+        out = []
+        while len(self.buffer) > sealed_size:
+            out.append(self.open(self.buffer[:sealed_size], False))
+            del self.buffer[:sealed_size]
+        return b''.join(out)
+    
+    def finish(self):
+        if self.header is None:
+            raise DecryptionError("Encrypted upload is truncated")
+        data = self.open(self.buffer, True)
+        self.buffer = bytearray()
+        return data
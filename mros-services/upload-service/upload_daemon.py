@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Daemon
+Long-running upload service on a Unix domain socket with one shared job queue
+"""
+
+import os
+import json
+import itertools
+import socketserver
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from upload_walker import walk_files
+from upload_queue import QueueRunner
+from upload_client import UploadClient, default_socket_path
+
+class UploadJob:
+    """A client submission being served: one batch in the job queue"""
+    
+    def __init__(self, batch, request, send):
+        self.id = batch
+        self.options = dict(request.get('options') or {})
+        self.priority = self.options.pop('priority', None) or 0
+        self.show_progress = request.get('show_progress', True)
+        self.want_progress = request.get('progress', False)
+        self.send = send
+        self.created = time.time()
+        self.folder = request.get('folder')
+        self.files = request.get('files') or []
+        self.kind = 'pack' if self.folder is not None and self.options.get('pack') else 'file'
+        self.feeding = self.folder is not None and self.kind == 'file'
+        self.total = None if self.feeding else (1 if self.kind == 'pack' else len(self.files))
+        self.finished = 0
+        self.cancelled = False
+        self.completed = False
+        self.done = threading.Event()
+        self.notify_key = f"job-{self.id}"
+    
+    def emit(self, event):
+        """Send an event to the submitting client, if it is still listening"""
+        send = self.send
+        if send is None:
+            return
+        try:
+            send(event)
+        except OSError:
+            # The client went away; the job carries on without it
+            self.send = None
+    
+    def batch_notifications(self):
+        return self.show_progress and self.kind == 'file' and self.total != 1
+
+class UploadDaemon:
+    """Serves upload jobs from every client through one MrosUploadService
+    
+    All clients share the service's connection pool, rate limiter,
+    history store and durable job queue.  Jobs of equal priority are
+    interleaved file by file, so a large folder upload cannot starve a
+    single file submitted afterwards by another process.  On start the
+    daemon adopts queued jobs of processes that died.
+    """
+    
+    def __init__(self, service, socket_path=None, workers=None, idle_timeout=None, metrics_file=None):
+        self.service = service
+        self.queue = service.queue
+        self.socket_path = str(socket_path or default_socket_path())
+        self.workers = workers or service.engine.max_workers
+        self.idle_timeout = idle_timeout
+        self.metrics_file = metrics_file
+        self.condition = threading.Condition()
+        self.jobs_by_id = {}
+        self.finished_jobs = deque(maxlen=50)
+        self.running = True
+        self.last_activity = time.monotonic()
+        self.server = None
+        self.runner = QueueRunner(
+            self.queue,
+            self.run_job,
+            workers=self.workers,
+            on_result=self.on_result
+        )
+    
+    # Job queue
+    
+    def submit(self, request, send):
+        job = UploadJob(self.queue.new_batch(), request, send)
+        job.emit({'event': 'accepted', 'job': job.id})
+        with self.condition:
+            self.jobs_by_id[job.id] = job
+            self.last_activity = time.monotonic()
+        
+        if job.batch_notifications():
+            message = f"Starting upload of {job.total} files..." if job.total else "Starting upload..."
+            self.service.show_notification(message, "upload-start", job.notify_key)
+        
+        if job.feeding:
+            threading.Thread(target=self.feed, args=(job,), name='mros-daemon-walk', daemon=True).start()
+        else:
+            paths = [job.folder] if job.kind == 'pack' else job.files
+            self.queue.enqueue(job.id, paths, job.priority, job.kind, job.options)
+            self.runner.wake()
+            self.check_complete(job)
+        return job
+    
+    def feed(self, job):
+        """Walk a folder into the queue while its first files already upload"""
+        options = job.options
+        try:
+            self.service.enqueue_paths(
+                job.id,
+                itertools.takewhile(
+                    lambda path: not job.cancelled,
+                    walk_files(job.folder, include=options.get('include'), exclude=options.get('exclude'))
+                ),
+                job.priority,
+                options=options,
+                on_enqueued=self.runner.wake
+            )
+        except Exception as e:
+            print(f"Folder walk failed for {job.folder}: {e}")
+        finally:
+            if job.cancelled:
+                self.queue.cancel(batch=job.id)
+            job.feeding = False
+            job.total = sum(self.queue.batch_counts(job.id).values())
+            self.check_complete(job)
+    
+    def run_job(self, queued):
+        job = self.jobs_by_id.get(queued['batch'])
+        if job is None:
+            # Adopted from a process that died, nobody is listening
+            return self.service.run_job(queued)
+        
+        progress_callback = None
+        if job.want_progress:
+            def progress_callback(event):
+                job.emit({'event': 'progress', 'job': job.id, 'progress': event})
+        return self.service.run_job(
+            queued,
+            show_progress=job.show_progress and job.total == 1,
+            progress_callback=progress_callback
+        )
+    
+    def on_result(self, queued, result, final):
+        with self.condition:
+            self.last_activity = time.monotonic()
+        job = self.jobs_by_id.get(queued['batch'])
+        if job is None:
+            return
+        
+        if not final:
+            job.emit({'event': 'retry', 'job': job.id, 'index': queued['seq'], 'item': queued['path'],
+                      'attempts': queued['attempts'], 'error': result.get('error')})
+            return
+        
+        job.finished += 1
+        job.emit({'event': 'result', 'job': job.id, 'index': queued['seq'], 'item': queued['path'], 'result': result})
+        if job.batch_notifications():
+            position = f"{job.finished}/{job.total}" if job.total else f"{job.finished}"
+            self.service.show_notification(
+                f"Uploaded file {position}: {Path(queued['path']).name}", "upload-progress", job.notify_key
+            )
+        self.check_complete(job)
+    
+    def check_complete(self, job):
+        if job.feeding or self.queue.batch_active(job.id):
+            return
+        with self.condition:
+            if job.completed:
+                return
+            job.completed = True
+            self.jobs_by_id.pop(job.id, None)
+            self.finished_jobs.append(self.summary(job))
+        
+        results = self.queue.batch_results(job.id)
+        if job.batch_notifications() and len(results) > 1:
+            successful = sum(1 for r in results if r['success'])
+            if successful == len(results):
+                self.service.show_notification(
+                    f"All {len(results)} files uploaded successfully!", "upload-success", job.notify_key
+                )
+            else:
+                self.service.show_notification(
+                    f"{successful} files uploaded, {len(results) - successful} failed",
+                    "upload-warning", job.notify_key
+                )
+        elif job.batch_notifications() and not results and job.folder:
+            self.service.show_notification("No files found in folder", "upload-warning")
+        
+        job.emit({'event': 'done', 'job': job.id, 'results': results})
+        job.done.set()
+    
+    def cancel(self, job_id):
+        """Drop the job's queued files; transfers already running finish"""
+        job = self.jobs_by_id.get(job_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        self.queue.cancel(batch=job_id)
+        self.check_complete(job)
+        return True
+    
+    def summary(self, job):
+        counts = self.queue.batch_counts(job.id)
+        return {
+            'job': job.id,
+            'kind': job.kind,
+            'folder': job.folder,
+            'created': job.created,
+            'priority': job.priority,
+            'queued': counts.get('queued', 0),
+            'running': counts.get('running', 0),
+            'finished': job.finished,
+            'failed': counts.get('dead', 0),
+            'total': job.total,
+            'cancelled': job.cancelled
+        }
+    
+    def status(self):
+        with self.condition:
+            jobs = list(self.jobs_by_id.values())
+            finished = list(self.finished_jobs)
+        return [self.summary(job) for job in jobs] + finished
+    
+    # Server
+    
+    def handle(self, request, send):
+        """Execute one client request, streaming events through send"""
+        op = request.get('op')
+        if op == 'ping':
+            send({'event': 'pong', 'pid': os.getpid(), 'jobs': len(self.jobs_by_id)})
+        elif op == 'upload':
+            job = self.submit(request, send if request.get('wait', True) else None)
+            if not request.get('wait', True):
+                send({'event': 'queued', 'job': job.id})
+                return
+            job.done.wait()
+        elif op == 'history':
+            records, cursor = self.service.query_history(request.get('limit', 50), request.get('cursor'),
+                                                         **request.get('filters', {}))
+            send({'event': 'history', 'records': records, 'cursor': cursor})
+        elif op == 'clear_history':
+            self.service.clear_history()
+            send({'event': 'ok'})
+        elif op == 'status':
+            send({'event': 'status', 'jobs': self.status()})
+        elif op == 'metrics':
+            metrics = self.service.metrics
+            send({'event': 'metrics', 'text': metrics.render_prometheus(), 'snapshot': metrics.registry.snapshot()})
+        elif op == 'cancel':
+            if self.cancel(request.get('job')):
+                send({'event': 'ok'})
+            else:
+                send({'event': 'error', 'error': f"No such job: {request.get('job')}"})
+        elif op == 'shutdown':
+            send({'event': 'ok'})
+            threading.Thread(target=self.stop, daemon=True).start()
+        else:
+            send({'event': 'error', 'error': f"Unknown request: {op}"})
+    
+    def bind(self):
+        """Create the listening socket, replacing a stale one"""
+        if os.path.exists(self.socket_path):
+            if UploadClient(self.socket_path, timeout=1).ping():
+                raise RuntimeError(f"Upload daemon already running on {self.socket_path}")
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(self.socket_path), exist_ok=True)
+        
+        # Only the owner may connect to the socket
+        old_umask = os.umask(0o177)
+        try:
+            self.server = DaemonServer(self.socket_path, DaemonRequestHandler)
+        finally:
+            os.umask(old_umask)
+        self.server.upload_daemon = self
+    
+    def serve(self):
+        """Run until stopped by a shutdown request, idle timeout or signal"""
+        if self.server is None:
+            self.bind()
+        
+        # Take over whatever earlier processes left in the queue
+        adopted = self.queue.recover(startup=True)
+        if adopted:
+            print(f"Resuming {adopted} queued upload(s)")
+        self.queue.purge()
+        self.runner.start()
+        threading.Thread(target=self.maintain, name='mros-daemon-maintain', daemon=True).start()
+        
+        try:
+            self.server.serve_forever(poll_interval=0.5)
+        finally:
+            self.running = False
+            # Unfinished jobs stay in the queue for the next start
+            self.runner.stop(wait=False)
+            self.server.server_close()
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+            self.service.flush_notifications()
+            self.write_metrics()
+    
+    def write_metrics(self):
+        if not self.metrics_file:
+            return
+        try:
+            self.service.metrics.write_prometheus(self.metrics_file)
+        except OSError as e:
+            print(f"Failed to write metrics: {e}")
+    
+    def maintain(self):
+        """Adopt jobs of clients that died, export metrics and stop when idle for too long"""
+        while self.running:
+            time.sleep(5)
+            # Also picks up jobs retried or reordered by other processes
+            self.queue.recover()
+            self.runner.wake()
+            self.write_metrics()
+            if not self.idle_timeout:
+                continue
+            with self.condition:
+                idle = (not self.jobs_by_id and not self.queue.active(owner=os.getpid())
+                        and time.monotonic() - self.last_activity > self.idle_timeout)
+            if idle:
+                self.stop()
+                return
+    
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+class DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    upload_daemon = None
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Newline-delimited JSON requests, several per connection allowed"""
+    
+    def handle(self):
+        daemon = self.server.upload_daemon
+        lock = threading.Lock()
+        
+        def send(event):
+            data = json.dumps(event).encode() + b'\n'
+            with lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+        
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                send({'event': 'error', 'error': 'Malformed request'})
+                continue
+            with daemon.condition:
+                daemon.last_activity = time.monotonic()
+            try:
+                daemon.handle(request, send)
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                try:
+                    send({'event': 'error', 'error': str(e)})
+                except OSError:
+                    return
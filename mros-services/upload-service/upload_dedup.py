@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Deduplication
+Content-addressed index so unchanged files are never uploaded twice
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+# Older indexes also hold 'blake2b:' hashes; they stay valid for their files
+HASH_ALGORITHM = 'blake3' if blake3 is not None else 'sha256'
+HASH_BLOCK_SIZE = 1024 * 1024
+
+def new_hasher():
+    return blake3.blake3() if blake3 is not None else hashlib.sha256()
+
+def hash_file(file_path, block_size=HASH_BLOCK_SIZE):
+    """Streaming hash of a file, returned as '<algorithm>:<hex>'"""
+    hasher = new_hasher()
+    buffer = bytearray(block_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            hasher.update(view[:count])
+    return f'{HASH_ALGORITHM}:{hasher.hexdigest()}'
+
+class StreamDigest:
+    """Content hash fed with a file's bytes while they are being sent
+    
+    position is the number of bytes hashed so far.  Senders only feed
+    data that starts exactly at position, so ranges sent again after a
+    retry are not hashed twice; catch_up() reads whatever an earlier
+    attempt sent before this digest existed.
+    """
+    
+    def __init__(self):
+        self.hasher = new_hasher()
+        self.position = 0
+        self.known = None
+    
+    @classmethod
+    def precomputed(cls, content_hash, size):
+        """Digest of a file that was already hashed, e.g. for the dedup lookup
+        
+        It counts as having seen all size bytes; senders are not given
+        it, so the file is read only once.
+        """
+        digest = cls()
+        digest.known = content_hash
+        digest.position = size
+        return digest
+    
+    def update(self, data):
+        self.hasher.update(data)
+        self.position += len(data)
+    
+    def feeds(self, offset):
+        """Whether data starting at offset should be fed"""
+        return offset == self.position
+    
+    def catch_up(self, file_path, offset, block_size=HASH_BLOCK_SIZE, source=None):
+        """Hash the file (or what source makes of it) from position up to offset"""
+        if offset <= self.position:
+            return
+        with open(file_path, 'rb') as f:
+            f.seek(self.position)
+            while self.position < offset:
+                size = min(block_size, offset - self.position)
+                if source is not None:
+                    data = source.pread(self.position, size, f.fileno())
+                else:
+                    data = f.read(size)
+                if not data:
+                    raise IOError(f"File shrank during upload: {file_path}")
+                self.update(data)
+    
+    def tee(self, chunks):
+        """Yield chunks, hashing them on the way"""
+        for chunk in chunks:
+            self.update(chunk)
+            yield chunk
+    
+    def content_hash(self):
+        if self.known is not None:
+            return self.known
+        return f'{HASH_ALGORITHM}:{self.hasher.hexdigest()}'
+
+def same_algorithm(first, second):
+    """Whether two content hashes can be compared"""
+    return bool(first and second) and first.split(':', 1)[0] == second.split(':', 1)[0]
+
+class DedupIndex:
+    """SQLite index of file fingerprints and already uploaded content
+    
+    The files table caches (size, mtime, inode) -> content hash so an
+    unchanged file is never re-hashed; the objects table maps a content
+    hash to the URL it was uploaded to.
+    """
+    
+    def __init__(self, db_path, url_ttl=3600):
+        self.db_path = str(db_path)
+        self.url_ttl = url_ttl
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                content_hash TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS objects (
+                content_hash TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                download_url TEXT NOT NULL,
+                uploaded_at REAL NOT NULL,
+                validated_at REAL NOT NULL
+            );
+        """)
+        self.db.commit()
+    
+    def content_hash(self, file_path, stat=None):
+        """Return the content hash, hashing only when the fingerprint changed"""
+        path = os.path.abspath(file_path)
+        stat = stat or os.stat(path)
+        
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, mtime_ns, inode, content_hash FROM files WHERE path = ?',
+                (path,)
+            ).fetchone()
+        if row and row[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            return row[3]
+        
+        content_hash = hash_file(path)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                (path, stat.st_size, stat.st_mtime_ns, stat.st_ino, content_hash)
+            )
+            self.db.commit()
+        return content_hash
+    
+    def lookup(self, content_hash, validate=None):
+        """Return the cached upload for content_hash if its URL is still valid
+        
+        validate is called with the URL when the last validation is older
+        than url_ttl and should return True while the URL still serves.
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT size, download_url, uploaded_at, validated_at FROM objects WHERE content_hash = ?',
+                (content_hash,)
+            ).fetchone()
+        if row is None:
+            return None
+        
+        size, download_url, uploaded_at, validated_at = row
+        if validate and time.time() - validated_at > self.url_ttl:
+            if not validate(download_url):
+                self.forget(content_hash)
+                return None
+            with self.lock:
+                self.db.execute(
+                    'UPDATE objects SET validated_at = ? WHERE content_hash = ?',
+                    (time.time(), content_hash)
+                )
+                self.db.commit()
+        
+        return {
+            'content_hash': content_hash,
+            'size': size,
+            'download_url': download_url,
+            'uploaded_at': uploaded_at
+        }
+    
+    def record_upload(self, content_hash, size, download_url):
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)',
+                (content_hash, size, download_url, now, now)
+            )
+            self.db.commit()
+    
+    def forget(self, content_hash):
+        with self.lock:
+            self.db.execute('DELETE FROM objects WHERE content_hash = ?', (content_hash,))
+            self.db.commit()
+    
+    def forget_url(self, download_url):
+        """Drop the cached upload behind a URL, e.g. after it was deleted"""
+        with self.lock:
+            self.db.execute('DELETE FROM objects WHERE download_url = ?', (download_url,))
+            self.db.commit()
+    
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM objects')
+            self.db.execute('DELETE FROM files')
+            self.db.commit()
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
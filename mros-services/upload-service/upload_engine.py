@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Engine
+Bounded concurrent job runner with per-host limits and rate limiting
+"""
+
+import threading
+import time
+
+class TokenBucket:
+    """Token bucket rate limiter shared between worker threads"""
+    
+    def __init__(self, rate, capacity=None):
+        # rate is tokens per second, None or 0 disables limiting
+        self.rate = float(rate) if rate else 0.0
+        self.capacity = float(capacity) if capacity else max(self.rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def set_rate(self, rate, capacity=None):
+        """Change the refill rate without losing accumulated tokens"""
+        with self.lock:
+            self._refill()
+            self.rate = float(rate) if rate else 0.0
+            self.capacity = float(capacity) if capacity else max(self.rate, 1.0)
+            self.tokens = min(self.tokens, self.capacity)
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, tokens=1):
+        """Take tokens and return how long the caller has to wait for them"""
+        if not self.rate:
+            return 0.0
+        
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+    
+    def acquire(self, tokens=1):
+        """Block until the requested number of tokens is available"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+class HostLimiter:
+    """Caps the number of concurrent requests against a single host"""
+    
+    def __init__(self, limit):
+        self.limit = max(1, int(limit))
+        self.semaphores = {}
+        self.lock = threading.Lock()
+    
+    def get(self, host):
+        with self.lock:
+            semaphore = self.semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit)
+                self.semaphores[host] = semaphore
+            return semaphore
+
+class UploadEngine:
+    """Rate and per-host limits for upload jobs run by a bounded pool of max_workers"""
+    
+    def __init__(self, max_workers=4, per_host_limit=4, rate=None, burst=None):
+        self.max_workers = max(1, int(max_workers))
+        self.host_limiter = HostLimiter(per_host_limit)
+        self.rate_limiter = TokenBucket(rate, burst or self.max_workers)
+    
+    def run(self, func, item, host=None):
+        """Call func(item) under the rate limit and the host's concurrency cap"""
+        # Rate limit first so a throttled job does not hold a host slot
+        self.rate_limiter.acquire()
+        with self.host_limiter.get(host):
+            return func(item)
+
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Fetch
+Download path: parallel ranged reads into a preallocated file and an LRU object cache
+"""
+
+import os
+import time
+import random
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+import requests
+
+from upload_backends import RangeNotSupported
+from upload_dedup import StreamDigest
+from upload_parts import plan_parts
+from upload_stream import ProgressTracker
+
+DEFAULT_FETCH_RANGE_SIZE = 8 * 1024 * 1024
+DEFAULT_FETCH_WORKERS = 4
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+def default_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(cache_home) / 'mros-upload' / 'objects'
+
+def preallocate(fd, size):
+    """Reserve size bytes for a file, so ranges written out of order don't fragment it"""
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except (AttributeError, OSError):
+        # Not every filesystem can allocate ahead
+        os.ftruncate(fd, size)
+
+def write_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+class ObjectCache:
+    """Fetched objects, by default in ~/.cache/mros-upload/objects, named by content hash
+    
+    Least recently used objects are removed once the cache holds more
+    than max_bytes.  Recency is the file's mtime, touched on every hit,
+    so processes share the directory without an index to keep in sync.
+    """
+    
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_SIZE):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+    
+    def path_for(self, content_hash):
+        algorithm, _, hexdigest = content_hash.partition(':')
+        if not algorithm.isalnum() or not hexdigest.isalnum():
+            raise ValueError(f"Invalid content hash: {content_hash}")
+        return self.directory / f'{algorithm}-{hexdigest}'
+    
+    def get(self, content_hash):
+        """Path of the cached object, None on a miss"""
+        path = self.path_for(content_hash)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+    
+    def temp_path(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        return self.directory / f'.fetch-{os.getpid()}-{threading.get_ident()}.part'
+    
+    def add(self, content_hash, temp_path):
+        """Move a fetched file into the cache and make room for it"""
+        path = self.path_for(content_hash)
+        os.replace(temp_path, path)
+        self.evict(keep=path)
+        return path
+    
+    def evict(self, keep=None):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.'):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == str(keep):
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class RangeFetcher:
+    """Downloads one object as concurrent ranged reads
+    
+    Every range is read by a worker of its own and written with pwrite
+    into a file preallocated to the object's size, so a big download
+    keeps several connections busy instead of one.  A failed range is
+    read again with backoff while the others carry on.  The digest is
+    fed in object order; ranges read ahead of their turn wait in memory.
+    Servers that answer ranged reads with the whole object are read with
+    a single streamed GET instead.
+    """
+    
+    def __init__(self, range_size=DEFAULT_FETCH_RANGE_SIZE, workers=DEFAULT_FETCH_WORKERS, max_attempts=5):
+        self.range_size = range_size
+        self.workers = max(1, workers)
+        self.max_attempts = max_attempts
+    
+    def fetch(self, backend, download_url, path, size=None, progress_callback=None):
+        """Write the object at download_url to path, returns its StreamDigest
+        
+        size is asked from the backend when not given; objects of unknown
+        size are read range after range until a short one.
+        """
+        if size is None:
+            size = backend.object_size(download_url)
+        digest = StreamDigest()
+        progress = ProgressTracker(Path(path).name, size, progress_callback)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            try:
+                if size is None:
+                    self.fetch_sequential(backend, download_url, fd, digest, progress)
+                else:
+                    preallocate(fd, size)
+                    self.fetch_ranges(backend, download_url, fd, size, digest, progress)
+            except RangeNotSupported:
+                digest = StreamDigest()
+                progress = ProgressTracker(Path(path).name, size, progress_callback)
+                self.fetch_stream(backend, download_url, fd, size, digest, progress)
+        finally:
+            os.close(fd)
+        if progress.callback:
+            progress.report()
+        return digest
+    
+    def read(self, backend, download_url, offset, length):
+        attempts = 0
+        while True:
+            try:
+                return backend.read_range(download_url, offset, length)
+            except (OSError, requests.RequestException) as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    raise IOError(f"Range at {offset} failed after {attempts} attempts: {e}")
+                time.sleep(min(30, 2 ** attempts) * random.uniform(0.5, 1.0))
+    
+    def fetch_sequential(self, backend, download_url, fd, digest, progress):
+        while True:
+            data = self.read(backend, download_url, digest.position, self.range_size)
+            write_all(fd, data, digest.position)
+            digest.update(data)
+            progress.update(len(data))
+            if len(data) < self.range_size:
+                break
+    
+    def fetch_stream(self, backend, download_url, fd, size, digest, progress):
+        for data in backend.read_stream(download_url, self.range_size):
+            write_all(fd, data, digest.position)
+            digest.update(data)
+            progress.update(len(data))
+        os.ftruncate(fd, digest.position)
+        if size is not None and digest.position != size:
+            raise IOError(f"Object is {digest.position} bytes, {size} were reported")
+    
+    def fetch_ranges(self, backend, download_url, fd, size, digest, progress):
+        ranges = [part for part in plan_parts(size, self.range_size) if part['length']]
+        pending = {}
+        lock = threading.Lock()
+        failed = threading.Event()
+        
+        def run(part):
+            if failed.is_set():
+                return
+            data = self.read(backend, download_url, part['offset'], part['length'])
+            if len(data) != part['length']:
+                raise IOError(f"Object shrank while fetching: {len(data)} of {part['length']} bytes "
+                              f"at offset {part['offset']}")
+            write_all(fd, data, part['offset'])
+            with lock:
+                progress.update(len(data))
+                pending[part['offset']] = data
+                while digest.position in pending:
+                    digest.update(pending.pop(digest.position))
+        
+        if not ranges:
+            return
+        # The pool hands out ranges in object order, which bounds what waits for the digest
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(ranges)),
+                                thread_name_prefix='mros-fetch') as pool:
+            futures = [pool.submit(run, part) for part in ranges]
+            done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in done:
+                if future.exception() is not None:
+                    failed.set()
+                    for other in futures:
+                        other.cancel()
+                    raise future.exception()
+        # Nothing may follow the end the backend reported
+        if backend.read_range(download_url, size, 1):
+            raise IOError(f"Object is larger than the {size} bytes reported")
+
+def copy_out(source, output):
+    """Copy a fetched object to output through a temporary name"""
+    output = Path(output)
+    temp_path = output.with_name(f'.{output.name}.part')
+    try:
+        shutil.copyfile(source, temp_path)
+        os.replace(temp_path, output)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return output
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload History Store
+Append-only SQLite history of uploads, shared safely between processes
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from pathlib import Path
+
+# Record keys stored in their own columns, everything else goes to 'extra'
+HISTORY_COLUMNS = (
+    'timestamp', 'filename', 'filepath', 'size', 'mime_type', 'status',
+    'download_url', 'upload_id', 'content_hash', 'error'
+)
+
+class HistoryStore:
+    """Upload history in SQLite (WAL mode) with indexed lookups
+    
+    Appends are a single INSERT, so the cost of recording an upload does
+    not grow with the history.  WAL mode plus a busy timeout lets the CLI,
+    the Upload Manager and the daemon write concurrently.  Queries page
+    newest first along the (timestamp, size) index, so a page costs the
+    same at any depth of the history.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS uploads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL NOT NULL,
+                filename TEXT NOT NULL,
+                filepath TEXT,
+                size INTEGER,
+                mime_type TEXT,
+                status TEXT NOT NULL,
+                download_url TEXT,
+                upload_id TEXT,
+                content_hash TEXT,
+                error TEXT,
+                extra TEXT
+            );
+            CREATE INDEX IF NOT EXISTS uploads_timestamp_size ON uploads (timestamp, size);
+            DROP INDEX IF EXISTS uploads_timestamp;
+            CREATE INDEX IF NOT EXISTS uploads_filename ON uploads (filename);
+            CREATE INDEX IF NOT EXISTS uploads_status ON uploads (status, timestamp);
+            CREATE INDEX IF NOT EXISTS uploads_mime_type ON uploads (mime_type, timestamp);
+            CREATE INDEX IF NOT EXISTS uploads_content_hash ON uploads (content_hash);
+            CREATE INDEX IF NOT EXISTS uploads_upload_id ON uploads (upload_id);
+            CREATE INDEX IF NOT EXISTS uploads_download_url ON uploads (download_url);
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+        """)
+        self.fts = self.create_search_index()
+        self.db.commit()
+    
+    def create_search_index(self):
+        """Trigram full-text index over file names and URLs, False without FTS5
+        
+        Kept in sync with the uploads table by triggers; an existing
+        history is indexed once when the index is created.
+        """
+        exists = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'uploads_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            self.db.executescript("""
+                BEGIN;
+                CREATE VIRTUAL TABLE IF NOT EXISTS uploads_fts USING fts5(
+                    filename, download_url, content='uploads', content_rowid='id', tokenize='trigram'
+                );
+                CREATE TRIGGER IF NOT EXISTS uploads_fts_insert AFTER INSERT ON uploads BEGIN
+                    INSERT INTO uploads_fts (rowid, filename, download_url)
+                    VALUES (new.id, new.filename, new.download_url);
+                END;
+                CREATE TRIGGER IF NOT EXISTS uploads_fts_delete AFTER DELETE ON uploads BEGIN
+                    INSERT INTO uploads_fts (uploads_fts, rowid, filename, download_url)
+                    VALUES ('delete', old.id, old.filename, old.download_url);
+                END;
+                CREATE TRIGGER IF NOT EXISTS uploads_fts_update AFTER UPDATE ON uploads BEGIN
+                    INSERT INTO uploads_fts (uploads_fts, rowid, filename, download_url)
+                    VALUES ('delete', old.id, old.filename, old.download_url);
+                    INSERT INTO uploads_fts (rowid, filename, download_url)
+                    VALUES (new.id, new.filename, new.download_url);
+                END;
+                INSERT INTO uploads_fts (uploads_fts) VALUES ('rebuild');
+                COMMIT;
+            """)
+        except sqlite3.OperationalError:
+            # SQLite built without FTS5 or too old for trigrams: searches fall back to LIKE
+            if self.db.in_transaction:
+                self.db.rollback()
+            return False
+        return True
+    
+    def record_to_row(self, record):
+        extra = {k: v for k, v in record.items() if k not in HISTORY_COLUMNS and k != 'id'}
+        row = [record.get(column) for column in HISTORY_COLUMNS]
+        row.append(json.dumps(extra) if extra else None)
+        return row
+    
+    def row_to_record(self, row):
+        record = {'id': row['id']}
+        for column in HISTORY_COLUMNS:
+            if row[column] is not None:
+                record[column] = row[column]
+        if row['extra']:
+            record.update(json.loads(row['extra']))
+        return record
+    
+    def append(self, record):
+        """Append one upload record and return its id"""
+        columns = ', '.join(HISTORY_COLUMNS + ('extra',))
+        placeholders = ', '.join('?' * (len(HISTORY_COLUMNS) + 1))
+        with self.lock:
+            cursor = self.db.execute(
+                f'INSERT INTO uploads ({columns}) VALUES ({placeholders})',
+                self.record_to_row(record)
+            )
+            self.db.commit()
+            return cursor.lastrowid
+    
+    def recent(self, limit=50):
+        """Newest records first"""
+        query = 'SELECT * FROM uploads ORDER BY id DESC'
+        params = ()
+        if limit is not None:
+            query += ' LIMIT ?'
+            params = (limit,)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [self.row_to_record(row) for row in rows]
+    
+    def text_filter(self, words, column=None):
+        """SQL condition and parameters matching every word anywhere in a name or URL"""
+        if self.fts and all(len(word) >= 3 for word in words):
+            phrases = ['"' + word.replace('"', '""') + '"' for word in words]
+            if column:
+                phrases = [f'{column} : {phrase}' for phrase in phrases]
+            return 'id IN (SELECT rowid FROM uploads_fts WHERE uploads_fts MATCH ?)', [' AND '.join(phrases)]
+        conditions, params = [], []
+        columns = [column] if column else ['filename', 'download_url']
+        for word in words:
+            pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append('(' + ' OR '.join(f"{c} LIKE ? ESCAPE '\\'" for c in columns) + ')')
+            params += [pattern] * len(columns)
+        return ' AND '.join(conditions), params
+    
+    def query(self, limit=50, cursor=None, status=None, since=None, until=None, min_size=None,
+              max_size=None, mime_type=None, name=None, name_prefix=None, search=None):
+        """One page of matching records, newest first, and the cursor of the next page
+        
+        cursor is the value returned with the previous page, None for
+        the first; the returned cursor is None after the last page, and
+        limit=None returns all matches at once.
+        
+        since and until are timestamps, mime_type may end in /* for a
+        whole type, name matches anywhere in the file name and every
+        word of search anywhere in the file name or download URL.
+        """
+        conditions, params = [], []
+        
+        def where(condition, *values):
+            conditions.append(condition)
+            params.extend(values)
+        
+        if cursor is not None:
+            timestamp, _, row_id = str(cursor).partition(':')
+            where('(timestamp, id) < (?, ?)', float(timestamp), int(row_id))
+        if status:
+            where('status = ?', status)
+        if since is not None:
+            where('timestamp >= ?', since)
+        if until is not None:
+            where('timestamp < ?', until)
+        if min_size is not None:
+            where('size >= ?', min_size)
+        if max_size is not None:
+            where('size <= ?', max_size)
+        if mime_type and mime_type.endswith('/*'):
+            # Walking the time index beats sorting a whole type's rows
+            where('mime_type LIKE ?', mime_type[:-1] + '%')
+        elif mime_type:
+            where('mime_type = ?', mime_type)
+        if name_prefix:
+            where('filename >= ? AND filename < ?', name_prefix, name_prefix + '\U0010ffff')
+        if name:
+            condition, values = self.text_filter([name], 'filename')
+            where(condition, *values)
+        if search and search.split():
+            condition, values = self.text_filter(search.split())
+            where(condition, *values)
+        
+        query = 'SELECT * FROM uploads'
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY timestamp DESC, id DESC'
+        if limit is not None:
+            # One row more tells whether there is a next page
+            query += ' LIMIT ?'
+            params.append(limit + 1)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        records = [self.row_to_record(row) for row in rows[:limit]]
+        if limit is None or len(rows) <= limit:
+            return records, None
+        return records, f"{records[-1]['timestamp']!r}:{records[-1]['id']}"
+    
+    def find_by_hash(self, content_hash):
+        """Completed uploads of the given content, newest first"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT * FROM uploads WHERE content_hash = ? AND status = 'completed' ORDER BY id DESC",
+                (content_hash,)
+            ).fetchall()
+        return [self.row_to_record(row) for row in rows]
+    
+    def find_upload(self, key):
+        """Newest completed upload with the given id, upload id or download URL"""
+        query = "SELECT * FROM uploads WHERE status = 'completed' AND (upload_id = ? OR download_url = ?"
+        params = [key, key]
+        if str(key).isdigit():
+            query += ' OR id = ?'
+            params.append(int(key))
+        with self.lock:
+            row = self.db.execute(query + ') ORDER BY id DESC LIMIT 1', params).fetchone()
+        return self.row_to_record(row) if row else None
+    
+    def count(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM uploads').fetchone()[0]
+    
+    def clear(self):
+        with self.lock:
+            self.db.execute('DELETE FROM uploads')
+            self.db.commit()
+    
+    def migrate_json(self, json_path):
+        """One-time import of the old upload_history.json"""
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0
+        
+        try:
+            with open(json_path, 'r') as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            records = []
+        
+        columns = ', '.join(HISTORY_COLUMNS + ('extra',))
+        placeholders = ', '.join('?' * (len(HISTORY_COLUMNS) + 1))
+        with self.lock:
+            # BEGIN IMMEDIATE so two processes starting together migrate once
+            self.db.execute('BEGIN IMMEDIATE')
+            done = self.db.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if done:
+                self.db.rollback()
+                return 0
+            
+            # The JSON list is newest first; insert oldest first to keep id order
+            self.db.executemany(
+                f'INSERT INTO uploads ({columns}) VALUES ({placeholders})',
+                [self.record_to_row(record) for record in reversed(records)
+                 if isinstance(record, dict) and all(k in record for k in ('filename', 'timestamp', 'status'))]
+            )
+            self.db.execute("INSERT OR REPLACE INTO meta VALUES ('json_migrated', ?)", (str(json_path),))
+            self.db.commit()
+        
+        os.replace(json_path, json_path.with_suffix('.json.migrated'))
+        return len(records)
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
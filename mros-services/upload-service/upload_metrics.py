@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Metrics
+Counters, histograms and per-job trace spans with Prometheus text and JSON lines export
+"""
+
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Stages an upload's wall time is split into
+STAGES = ('wait', 'stat', 'hash', 'dedup', 'compress', 'connect', 'send', 'server_wait', 'verify', 'history')
+
+# Seconds, from a cached stat() to a long transfer
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                10.0, 30.0, 60.0, 300.0)
+SIZE_BUCKETS = tuple(1024 * 4 ** power for power in range(11))
+
+METRICS = {
+    'mros_upload_files_total': ('counter', 'Files finished by the upload service, by outcome'),
+    'mros_upload_bytes_total': ('counter', 'Bytes of files uploaded successfully'),
+    'mros_upload_retries_total': ('counter', 'Upload attempts that repeat an earlier failed one'),
+    'mros_upload_active': ('gauge', 'Spans currently open'),
+    'mros_upload_queue_jobs': ('gauge', 'Jobs in the durable queue, by state'),
+    'mros_upload_bandwidth_cap_bytes': ('gauge', 'Current global bandwidth cap in bytes/s, 0 = unlimited'),
+    'mros_upload_paused': ('gauge', '1 while uploads are paused'),
+    'mros_upload_duration_seconds': ('histogram', 'Wall time of finished spans', TIME_BUCKETS),
+    'mros_upload_stage_seconds': ('histogram', 'Time spent in each upload stage', TIME_BUCKETS),
+    'mros_upload_size_bytes': ('histogram', 'Size of uploaded files', SIZE_BUCKETS)
+}
+
+current = contextvars.ContextVar('mros_upload_span', default=None)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+    
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+    
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield bound, total
+        yield float('inf'), self.count
+    
+    def quantile(self, fraction):
+        """Upper bucket bound holding the given fraction of observations"""
+        if not self.count:
+            return None
+        for bound, total in self.cumulative():
+            if total >= fraction * self.count:
+                return bound
+        return float('inf')
+
+class MetricsRegistry:
+    """Process metrics keyed by name and label set
+    
+    Collectors are called before every snapshot or export to refresh
+    gauges that are cheaper to read on demand, such as queue depth.
+    """
+    
+    def __init__(self, metrics=METRICS):
+        self.definitions = dict(metrics)
+        self.series = {name: {} for name in self.definitions}
+        self.collectors = []
+        self.lock = threading.Lock()
+    
+    def labels_key(self, labels):
+        return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+    
+    def inc(self, name, value=1, **labels):
+        key = self.labels_key(labels)
+        with self.lock:
+            series = self.series[name]
+            series[key] = series.get(key, 0) + value
+    
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.series[name][self.labels_key(labels)] = value
+    
+    def observe(self, name, value, **labels):
+        key = self.labels_key(labels)
+        with self.lock:
+            histogram = self.series[name].get(key)
+            if histogram is None:
+                histogram = self.series[name][key] = Histogram(self.definitions[name][2])
+            histogram.observe(value)
+    
+    def add_collector(self, collector):
+        """collector(registry) runs before every export"""
+        self.collectors.append(collector)
+    
+    def collect(self):
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+    
+    def snapshot(self):
+        """All series as plain data, histograms with count, sum and p50/p99 bounds"""
+        self.collect()
+        snapshot = {}
+        with self.lock:
+            for name, series in self.series.items():
+                entries = []
+                for key, value in series.items():
+                    entry = {'labels': dict(key)}
+                    if isinstance(value, Histogram):
+                        entry.update({'count': value.count, 'sum': round(value.sum, 6),
+                                      'p50': value.quantile(0.5), 'p99': value.quantile(0.99)})
+                    else:
+                        entry['value'] = value
+                    entries.append(entry)
+                if entries:
+                    snapshot[name] = entries
+        return snapshot
+    
+    def render_prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        self.collect()
+        lines = []
+        with self.lock:
+            for name, series in self.series.items():
+                if not series:
+                    continue
+                kind, help_text = self.definitions[name][:2]
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                for key, value in sorted(series.items()):
+                    if not isinstance(value, Histogram):
+                        lines.append(f'{name}{format_labels(key)} {format_value(value)}')
+                        continue
+                    for bound, total in value.cumulative():
+                        bucket_key = key + (('le', format_value(float(bound))),)
+                        lines.append(f'{name}_bucket{format_labels(bucket_key)} {total}')
+                    lines.append(f'{name}_sum{format_labels(key)} {format_value(value.sum)}')
+                    lines.append(f'{name}_count{format_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+class Span:
+    """One traced operation: attributes, status and time per stage
+    
+    A span opened inside another one joins its trace.  Stage times are
+    added to the innermost open span; stages may overlap (compress runs
+    inside send), so they need not add up to the span's duration.
+    """
+    
+    def __init__(self, name, parent=None, **attributes):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = {key: value for key, value in attributes.items() if value is not None}
+        self.stages = {}
+        self.status = None
+        self.start = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.lock = threading.Lock()
+    
+    def set(self, **attributes):
+        self.attributes.update({key: value for key, value in attributes.items() if value is not None})
+    
+    def add_stage(self, stage, seconds):
+        with self.lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + max(seconds, 0.0)
+    
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            self.add_stage(stage, time.perf_counter() - started)
+    
+    def timings(self):
+        """Seconds spent so far, in total and per stage"""
+        with self.lock:
+            timings = {stage: round(seconds, 6) for stage, seconds in self.stages.items()}
+        timings['total'] = round(time.perf_counter() - self.started, 6)
+        return timings
+    
+    def finish(self, result=None):
+        """Take status and size from an upload result dict"""
+        if result is None:
+            return
+        if result.get('deduplicated'):
+            self.status = 'deduplicated'
+        else:
+            self.status = 'ok' if result.get('success') else 'failed'
+        self.set(size=result.get('size'), error=result.get('error'), url=result.get('url'))
+    
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6) if self.duration is not None else None,
+            'status': self.status,
+            'stages': {stage: round(seconds, 6) for stage, seconds in self.stages.items()},
+            'attributes': self.attributes
+        }
+
+class TraceLog:
+    """Appends finished spans to a JSON lines file, rotating it at max_bytes"""
+    
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+    
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            try:
+                if os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + '.1')
+            except OSError:
+                pass
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+class UploadMetrics:
+    """Registry and tracer of one upload service
+    
+    Spans named 'upload' are file transfers and feed the per-file
+    counters; every span feeds the duration and stage histograms and,
+    when a trace log is configured, is written to it once finished.
+    """
+    
+    def __init__(self, registry=None, trace_log=None):
+        self.registry = registry or MetricsRegistry()
+        self.trace_log = TraceLog(trace_log) if trace_log else None
+    
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, current.get(), **attributes)
+        token = current.set(span)
+        self.registry.inc('mros_upload_active', 1, span=name)
+        try:
+            yield span
+        except BaseException as e:
+            span.status = 'error'
+            span.set(error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            current.reset(token)
+            self.registry.inc('mros_upload_active', -1, span=name)
+            self.record(span)
+    
+    def record(self, span):
+        span.duration = time.perf_counter() - span.started
+        registry = self.registry
+        registry.observe('mros_upload_duration_seconds', span.duration, span=span.name, status=span.status)
+        for stage, seconds in span.stages.items():
+            registry.observe('mros_upload_stage_seconds', seconds, stage=stage)
+        if span.name == 'upload':
+            backend = span.attributes.get('backend')
+            registry.inc('mros_upload_files_total', status=span.status or 'unknown', backend=backend)
+            if span.status == 'ok' and span.attributes.get('size') is not None:
+                registry.inc('mros_upload_bytes_total', span.attributes['size'], backend=backend)
+                registry.observe('mros_upload_size_bytes', span.attributes['size'])
+        if self.trace_log is not None:
+            try:
+                self.trace_log.write(span.to_dict())
+            except OSError as e:
+                print(f"Failed to write trace: {e}")
+    
+    def render_prometheus(self):
+        return self.registry.render_prometheus()
+    
+    def write_prometheus(self, path):
+        """Write the exposition atomically, for node_exporter's textfile collector"""
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(self.render_prometheus())
+        os.replace(temp_file, path)
+
+# Helpers for code below the service that only sees the current span
+
+def current_span():
+    return current.get()
+
+@contextmanager
+def stage(name):
+    """Time a block into the current span's stage; no-op outside a span"""
+    span = current.get()
+    if span is None:
+        yield None
+        return
+    with span.stage(name):
+        yield span
+
+def add_stage(name, seconds):
+    span = current.get()
+    if span is not None:
+        span.add_stage(name, seconds)
+
+class RequestClock:
+    """Splits one HTTP request into connect, send and server_wait
+    
+    The body is wrapped so that its first read marks the end of connect
+    (connection taken from the pool or opened, headers sent) and reading
+    past its end the end of send; the rest, until finish(), is the time
+    the server took to answer.
+    """
+    
+    def __init__(self):
+        self.span = current.get()
+        self.started = time.perf_counter()
+        self.body_started = None
+        self.body_finished = None
+    
+    def mark(self, data):
+        now = time.perf_counter()
+        if self.body_started is None:
+            self.body_started = now
+        if not data and self.body_finished is None:
+            self.body_finished = now
+    
+    def wrap(self, body):
+        if self.span is None:
+            return body
+        if hasattr(body, 'read'):
+            return TimedReader(body, self)
+        return self.iterate(body)
+    
+    def iterate(self, body):
+        self.mark(b'x')
+        for chunk in body:
+            yield chunk
+        self.mark(b'')
+    
+    def finish(self):
+        if self.span is None:
+            return
+        now = time.perf_counter()
+        body_started = self.body_started or now
+        body_finished = self.body_finished or now
+        self.span.add_stage('connect', body_started - self.started)
+        self.span.add_stage('send', body_finished - body_started)
+        self.span.add_stage('server_wait', now - body_finished)
+
+class TimedReader:
+    """File-like body proxy that reports reads to a RequestClock"""
+    
+    def __init__(self, body, clock):
+        self.body = body
+        self.clock = clock
+    
+    def __len__(self):
+        return len(self.body)
+    
+    def read(self, size=-1):
+        data = self.body.read(size)
+        self.clock.mark(data)
+        return data
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Notifications
+Background dispatcher for desktop notifications and clipboard copies
+"""
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+NOTIFICATION_ICONS = {
+    'info': 'dialog-information',
+    'upload-start': 'cloud-upload',
+    'upload-progress': 'cloud-upload',
+    'upload-success': 'dialog-ok-apply',
+    'upload-error': 'dialog-error',
+    'upload-warning': 'dialog-warning'
+}
+
+class NotificationDispatcher:
+    """Runs notification and clipboard helpers off the upload hot path
+    
+    Requests are queued and handled by one worker thread.  Notifications
+    sharing a key are coalesced: only the newest pending message is
+    shown, and on notify-send it replaces the previous bubble in place.
+    Consecutive clipboard copies collapse into the last one.  Backends
+    are probed once and cached.
+    """
+    
+    def __init__(self, app_name='mros Upload Service', min_interval=0.5):
+        self.app_name = app_name
+        self.min_interval = min_interval
+        self.condition = threading.Condition()
+        self.pending = {}
+        self.clipboard_text = None
+        self.busy = False
+        self.replace_ids = {}
+        self.last_shown = {}
+        self.notify_backend = None
+        self.clipboard_backend = None
+        self.detected = False
+        self.worker = threading.Thread(target=self.run, name='mros-notify', daemon=True)
+        self.worker.start()
+    
+    # Backend detection
+    
+    def detect(self):
+        """Probe available helpers once"""
+        if self.detected:
+            return
+        self.detected = True
+        
+        if shutil.which('notify-send'):
+            supports_replace = False
+            try:
+                help_text = subprocess.run(
+                    ['notify-send', '--help'], capture_output=True, text=True, timeout=2
+                ).stdout
+                supports_replace = '--replace-id' in help_text
+            except (OSError, subprocess.TimeoutExpired):
+                pass
+            self.notify_backend = ('notify-send', supports_replace)
+        elif shutil.which('zenity'):
+            self.notify_backend = ('zenity', False)
+        else:
+            self.notify_backend = ('console', False)
+        
+        candidates = []
+        if os.environ.get('WAYLAND_DISPLAY'):
+            candidates.append(['wl-copy'])
+        candidates += [['xclip', '-selection', 'clipboard'], ['xsel', '--clipboard', '--input']]
+        for command in candidates:
+            if shutil.which(command[0]):
+                self.clipboard_backend = command
+                break
+        else:
+            if not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+                return
+            try:
+                import tkinter  # noqa: F401
+                self.clipboard_backend = 'tkinter'
+            except ImportError:
+                self.clipboard_backend = None
+    
+    def has_clipboard(self):
+        with self.condition:
+            self.detect()
+        return self.clipboard_backend is not None
+    
+    # Public API
+    
+    def notify(self, message, notification_type='info', key=None):
+        """Queue a notification; a newer one with the same key replaces it"""
+        key = key or uuid.uuid4().hex
+        with self.condition:
+            self.pending.pop(key, None)
+            self.pending[key] = (message, notification_type)
+            self.condition.notify()
+    
+    def copy(self, text):
+        """Queue a clipboard copy, superseding any copy not yet done"""
+        with self.condition:
+            self.clipboard_text = text
+            self.condition.notify()
+    
+    def flush(self, timeout=5):
+        """Wait until everything queued so far has been handled"""
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while self.pending or self.clipboard_text is not None or self.busy:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+    
+    # Worker
+    
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and self.clipboard_text is None:
+                    self.busy = False
+                    self.condition.notify_all()
+                    self.condition.wait()
+                self.busy = True
+                self.detect()
+                
+                text, self.clipboard_text = self.clipboard_text, None
+                item = None
+                if self.pending:
+                    key = next(iter(self.pending))
+                    message, notification_type = self.pending.pop(key)
+                    item = (key, message, notification_type)
+            
+            if text is not None:
+                self.set_clipboard(text)
+            if item is not None:
+                key, message, notification_type = item
+                # Rate limit in-place updates so a fast batch coalesces
+                wait = self.last_shown.get(key, 0) + self.min_interval - time.monotonic()
+                if wait > 0 and notification_type == 'upload-progress':
+                    time.sleep(wait)
+                    with self.condition:
+                        if key in self.pending:
+                            continue
+                self.show(key, message, notification_type)
+                self.last_shown[key] = time.monotonic()
+    
+    def show(self, key, message, notification_type):
+        icon = NOTIFICATION_ICONS.get(notification_type, 'dialog-information')
+        backend, supports_replace = self.notify_backend
+        
+        try:
+            if backend == 'notify-send':
+                command = [
+                    'notify-send',
+                    '-i', icon,
+                    '-a', self.app_name,
+                    '-h', f'string:x-canonical-private-synchronous:{key}'
+                ]
+                if supports_replace:
+                    command.append('--print-id')
+                    if key in self.replace_ids:
+                        command += ['--replace-id', self.replace_ids[key]]
+                command += ['File Upload', message]
+                result = subprocess.run(command, capture_output=True, text=True, timeout=5)
+                if supports_replace and result.returncode == 0 and result.stdout.strip():
+                    self.replace_ids[key] = result.stdout.strip()
+                return
+            if backend == 'zenity':
+                # Tray notification rather than a modal dialog
+                subprocess.Popen(
+                    ['zenity', '--notification', '--text', f"File Upload\n{message}"],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+                return
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        
+        print(f"NOTIFICATION: {message}")
+    
+    def set_clipboard(self, text):
+        backend = self.clipboard_backend
+        try:
+            if backend == 'tkinter':
+                import tkinter as tk
+                root = tk.Tk()
+                root.withdraw()
+                root.clipboard_clear()
+                root.clipboard_append(text)
+                root.update()
+                root.destroy()
+            elif backend:
+                subprocess.run(
+                    backend,
+                    input=text.encode(),
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=5
+                )
+        except Exception as e:
+            print(f"Failed to copy to clipboard: {e}")
+
+_shared_dispatcher = None
+_shared_dispatcher_lock = threading.Lock()
+
+def get_shared_dispatcher():
+    """Return the process-wide dispatcher, starting it on first use"""
+    global _shared_dispatcher
+    with _shared_dispatcher_lock:
+        if _shared_dispatcher is None:
+            _shared_dispatcher = NotificationDispatcher()
+        return _shared_dispatcher
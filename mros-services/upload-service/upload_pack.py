@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Packing
+Streams many small files into one tar archive upload, no temp file needed
+"""
+
+import os
+import queue
+import tarfile
+import threading
+
+from upload_codecs import Compressor
+
+# --pack format -> compression codec applied to the tar stream
+PACK_FORMATS = {
+    'tar': None,
+    'tar.gz': 'gzip',
+    'tar.xz': 'xz',
+    'tar.zst': 'zstd',
+}
+
+PACK_MIME_TYPES = {
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+    'tar.xz': 'application/x-xz',
+    'tar.zst': 'application/zstd',
+}
+
+class _ChunkWriter:
+    """File-like sink for tarfile that compresses and queues fixed-size chunks"""
+    
+    def __init__(self, emit, codec, chunk_size):
+        self.emit = emit
+        self.compressor = Compressor(codec) if codec else None
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+    
+    def write(self, data):
+        self.bytes_in += len(data)
+        if self.compressor:
+            data = self.compressor.compress(data)
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.send(bytes(self.buffer[:self.chunk_size]))
+            del self.buffer[:self.chunk_size]
+        return len(data)
+    
+    def send(self, chunk):
+        self.bytes_out += len(chunk)
+        self.emit(chunk)
+    
+    def close(self):
+        if self.compressor:
+            self.buffer += self.compressor.flush()
+        if self.buffer:
+            self.send(bytes(self.buffer))
+            self.buffer = bytearray()
+
+class TarStream:
+    """Iterable of archive chunks built on the fly from a file iterator
+    
+    A producer thread writes the tar stream while the upload consumes it
+    through a bounded queue, so memory use is a few chunks regardless of
+    how many files go in.  After iteration, manifest lists every member
+    with its header and data offsets in the uncompressed tar stream.
+    """
+    
+    def __init__(self, root, files, pack_format='tar', chunk_size=256 * 1024, max_buffered=16):
+        if pack_format not in PACK_FORMATS:
+            raise ValueError(f"Unknown pack format: {pack_format}")
+        self.root = os.fspath(root)
+        self.files = files
+        self.pack_format = pack_format
+        self.codec = PACK_FORMATS[pack_format]
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=max_buffered)
+        self.stop = threading.Event()
+        self.error = None
+        self.manifest = []
+        self.writer = None
+        
+        # Fail early on a missing codec instead of inside the producer
+        if self.codec:
+            Compressor(self.codec)
+    
+    @property
+    def bytes_in(self):
+        return self.writer.bytes_in if self.writer else 0
+    
+    @property
+    def bytes_out(self):
+        return self.writer.bytes_out if self.writer else 0
+    
+    def emit(self, chunk):
+        while not self.stop.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise IOError("Archive consumer went away")
+    
+    def produce(self):
+        try:
+            self.writer = _ChunkWriter(self.emit, self.codec, self.chunk_size)
+            with tarfile.open(fileobj=self.writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+                for file_path in self.files:
+                    file_path = os.fspath(file_path)
+                    arcname = os.path.relpath(file_path, self.root)
+                    info = tar.gettarinfo(file_path, arcname)
+                    if not info.isfile():
+                        continue
+                    
+                    header_offset = tar.offset
+                    with open(file_path, 'rb') as f:
+                        tar.addfile(info, f)
+                    blocks = -(-info.size // tarfile.BLOCKSIZE)
+                    self.manifest.append({
+                        'name': arcname,
+                        'size': info.size,
+                        'mtime': info.mtime,
+                        'header_offset': header_offset,
+                        'data_offset': tar.offset - blocks * tarfile.BLOCKSIZE
+                    })
+            self.writer.close()
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self.emit(None)
+            except IOError:
+                pass
+    
+    def __iter__(self):
+        producer = threading.Thread(target=self.produce, name='mros-pack', daemon=True)
+        producer.start()
+        try:
+            while True:
+                chunk = self.chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+            if self.error is not None:
+                raise self.error
+        finally:
+            self.stop.set()
+            producer.join()
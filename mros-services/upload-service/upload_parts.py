@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Parts
+Parallel multi-part transfer of one large file: ranged reads, concurrent parts, per-part retries
+"""
+
+import os
+import time
+import random
+import hashlib
+import threading
+from pathlib import Path
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+import requests
+
+from upload_stream import ProgressTracker, DEFAULT_CHUNK_SIZE
+from upload_resume import ResumableUploadError, TUS_VERSION
+
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_PART_WORKERS = 4
+
+def plan_parts(size, part_size):
+    """Split size bytes into parts; an empty file is a single empty part"""
+    if size == 0:
+        return [{'index': 0, 'offset': 0, 'length': 0, 'handle': None, 'done': False}]
+    return [
+        {'index': index, 'offset': offset, 'length': min(part_size, size - offset), 'handle': None, 'done': False}
+        for index, offset in enumerate(range(0, size, part_size))
+    ]
+
+def read_part(fd, offset, length):
+    """Read a whole part with pread, so workers can share one descriptor"""
+    data = bytearray()
+    while len(data) < length:
+        piece = os.pread(fd, length - len(data), offset + len(data))
+        if not piece:
+            raise IOError("File shrank during upload")
+        data += piece
+    return data
+
+class PartBody:
+    """File-like body of one part held in memory
+    
+    Hands the data out in chunk_size pieces, calling throttle(nbytes)
+    before and sent(nbytes) after each, so parts running side by side
+    share the bandwidth cap and the file's progress.
+    """
+    
+    def __init__(self, data, chunk_size=DEFAULT_CHUNK_SIZE, throttle=None, sent=None):
+        self.data = memoryview(data)
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.sent = sent
+        self.position = 0
+    
+    def __len__(self):
+        return len(self.data)
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.chunk_size
+        data = self.data[self.position:self.position + min(size, self.chunk_size)]
+        if data:
+            if self.throttle is not None:
+                self.throttle(len(data))
+            self.position += len(data)
+            if self.sent is not None:
+                self.sent(len(data))
+        return data
+
+class TusPartTarget:
+    """Parts as tus partial uploads, joined by a final concatenation request
+    
+    Needs the server's 'concatenation' extension.  A handle is the URL
+    of a partial upload; the final upload is created from the handles
+    in file order and its Upload-Url (or Location) is the download URL.
+    """
+    
+    def __init__(self, session_pool, endpoint, timeout=300):
+        self.session_pool = session_pool
+        self.endpoint = endpoint
+        self.timeout = timeout
+    
+    def describe(self):
+        return self.endpoint
+    
+    def open(self, file_path, stat, size, checkpoint):
+        """Prepare for a transfer of size bytes; False when earlier parts cannot be kept"""
+        return True
+    
+    def create_part(self, name, part):
+        response = self.session_pool.session().post(
+            self.endpoint,
+            headers={
+                'Tus-Resumable': TUS_VERSION,
+                'Upload-Concat': 'partial',
+                'Upload-Length': str(part['length']),
+                'Upload-Filename': f"{name}.part{part['index']}"
+            },
+            timeout=self.timeout
+        )
+        if response.status_code not in (200, 201) or 'Location' not in response.headers:
+            raise ResumableUploadError(f"Could not create part {part['index']}: HTTP {response.status_code}")
+        return urljoin(self.endpoint, response.headers['Location'])
+    
+    def part_complete(self, part):
+        """Whether the server holds all of a part sent by an earlier attempt"""
+        try:
+            response = self.session_pool.session().head(
+                part['handle'],
+                headers={'Tus-Resumable': TUS_VERSION},
+                timeout=self.timeout
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code == 200 and int(response.headers.get('Upload-Offset', -1)) == part['length']
+    
+    def send_part(self, part, body):
+        response = self.session_pool.session().patch(
+            part['handle'],
+            data=body,
+            headers={
+                'Tus-Resumable': TUS_VERSION,
+                'Upload-Offset': '0',
+                'Content-Type': 'application/offset+octet-stream'
+            },
+            timeout=self.timeout
+        )
+        if response.status_code not in (200, 204):
+            raise ResumableUploadError(f"Part {part['index']} rejected: HTTP {response.status_code}")
+        if int(response.headers.get('Upload-Offset', -1)) != part['length']:
+            raise ResumableUploadError(f"Part {part['index']} was not stored completely")
+    
+    def discard_part(self, part):
+        try:
+            self.session_pool.session().delete(
+                part['handle'],
+                headers={'Tus-Resumable': TUS_VERSION},
+                timeout=30
+            )
+        except requests.RequestException:
+            pass
+    
+    def finalize(self, name, parts):
+        response = self.session_pool.session().post(
+            self.endpoint,
+            headers={
+                'Tus-Resumable': TUS_VERSION,
+                'Upload-Concat': 'final;' + ' '.join(part['handle'] for part in parts),
+                'Upload-Filename': name
+            },
+            timeout=self.timeout
+        )
+        if response.status_code not in (200, 201):
+            raise ResumableUploadError(f"Could not join {len(parts)} parts: HTTP {response.status_code}")
+        download_url = response.headers.get('Upload-Url') or response.headers.get('Location')
+        if not download_url:
+            raise ResumableUploadError("No download URL for the joined upload")
+        return urljoin(self.endpoint, download_url)
+    
+    def close(self):
+        pass
+
+class FilePartTarget:
+    """Parts written with pwrite into one preallocated file of a FileSystemBackend
+    
+    The file stays in the backend's .partial/ directory until every part
+    is written and synced, then it is renamed into place.
+    """
+    
+    def __init__(self, backend):
+        self.backend = backend
+        self.fd = None
+        self.partial_path = None
+        self.key = None
+    
+    def describe(self):
+        return self.backend.describe()
+    
+    def open(self, file_path, stat, size, checkpoint):
+        self.key = hashlib.sha256(
+            f'{file_path.resolve()}:{stat.st_size}:{stat.st_mtime_ns}:{size}'.encode()
+        ).hexdigest()[:32]
+        partial_dir = self.backend.directory / '.partial'
+        partial_dir.mkdir(exist_ok=True)
+        self.partial_path = partial_dir / f'{self.key}.parts'
+        
+        try:
+            keep = checkpoint is not None and self.partial_path.stat().st_size == size
+        except OSError:
+            keep = False
+        self.fd = os.open(self.partial_path, os.O_RDWR | os.O_CREAT, 0o644)
+        if not keep:
+            os.ftruncate(self.fd, 0)
+            if size:
+                try:
+                    os.posix_fallocate(self.fd, 0, size)
+                except OSError:
+                    # Not supported by every filesystem, a sparse file will do
+                    os.ftruncate(self.fd, size)
+        return keep
+    
+    def create_part(self, name, part):
+        return self.partial_path.name
+    
+    def part_complete(self, part):
+        # Parts are synced before they are checkpointed as done
+        return True
+    
+    def send_part(self, part, body):
+        offset = part['offset']
+        while data := body.read():
+            while data:
+                written = os.pwrite(self.fd, data, offset)
+                offset += written
+                data = data[written:]
+        os.fdatasync(self.fd)
+    
+    def discard_part(self, part):
+        pass
+    
+    def finalize(self, name, parts):
+        os.fsync(self.fd)
+        self.close()
+        name = f'{self.key[:8]}-{name}'
+        os.replace(self.partial_path, self.backend.directory / name)
+        return self.backend.object_url(name)
+    
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+class PartUploader:
+    """Sends one file as concurrent parts and joins them on the target
+    
+    Every part is read whole with os.pread from a shared descriptor and
+    sent by a worker of its own, so a big file keeps several connections
+    busy instead of one.  A failed part is sent again on a fresh handle
+    with backoff while the others carry on.  With a journal the handles
+    of finished parts are checkpointed; an interrupted upload resumes
+    by sending only the parts the target does not hold yet.
+    """
+    
+    def __init__(self, target, part_size=DEFAULT_PART_SIZE, workers=DEFAULT_PART_WORKERS,
+                 journal=None, max_attempts=5):
+        self.target = target
+        self.part_size = part_size
+        self.workers = max(1, workers)
+        self.journal = journal
+        self.max_attempts = max_attempts
+    
+    def load_checkpoint(self, file_path, stat, source):
+        if self.journal is None:
+            return None
+        checkpoint = self.journal.load(file_path, stat)
+        if checkpoint is None or checkpoint.get('kind') != 'parts':
+            return None
+        if checkpoint.get('part_size') != self.part_size or checkpoint.get('target') != self.target.describe():
+            return None
+        if checkpoint.get('source') != (source.identity if source else None):
+            return None
+        return checkpoint
+    
+    def upload(self, file_path, progress_callback=None, throttle=None, digest=None, source=None):
+        """Upload file_path in parts, returns the download URL
+        
+        digest is fed in file order: parts read ahead of their turn wait
+        in memory until the parts before them were read, and parts kept
+        from an earlier attempt are read once more to hash them.  With a
+        source (EncryptedFile) its bytes are split instead of the file's.
+        """
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        size = source.size if source else stat.st_size
+        name = source.name if source else file_path.name
+        checkpoint = self.load_checkpoint(file_path, stat, source)
+        try:
+            if not self.target.open(file_path, stat, size, checkpoint):
+                checkpoint = None
+            if checkpoint is None:
+                checkpoint = {
+                    'kind': 'parts',
+                    'filepath': str(file_path),
+                    'size': stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                    'part_size': self.part_size,
+                    'target': self.target.describe(),
+                    'source': None,
+                    'parts': plan_parts(size, self.part_size),
+                    'created': time.time()
+                }
+                if source is not None:
+                    checkpoint.update(source.checkpoint_fields())
+            parts = checkpoint['parts']
+            for part in parts:
+                if part['done'] and not self.target.part_complete(part):
+                    part.update(handle=None, done=False)
+            
+            self.transfer(file_path, name, size, checkpoint, progress_callback, throttle, digest, source)
+            if digest is not None:
+                digest.catch_up(file_path, size, source=source)
+            download_url = self.target.finalize(name, parts)
+        finally:
+            self.target.close()
+        if self.journal is not None:
+            self.journal.remove(file_path)
+        return download_url
+    
+    def transfer(self, file_path, name, size, checkpoint, progress_callback, throttle, digest, source):
+        parts = checkpoint['parts']
+        todo = [part for part in parts if not part['done']]
+        kept = {part['offset']: part['offset'] + part['length'] for part in parts if part['done']}
+        pending = {}
+        lock = threading.Lock()
+        failed = threading.Event()
+        progress = ProgressTracker(file_path.name, size, progress_callback, filepath=str(file_path))
+        progress.bytes_sent = sum(part['length'] for part in parts if part['done'])
+        
+        def sent(nbytes):
+            with lock:
+                progress.update(nbytes)
+        
+        def feed(offset=None, data=None):
+            # Hash whatever is contiguous from the digest's position on
+            with lock:
+                if offset is not None:
+                    pending[offset] = data
+                while True:
+                    if digest.position in pending:
+                        digest.update(pending.pop(digest.position))
+                    elif digest.position in kept:
+                        digest.catch_up(file_path, kept.pop(digest.position), source=source)
+                    else:
+                        break
+        
+        def run(fd, part):
+            if failed.is_set():
+                return
+            if source is not None:
+                data = source.pread(part['offset'], part['length'], fd)
+            else:
+                data = read_part(fd, part['offset'], part['length'])
+            if digest is not None:
+                feed(part['offset'], data)
+            
+            attempts = 0
+            while True:
+                body = PartBody(data, throttle=throttle, sent=sent)
+                try:
+                    if part['handle'] is None:
+                        part['handle'] = self.target.create_part(name, part)
+                    self.target.send_part(part, body)
+                    break
+                except (OSError, ResumableUploadError) as e:
+                    with lock:
+                        progress.bytes_sent -= body.position
+                    attempts += 1
+                    if attempts >= self.max_attempts or failed.is_set():
+                        raise ResumableUploadError(f"Part {part['index']} failed after {attempts} attempts: {e}")
+                    if part['handle'] is not None:
+                        self.target.discard_part(part)
+                        part['handle'] = None
+                    time.sleep(min(30, 2 ** attempts) * random.uniform(0.5, 1.0))
+            
+            with lock:
+                part['done'] = True
+                if self.journal is not None:
+                    self.journal.save(checkpoint)
+        
+        if digest is not None:
+            feed()
+        if not todo:
+            return
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            # The pool hands out parts in file order, which bounds what feed() holds back
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(todo)),
+                                    thread_name_prefix='mros-part') as pool:
+                futures = [pool.submit(run, fd, part) for part in todo]
+                done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    if future.exception() is not None:
+                        failed.set()
+                        for other in futures:
+                            other.cancel()
+                        raise future.exception()
+        finally:
+            os.close(fd)
+        if progress.callback:
+            progress.report()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Pipeline
+What happens to a file on its way to a backend, shared by the threaded and asyncio upload services
+"""
+
+import os
+import mimetypes
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+from upload_stream import ProgressTracker, DEFAULT_CHUNK_SIZE
+from upload_resume import CheckpointJournal, DEFAULT_RESUMABLE_CHUNK_SIZE
+from upload_parts import DEFAULT_PART_SIZE, DEFAULT_PART_WORKERS
+from upload_backends import UploadBackend, make_backend
+from upload_session import get_shared_pool
+from upload_dedup import DedupIndex, StreamDigest, same_algorithm, HASH_ALGORITHM
+from upload_history import HistoryStore
+from upload_pack import TarStream, PACK_MIME_TYPES
+from upload_codecs import CODECS, check_codec, choose_codec, compressed_chunks
+from upload_crypto import KeyStore, Encryptor, EncryptedFile, file_signature, ENCRYPTED_SUFFIX, ENCRYPTED_MIME_TYPE
+from upload_notify import get_shared_dispatcher
+from upload_bandwidth import BandwidthGovernor
+from upload_metrics import UploadMetrics, stage, add_stage
+from upload_records import new_record, complete_record, fail_record, success_result, failure_result, error_result
+
+class FileUpload:
+    """One file between start_upload and finish_upload
+    
+    route is 'parts', 'resumable' or 'post'; posted files may be
+    compressed with codec.  source is the EncryptedFile view for
+    encrypted uploads.  result is already set when the file needs no
+    transfer because its content was uploaded before.
+    """
+    
+    def __init__(self, file_path, stat, mime_type, backend):
+        self.file_path = file_path
+        self.stat = stat
+        self.size = stat.st_size
+        self.mime_type = mime_type
+        self.backend = backend
+        self.content_hash = None
+        self.record = None
+        self.digest = StreamDigest()
+        self.source = None
+        self.route = None
+        self.codec = None
+        self.stats = {}
+        self.result = None
+    
+    @property
+    def send_digest(self):
+        """Digest the sender feeds, None when the content hash is already known"""
+        return None if self.digest.known else self.digest
+    
+    def changed(self):
+        """Whether the file's stat signature moved since start_upload"""
+        try:
+            return file_signature(self.file_path.stat()) != file_signature(self.stat)
+        except OSError:
+            return True
+
+class PackedUpload:
+    """A folder streamed into one archive, between start_packed and finish_packed"""
+    
+    def __init__(self, name, archive, chunks, upload_name, mime_type, record, backend, encryptor=None):
+        self.name = name
+        self.archive = archive
+        self.digest = StreamDigest()
+        self.chunks = self.digest.tee(chunks)
+        self.upload_name = upload_name
+        self.mime_type = mime_type
+        self.record = record
+        self.backend = backend
+        self.encryptor = encryptor
+
+class UploadPipeline:
+    """Everything about an upload except moving its bytes
+    
+    Base of MrosUploadService and AsyncMrosUploadService: settings,
+    backends, the dedup lookup, codec and encryption choice, routing to
+    resumable, multi-part or single-request transfers, integrity checks,
+    history records and results.  The services only send the bytes, the
+    threaded one with send_upload and the asyncio one on its event loop.
+    All methods here block.
+    """
+    
+    def __init__(self, backend=None, session_pool=None, resumable_url=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 resumable_threshold=16 * 1024 * 1024, resumable_chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE,
+                 dedup=True, compression=None, bandwidth_limit=None, bandwidth_schedule=None, trace_log=None,
+                 verify=None, part_size=DEFAULT_PART_SIZE, part_workers=DEFAULT_PART_WORKERS,
+                 parts_threshold=64 * 1024 * 1024, encryption_key=None):
+        self.config_dir = Path.home() / '.config' / 'mros-upload'
+        self.config_dir.mkdir(parents=True, exist_ok=True)
+        self.history_file = self.config_dir / 'upload_history.json'
+        self.chunk_size = chunk_size
+        self.load_history()
+        
+        # None disables compression, 'auto' picks a codec per file
+        if compression not in (None, 'none', 'auto'):
+            check_codec(compression)
+        self.compression = compression
+        
+        # Read uploads back after sending: None, 'sample' or 'full'
+        if verify not in (None, 'sample', 'full'):
+            raise ValueError(f"Unknown verify mode: {verify}")
+        self.verify = verify
+        
+        # Client-side encryption with a named key from ~/.config/mros-upload/keys, None = off
+        self.keys = KeyStore(self.config_dir / 'keys')
+        self.encryption_key = self.keys.get(encryption_key) if encryption_key else None
+        
+        # Resumable transfers keep a checkpoint per file so they survive restarts
+        self.resumable_threshold = resumable_threshold
+        self.resumable_chunk_size = resumable_chunk_size
+        self.checkpoints = CheckpointJournal(self.config_dir / 'checkpoints')
+        
+        # Files above parts_threshold go out as part_workers concurrent parts
+        self.part_size = part_size
+        self.part_workers = part_workers
+        self.parts_threshold = parts_threshold
+        
+        # Byte rate caps and pause state, shared with other processes via bandwidth.json
+        self.bandwidth = BandwidthGovernor(
+            self.config_dir / 'bandwidth.json',
+            limit=bandwidth_limit,
+            schedule=bandwidth_schedule
+        )
+        
+        # Per-stage timings, counters and a trace span per job
+        self.metrics = UploadMetrics(trace_log=trace_log)
+        
+        # Content-addressed index of what has already been uploaded
+        self.dedup_index = DedupIndex(self.config_dir / 'dedup.db') if dedup else None
+        
+        # Desktop notifications and clipboard run off the upload threads
+        self.notifier = get_shared_dispatcher()
+        
+        # Default destination; jobs may name another backend
+        self.session_pool = session_pool or get_shared_pool()
+        self.backend = backend if isinstance(backend, UploadBackend) else make_backend(
+            backend, self.session_pool, resumable_url
+        )
+        self.backends = {}
+        self.backends_lock = threading.Lock()
+    
+    @property
+    def upload_url(self):
+        return self.backend.upload_url or self.backend.describe()
+    
+    @upload_url.setter
+    def upload_url(self, url):
+        self.backend = make_backend(url, self.session_pool, getattr(self.backend, 'resumable_url', None))
+    
+    # Backends
+    
+    def get_backend(self, spec=None):
+        """Backend for a spec string (see make_backend), the default one for None
+        
+        Backends named by jobs are created once and cached; queue workers
+        ask concurrently, so creation happens under a lock.
+        """
+        if isinstance(spec, UploadBackend):
+            return spec
+        if spec is None or spec == self.backend.describe():
+            return self.backend
+        with self.backends_lock:
+            backend = self.backends.get(spec)
+            if backend is None:
+                backend = self.backends[spec] = make_backend(spec, self.session_pool)
+        return backend
+    
+    def backend_spec(self, backend):
+        """Spec string to store in queued jobs, None for the default backend"""
+        if backend is None or backend is self.backend:
+            return None
+        if isinstance(backend, UploadBackend):
+            spec = backend.describe()
+            with self.backends_lock:
+                self.backends.setdefault(spec, backend)
+            return spec
+        return backend
+    
+    def backend_for_url(self, download_url):
+        """Backend that handed out download_url, or a fresh one matching its scheme"""
+        with self.backends_lock:
+            backends = (self.backend, *self.backends.values())
+        for backend in backends:
+            if backend.owns(download_url):
+                return backend
+        parsed = urlparse(download_url)
+        if parsed.scheme == 'file':
+            return make_backend(os.path.dirname(parsed.path))
+        return make_backend(f"{parsed.scheme}://{parsed.netloc}", self.session_pool)
+    
+    # Decisions
+    
+    def choose_compression(self, file_path, mime_type, file_size):
+        """Codec for this file under the configured policy, or None"""
+        if not self.compression or file_size < 1024:
+            return None
+        with open(file_path, 'rb') as f:
+            sample = f.read(65536)
+        return choose_codec(mime_type, sample, file_size, self.compression)
+    
+    def use_resumable(self, file_size, resumable=None, backend=None):
+        """Decide whether a file goes through the resumable transfer"""
+        if not (backend or self.backend).supports_resume:
+            return False
+        if resumable is not None:
+            return resumable
+        return file_size >= self.resumable_threshold
+    
+    def use_parts(self, file_size, resumable=None, backend=None):
+        """Decide whether a file is sent as concurrent parts
+        
+        Only large files qualify, and only when resumable transfers are
+        not disabled for them; the backend is asked last because an HTTP
+        backend has to ask its server.
+        """
+        if self.part_workers < 2 or resumable is False or file_size < self.parts_threshold:
+            return False
+        return (backend or self.backend).supports_parts
+    
+    def check_upload(self, backend, download_url, digest, size=None, content_hash=None,
+                     local_path=None, codec=None):
+        """Integrity check of a finished transfer, returns None or the problem
+        
+        The digest of the bytes sent must cover the whole file and match
+        the hash taken before sending; in verify mode the upload is also
+        read back from the backend.
+        """
+        sent_hash = digest.content_hash()
+        if size is not None and digest.position != size:
+            return f"sent {digest.position} of {size} bytes"
+        if same_algorithm(content_hash, sent_hash) and content_hash != sent_hash:
+            return "file changed during upload"
+        if self.verify:
+            with stage('verify'):
+                error = backend.verify(download_url, sent_hash, self.verify, local_path, codec)
+            if error:
+                return f"verification failed: {error}"
+        return None
+    
+    def discard_upload(self, backend, download_url):
+        """Best-effort removal of an upload that failed its integrity check"""
+        if not backend.can_delete:
+            return
+        try:
+            backend.delete(download_url)
+        except Exception as e:
+            print(f"Failed to delete {download_url}: {e}")
+    
+    # Files
+    
+    def start_upload(self, file_path, backend, resumable=None, show_progress=True, validate=None):
+        """Stat a file, look it up for dedup and decide how it is sent
+        
+        Returns a FileUpload whose result is already set when identical
+        content is on the backend.  validate(url) tells whether a known
+        download URL still serves, url_is_valid by default.
+        """
+        file_path = Path(file_path)
+        with stage('stat'):
+            if not file_path.exists():
+                raise FileNotFoundError(f"File not found: {file_path}")
+            
+            if not file_path.is_file():
+                raise ValueError(f"Not a file: {file_path}")
+            
+            # Prepare file for upload
+            mime_type, _ = mimetypes.guess_type(str(file_path))
+            upload = FileUpload(file_path, file_path.stat(), mime_type, backend)
+        
+        # Show notification
+        if show_progress:
+            self.show_notification(f"Uploading {file_path.name}...", "upload-start")
+        
+        # Skip the transfer when identical content was already uploaded; an
+        # encrypted upload must not be answered with a plaintext one
+        if self.dedup_index is not None and self.encryption_key is None:
+            with stage('hash'):
+                upload.content_hash = self.dedup_index.content_hash(file_path, upload.stat)
+            with stage('dedup'):
+                cached = self.dedup_index.lookup(upload.content_hash, validate=validate or self.url_is_valid)
+            # Content stored on another backend does not count
+            if cached and backend.owns(cached['download_url']):
+                self.copy_to_clipboard(cached['download_url'])
+                if show_progress:
+                    self.show_notification(
+                        f"Already uploaded, URL copied to clipboard\\n{cached['download_url']}",
+                        "upload-success"
+                    )
+                
+                upload.result = success_result(file_path.name, cached['download_url'], upload.size,
+                                               upload.content_hash, deduplicated=True)
+                return upload
+            
+            # The dedup hash covers the content, the bytes sent need not be hashed again
+            if upload.content_hash.split(':', 1)[0] == HASH_ALGORITHM:
+                upload.digest = StreamDigest.precomputed(upload.content_hash, upload.size)
+        
+        # Create upload record
+        upload.record = new_record(file_path.name, file_path, backend, upload.size, mime_type, upload.content_hash)
+        
+        # Encrypted uploads send (and hash) the bytes of this view instead; a
+        # resumed transfer keeps the salt of the interrupted one
+        if self.encryption_key is not None:
+            salt = self.checkpoints.encryption_salt(file_path, file_signature(upload.stat))
+            upload.source = EncryptedFile(file_path, self.encryption_key, upload.stat, salt=salt)
+            upload.record['encryption'] = self.encryption_key.describe()
+        
+        # Resumable transfer for large files when the host supports it
+        if self.use_parts(upload.size, resumable, backend):
+            upload.route = 'parts'
+        elif self.use_resumable(upload.size, resumable, backend):
+            upload.route = 'resumable'
+        else:
+            upload.route = 'post'
+            upload.codec = self.choose_compression(file_path, mime_type, upload.size)
+        return upload
+    
+    def upload_body(self, upload, progress_callback=None):
+        """Chunks of a compressed or encrypted post and how to send them
+        
+        Returns (chunks, upload name, MIME type, progress callback, total
+        length or None).  The digest is fed with the bytes as sent; for
+        compressed files progress counts the bytes read instead.
+        """
+        file_path = upload.file_path
+        if upload.source is not None and not upload.codec:
+            return (upload.digest.tee(upload.source.chunks(self.chunk_size)), upload.source.name,
+                    ENCRYPTED_MIME_TYPE, progress_callback, upload.source.size)
+        
+        codec_info = CODECS[upload.codec]
+        progress = ProgressTracker(file_path.name, upload.size, progress_callback, filepath=str(file_path))
+        if upload.source is None:
+            chunks = compressed_chunks(file_path, upload.codec, self.chunk_size, progress, upload.stats,
+                                       upload.send_digest)
+            return chunks, file_path.name + codec_info['extension'], codec_info['mime_type'], None, None
+        
+        encryptor = Encryptor(self.encryption_key)
+        chunks = encryptor.encrypt_chunks(
+            compressed_chunks(file_path, upload.codec, self.chunk_size, progress, upload.stats)
+        )
+        return (upload.digest.tee(chunks), file_path.name + codec_info['extension'] + ENCRYPTED_SUFFIX,
+                ENCRYPTED_MIME_TYPE, None, None)
+    
+    def send_upload(self, upload, progress_callback=None, throttle=None):
+        """Send a file with the backend's blocking methods, returns (download_url, error, status_code)"""
+        backend = upload.backend
+        if upload.route == 'parts':
+            with stage('send'):
+                return backend.upload_parts(
+                    upload.file_path,
+                    self.checkpoints,
+                    self.part_size,
+                    self.part_workers,
+                    progress_callback,
+                    throttle,
+                    upload.send_digest,
+                    upload.source
+                ), None, None
+        if upload.route == 'resumable':
+            with stage('send'):
+                return backend.resume_file(
+                    upload.file_path,
+                    self.checkpoints,
+                    self.resumable_chunk_size,
+                    progress_callback,
+                    throttle,
+                    upload.send_digest,
+                    upload.source
+                ), None, None
+        if upload.source is None and not upload.codec:
+            return backend.upload_file(
+                upload.file_path,
+                upload.mime_type,
+                self.chunk_size,
+                progress_callback,
+                throttle,
+                upload.send_digest
+            )
+        chunks, upload_name, mime_type, progress_callback, total = self.upload_body(upload, progress_callback)
+        return backend.upload_chunks(chunks, upload_name, mime_type, progress_callback, throttle, total)
+    
+    def finish_upload(self, upload, download_url, error_msg, status_code=None, show_progress=True):
+        """Check a sent file, record it and return its result"""
+        file_path = upload.file_path
+        backend = upload.backend
+        upload_record = upload.record
+        if upload.codec:
+            add_stage('compress', upload.stats.get('seconds', 0.0))
+            bytes_out = upload.stats.get('bytes_out')
+            upload_record.update({
+                'compression': upload.codec,
+                'compressed_size': bytes_out,
+                'compression_ratio': round(bytes_out / upload.size, 4) if bytes_out else None
+            })
+        
+        retryable = False
+        if error_msg is None:
+            if upload.source is not None:
+                # The digest covers the encrypted bytes; their length is known unless compressed
+                problem = self.check_upload(backend, download_url, upload.digest,
+                                            None if upload.codec else upload.source.size)
+            elif upload.digest.known and upload.changed():
+                # Nothing was hashed while sending, so look at the file instead
+                problem = "file changed during upload"
+            else:
+                problem = self.check_upload(backend, download_url, upload.digest, upload.size,
+                                            upload.content_hash, file_path, upload.codec)
+            if problem:
+                self.discard_upload(backend, download_url)
+                error_msg = f"Integrity check failed: {problem}"
+                status_code = None
+                retryable = True
+        
+        if error_msg is not None:
+            fail_record(upload_record, error_msg)
+            with stage('history'):
+                self.add_history_record(upload_record)
+            
+            if show_progress:
+                self.show_notification(f"Upload failed: {error_msg}", "upload-error")
+            
+            return failure_result(file_path.name, error_msg, status_code, retryable)
+        
+        complete_record(upload_record, download_url, upload.digest.content_hash(), self.verify)
+        
+        # Add to history
+        with stage('history'):
+            self.add_history_record(upload_record)
+            if upload.content_hash:
+                self.dedup_index.record_upload(upload.content_hash, upload.size, download_url)
+        
+        # Copy URL to clipboard
+        self.copy_to_clipboard(download_url)
+        
+        # Show success notification
+        if show_progress:
+            self.show_notification(
+                f"Upload complete! URL copied to clipboard\\n{download_url}",
+                "upload-success"
+            )
+        
+        return success_result(file_path.name, download_url, upload.size, upload.digest.content_hash())
+    
+    # Folders packed into one archive
+    
+    def start_packed(self, folder_path, files, pack_format, backend, show_progress=True):
+        """Archive stream and record for a packed folder upload
+        
+        The archive is built on the fly from files and encrypted as a
+        whole, so members still decrypt in order.
+        """
+        folder_path = Path(folder_path)
+        archive_name = f"{folder_path.name or 'folder'}.{pack_format}"
+        mime_type = PACK_MIME_TYPES[pack_format]
+        
+        if show_progress:
+            self.show_notification(f"Packing and uploading {archive_name}...", "upload-start")
+        
+        archive = TarStream(folder_path, files, pack_format, chunk_size=self.chunk_size)
+        upload_record = new_record(archive_name, folder_path, backend, mime_type=mime_type, packed=True,
+                                   pack_format=pack_format)
+        
+        if self.encryption_key is None:
+            return PackedUpload(archive_name, archive, archive, archive_name, mime_type, upload_record, backend)
+        
+        encryptor = Encryptor(self.encryption_key)
+        upload_record['encryption'] = self.encryption_key.describe()
+        return PackedUpload(archive_name, archive, encryptor.encrypt_chunks(archive),
+                            archive_name + ENCRYPTED_SUFFIX, ENCRYPTED_MIME_TYPE, upload_record, backend, encryptor)
+    
+    def finish_packed(self, upload, download_url, error_msg, status_code=None, error=None, show_progress=True):
+        """Check a sent archive, record it with its member manifest and return its result
+        
+        error is the exception the transfer raised, if any.
+        """
+        archive = upload.archive
+        retryable = False
+        if error is not None:
+            failed = error_result(error, upload.name)
+            download_url, error_msg, retryable = None, failed['error'], failed['retryable']
+        
+        upload.record.update({
+            'size': archive.bytes_out,
+            'uncompressed_size': archive.bytes_in,
+            'member_count': len(archive.manifest),
+            'manifest': archive.manifest
+        })
+        
+        if error_msg is None:
+            problem = self.check_upload(upload.backend, download_url, upload.digest,
+                                        upload.encryptor.bytes_out if upload.encryptor else archive.bytes_out)
+            if problem:
+                self.discard_upload(upload.backend, download_url)
+                error_msg = f"Integrity check failed: {problem}"
+                status_code = None
+                retryable = True
+        
+        if error_msg is not None:
+            fail_record(upload.record, error_msg)
+            with stage('history'):
+                self.add_history_record(upload.record)
+            if show_progress:
+                self.show_notification(f"Upload failed: {error_msg}", "upload-error")
+            
+            return failure_result(upload.name, error_msg, status_code, retryable)
+        
+        complete_record(upload.record, download_url, upload.digest.content_hash(), self.verify)
+        with stage('history'):
+            self.add_history_record(upload.record)
+        self.copy_to_clipboard(download_url)
+        
+        if show_progress:
+            self.show_notification(
+                f"Uploaded {len(archive.manifest)} files as {upload.name}\\n{download_url}",
+                "upload-success"
+            )
+        
+        return success_result(upload.name, download_url, archive.bytes_out, upload.digest.content_hash(),
+                              member_count=len(archive.manifest))
+    
+    # History, clipboard and notifications
+    
+    def load_history(self):
+        """Open the history store, migrating the old JSON history once"""
+        self.history_store = HistoryStore(self.config_dir / 'history.db')
+        try:
+            self.history_store.migrate_json(self.history_file)
+        except Exception as e:
+            print(f"Failed to migrate upload history: {e}")
+    
+    def add_history_record(self, upload_record):
+        """Append a record to the history"""
+        try:
+            upload_record['id'] = self.history_store.append(upload_record)
+        except Exception as e:
+            print(f"Failed to save history: {e}")
+    
+    def copy_to_clipboard(self, text):
+        """Copy text to clipboard (asynchronously, never blocks an upload)"""
+        if not self.notifier.has_clipboard():
+            return False
+        self.notifier.copy(text)
+        return True
+    
+    def show_notification(self, message, notification_type="info", key=None):
+        """Show desktop notification
+        
+        Notifications are dispatched in the background; ones sharing a key
+        update a single bubble in place.
+        """
+        self.notifier.notify(message, notification_type, key)
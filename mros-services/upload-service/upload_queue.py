@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Queue
+Crash-safe SQLite job queue with priorities, retry backoff and a dead-letter list
+"""
+
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import threading
+
+# HTTP statuses worth retrying: timeouts, throttling and transient server errors
+RETRYABLE_STATUS_CODES = {408, 425, 429, 500, 502, 503, 504}
+
+# Job states; 'dead' is the dead-letter list
+QUEUED, RUNNING, DONE, DEAD, CANCELLED = 'queued', 'running', 'done', 'dead', 'cancelled'
+
+def is_retryable(result):
+    """Whether a failed upload result should be tried again later"""
+    if result.get('success'):
+        return False
+    if result.get('status_code') is not None:
+        return result['status_code'] in RETRYABLE_STATUS_CODES
+    return bool(result.get('retryable'))
+
+def pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class UploadQueue:
+    """Durable upload jobs in SQLite (WAL, synchronous=FULL)
+    
+    Every state change is one committed transaction, so after a crash or
+    power loss a job is either still queued or recorded as done and is
+    never uploaded twice.  Workers record a job's outcome and claim
+    their next job in the same transaction, one fsync per job.  Jobs belong to a batch and an owner process;
+    rows left running or queued by a process that died are adopted by
+    recover().  Ready jobs are taken by priority, then rank; rank
+    defaults to the position inside the batch, which interleaves
+    concurrent batches of equal priority.
+    """
+    
+    def __init__(self, db_path, max_attempts=5, backoff_base=2.0, backoff_cap=300.0):
+        self.db_path = str(db_path)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        # FULL makes every commit durable across power loss, not only crashes
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                kind TEXT NOT NULL DEFAULT 'file',
+                options TEXT,
+                priority INTEGER NOT NULL DEFAULT 0,
+                rank REAL NOT NULL,
+                state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                owner INTEGER,
+                last_error TEXT,
+                result TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, owner, priority DESC, rank, id);
+            CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch, seq);
+        """)
+    
+    def transaction(self):
+        return _Transaction(self.db)
+    
+    def row_to_job(self, row):
+        job = dict(row)
+        job['options'] = json.loads(job['options']) if job['options'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+    
+    # Producing
+    
+    def new_batch(self):
+        return uuid.uuid4().hex[:12]
+    
+    def enqueue(self, batch, paths, priority=0, kind='file', options=None, owner=None):
+        """Add paths to a batch in one transaction, returns their job ids"""
+        now = time.time()
+        options_json = json.dumps(options) if options else None
+        owner = owner or os.getpid()
+        ids = []
+        with self.lock, self.transaction():
+            seq = self.db.execute(
+                'SELECT COALESCE(MAX(seq) + 1, 0) FROM jobs WHERE batch = ?', (batch,)
+            ).fetchone()[0]
+            for path in paths:
+                cursor = self.db.execute(
+                    'INSERT INTO jobs (batch, seq, path, kind, options, priority, rank, state, owner, created, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (batch, seq, os.fspath(path), kind, options_json, priority, seq, QUEUED, owner, now, now)
+                )
+                ids.append(cursor.lastrowid)
+                seq += 1
+        return ids
+    
+    # Consuming
+    
+    def claim(self, owner=None, batch=None):
+        """Mark the next ready job running and return it, or None"""
+        return self.settle_and_claim(owner=owner, batch=batch)[1]
+    
+    def settle_and_claim(self, settle=None, owner=None, batch=None, claim_next=True):
+        """Record (job, result) if given and claim the next ready job
+        
+        Returns (requeued, job): whether the settled job went back to
+        the queue for a retry, and the claimed job or None.
+        """
+        owner = owner or os.getpid()
+        query = 'SELECT * FROM jobs WHERE state = ? AND owner = ? AND next_attempt <= ?'
+        params = [QUEUED, owner, time.time()]
+        if batch is not None:
+            query += ' AND batch = ?'
+            params.append(batch)
+        query += ' ORDER BY priority DESC, rank, id LIMIT 1'
+        
+        requeued = False
+        with self.lock, self.transaction():
+            if settle is not None:
+                requeued = self.record_outcome(*settle)
+            row = self.db.execute(query, params).fetchone() if claim_next else None
+            if row is None:
+                return requeued, None
+            self.db.execute(
+                'UPDATE jobs SET state = ?, attempts = attempts + 1, updated = ? WHERE id = ?',
+                (RUNNING, time.time(), row['id'])
+            )
+        job = self.row_to_job(row)
+        job['state'] = RUNNING
+        job['attempts'] += 1
+        return requeued, job
+    
+    def next_wakeup(self, owner=None, batch=None):
+        """Time of the earliest queued retry, None when nothing is waiting"""
+        query = 'SELECT MIN(next_attempt) FROM jobs WHERE state = ? AND owner = ?'
+        params = [QUEUED, owner or os.getpid()]
+        if batch is not None:
+            query += ' AND batch = ?'
+            params.append(batch)
+        with self.lock:
+            return self.db.execute(query, params).fetchone()[0]
+    
+    def complete(self, job_id, result):
+        with self.lock, self.transaction():
+            self.db.execute(
+                'UPDATE jobs SET state = ?, result = ?, last_error = NULL, updated = ? WHERE id = ?',
+                (DONE, json.dumps(result), time.time(), job_id)
+            )
+    
+    def record_outcome(self, job, result):
+        """Complete or fail a job inside the caller's transaction, True when requeued"""
+        if not result.get('success'):
+            return self.record_failure(job, result)
+        self.db.execute(
+            'UPDATE jobs SET state = ?, result = ?, last_error = NULL, updated = ? WHERE id = ?',
+            (DONE, json.dumps(result), time.time(), job['id'])
+        )
+        return False
+    
+    def backoff(self, attempts):
+        """Exponential backoff with jitter for the given attempt count"""
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+    
+    def fail(self, job, result):
+        """Record a failed attempt; returns True when the job was requeued
+        
+        Retryable failures are rescheduled with backoff until
+        max_attempts, everything else goes to the dead-letter list.
+        """
+        with self.lock, self.transaction():
+            return self.record_failure(job, result)
+    
+    def record_failure(self, job, result):
+        now = time.time()
+        error = result.get('error')
+        retry = is_retryable(result) and job['attempts'] < self.max_attempts
+        if retry:
+            self.db.execute(
+                'UPDATE jobs SET state = ?, next_attempt = ?, last_error = ?, updated = ? WHERE id = ?',
+                (QUEUED, now + self.backoff(job['attempts']), error, now, job['id'])
+            )
+        else:
+            self.db.execute(
+                'UPDATE jobs SET state = ?, result = ?, last_error = ?, updated = ? WHERE id = ?',
+                (DEAD, json.dumps(result), error, now, job['id'])
+            )
+        return retry
+    
+    def recover(self, owner=None, startup=False):
+        """Adopt jobs of processes that died; returns how many were taken over
+        
+        Jobs that were running go back to the queue without using up an
+        attempt, the upload never finished.  With startup=True, jobs
+        carrying our own pid are also taken back (left behind by an
+        earlier process that had the same pid).
+        """
+        owner = owner or os.getpid()
+        with self.lock:
+            owners = [row[0] for row in self.db.execute(
+                'SELECT DISTINCT owner FROM jobs WHERE state IN (?, ?)', (QUEUED, RUNNING)
+            )]
+        dead = [o for o in owners if o != owner and not pid_alive(o)]
+        if startup and owner in owners:
+            dead.append(owner)
+        
+        adopted = 0
+        now = time.time()
+        with self.lock, self.transaction():
+            for old_owner in dead:
+                cursor = self.db.execute(
+                    'UPDATE jobs SET state = ?, attempts = MAX(attempts - (state = ?), 0), owner = ?, updated = ? '
+                    'WHERE owner IS ? AND state IN (?, ?)',
+                    (QUEUED, RUNNING, owner, now, old_owner, QUEUED, RUNNING)
+                )
+                adopted += cursor.rowcount
+        return adopted
+    
+    # Inspection and editing (Upload Manager Active tab)
+    
+    def list(self, states=(QUEUED, RUNNING), batch=None, limit=None):
+        """Jobs in execution order: running first, then by priority and rank"""
+        placeholders = ', '.join('?' * len(states))
+        query = f'SELECT * FROM jobs WHERE state IN ({placeholders})'
+        params = list(states)
+        if batch is not None:
+            query += ' AND batch = ?'
+            params.append(batch)
+        query += ' ORDER BY state = ? DESC, priority DESC, rank, id'
+        params.append(RUNNING)
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        with self.lock:
+            rows = self.db.execute(query, params).fetchall()
+        return [self.row_to_job(row) for row in rows]
+    
+    def get(self, job_id):
+        with self.lock:
+            row = self.db.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return self.row_to_job(row) if row else None
+    
+    def batch_counts(self, batch):
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT state, COUNT(*) FROM jobs WHERE batch = ? GROUP BY state', (batch,)
+            ).fetchall()
+        return {state: count for state, count in rows}
+    
+    def counts(self):
+        """Number of jobs in every state, over all batches"""
+        with self.lock:
+            rows = self.db.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        return {state: count for state, count in rows}
+    
+    def active(self, owner=None, batch=None):
+        """Number of jobs still queued or running, for one owner or batch"""
+        query = 'SELECT COUNT(*) FROM jobs WHERE state IN (?, ?)'
+        params = [QUEUED, RUNNING]
+        if owner is not None:
+            query += ' AND owner = ?'
+            params.append(owner)
+        if batch is not None:
+            query += ' AND batch = ?'
+            params.append(batch)
+        with self.lock:
+            return self.db.execute(query, params).fetchone()[0]
+    
+    def batch_active(self, batch):
+        """Number of jobs of the batch still queued or running"""
+        return self.active(batch=batch)
+    
+    def batch_results(self, batch):
+        """Final results of a batch in submission order"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT * FROM jobs WHERE batch = ? ORDER BY seq', (batch,)
+            ).fetchall()
+        results = []
+        for row in rows:
+            job = self.row_to_job(row)
+            if job['result'] is not None:
+                results.append(job['result'])
+            else:
+                results.append({
+                    'success': False,
+                    'error': 'Cancelled' if job['state'] == CANCELLED else f"Upload {job['state']}",
+                    'filename': os.path.basename(job['path'])
+                })
+        return results
+    
+    def set_priority(self, job_id, priority):
+        with self.lock, self.transaction():
+            self.db.execute(
+                'UPDATE jobs SET priority = ?, updated = ? WHERE id = ?', (priority, time.time(), job_id)
+            )
+    
+    def move(self, job_id, before=None):
+        """Move a queued job in front of job 'before', or to the end of the queue"""
+        with self.lock, self.transaction():
+            if before is None:
+                row = self.db.execute(
+                    'SELECT MIN(priority), MAX(rank) FROM jobs WHERE state = ?', (QUEUED,)
+                ).fetchone()
+                priority, rank = row[0] or 0, (row[1] or 0) + 1
+            else:
+                target = self.db.execute(
+                    'SELECT priority, rank, id FROM jobs WHERE id = ?', (before,)
+                ).fetchone()
+                if target is None:
+                    return False
+                priority = target['priority']
+                previous = self.db.execute(
+                    'SELECT MAX(rank) FROM jobs WHERE state = ? AND priority = ? AND id != ? '
+                    'AND (rank < ? OR (rank = ? AND id < ?))',
+                    (QUEUED, priority, job_id, target['rank'], target['rank'], target['id'])
+                ).fetchone()[0]
+                rank = (previous + target['rank']) / 2 if previous is not None else target['rank'] - 1
+            self.db.execute(
+                'UPDATE jobs SET priority = ?, rank = ?, updated = ? WHERE id = ? AND state = ?',
+                (priority, rank, time.time(), job_id, QUEUED)
+            )
+        return True
+    
+    def cancel(self, job_id=None, batch=None):
+        """Cancel queued jobs (one job or a whole batch); running ones finish"""
+        query = 'UPDATE jobs SET state = ?, updated = ? WHERE state = ?'
+        params = [CANCELLED, time.time(), QUEUED]
+        if job_id is not None:
+            query += ' AND id = ?'
+            params.append(job_id)
+        if batch is not None:
+            query += ' AND batch = ?'
+            params.append(batch)
+        with self.lock, self.transaction():
+            return self.db.execute(query, params).rowcount
+    
+    def dead_letters(self, limit=100):
+        return self.list(states=(DEAD,), limit=limit)
+    
+    def retry(self, job_id, owner=None):
+        """Put a dead-lettered job back into the queue"""
+        with self.lock, self.transaction():
+            return self.db.execute(
+                'UPDATE jobs SET state = ?, attempts = 0, next_attempt = 0, result = NULL, '
+                'owner = ?, updated = ? WHERE id = ? AND state = ?',
+                (QUEUED, owner or os.getpid(), time.time(), job_id, DEAD)
+            ).rowcount > 0
+    
+    def purge(self, older_than=7 * 86400):
+        """Forget finished, cancelled and dead-lettered jobs older than the given age"""
+        with self.lock, self.transaction():
+            return self.db.execute(
+                'DELETE FROM jobs WHERE state IN (?, ?, ?) AND updated < ?',
+                (DONE, CANCELLED, DEAD, time.time() - older_than)
+            ).rowcount
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+        return self.db
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.db.execute('COMMIT')
+        else:
+            self.db.execute('ROLLBACK')
+
+class QueueRunner:
+    """Worker threads that drain an UploadQueue through a handler
+    
+    handler(job) returns an upload result dict.  Successful results
+    complete the job, failures are retried or dead-lettered by the
+    queue.  on_result(job, result, final) is called after every attempt.
+    With batch set only that batch is worked on, otherwise every job of
+    this owner.
+    """
+    
+    def __init__(self, queue, handler, workers=4, owner=None, batch=None, on_result=None):
+        self.queue = queue
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.owner = owner or os.getpid()
+        self.batch = batch
+        self.on_result = on_result
+        self.condition = threading.Condition()
+        self.running = False
+        self.threads = []
+    
+    def start(self):
+        self.running = True
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name=f'mros-queue-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+    
+    def wake(self):
+        """Tell idle workers that new jobs may be ready"""
+        with self.condition:
+            self.condition.notify_all()
+    
+    def stop(self, wait=True):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+        self.threads = []
+    
+    def wait_idle(self, owner_timeout=1.0):
+        """Sleep until work may be ready (new job, retry due or stop)"""
+        wakeup = self.queue.next_wakeup(self.owner, self.batch)
+        timeout = owner_timeout if wakeup is None else min(max(wakeup - time.time(), 0.01), owner_timeout)
+        with self.condition:
+            if self.running:
+                self.condition.wait(timeout)
+    
+    def work(self):
+        job = None
+        # A claimed job is always run, even when stop() came meanwhile
+        while job is not None or self.running:
+            if job is None:
+                job = self.queue.claim(self.owner, self.batch)
+            if job is None:
+                self.wait_idle()
+                continue
+            
+            try:
+                result = self.handler(job)
+            except Exception as e:
+                result = {
+                    'success': False,
+                    'error': f"Upload error: {e}",
+                    'filename': os.path.basename(job['path'])
+                }
+            
+            # Record this job and take the next one in a single commit
+            requeued, next_job = self.queue.settle_and_claim(
+                (job, result), self.owner, self.batch, claim_next=self.running
+            )
+            if self.on_result:
+                self.on_result(job, result, not requeued)
+            self.wake()
+            job = next_job
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Records
+History records and result dicts shared by the upload services and the daemon client
+"""
+
+import time
+import asyncio
+import hashlib
+
+def retryable_errors():
+    """Network trouble is worth another try, a missing file is not
+    
+    Imported on first use, the daemon client loads this module and
+    sticks to the standard library.
+    """
+    import requests
+    from upload_resume import ResumableUploadError
+    return (requests.ConnectionError, requests.Timeout, ResumableUploadError, ConnectionError,
+            TimeoutError, asyncio.TimeoutError, asyncio.IncompleteReadError)
+
+def new_record(filename, filepath, backend, size=None, mime_type=None, content_hash=None, **extra):
+    """History record of an upload that is about to start"""
+    record = {
+        'filename': filename,
+        'filepath': str(filepath),
+        'size': size,
+        'mime_type': mime_type,
+        'content_hash': content_hash,
+        'timestamp': time.time(),
+        'status': 'uploading',
+        'backend': backend.describe()
+    }
+    record.update(extra)
+    return record
+
+def complete_record(record, download_url, sent_hash, verify=None):
+    """Mark a record completed; sent_hash is the digest of the bytes the backend stores"""
+    record.update({
+        'status': 'completed',
+        'download_url': download_url,
+        'upload_id': hashlib.md5(download_url.encode()).hexdigest()[:8],
+        'content_hash': record.get('content_hash') or sent_hash,
+        'digest': sent_hash
+    })
+    if verify:
+        record['verified'] = verify
+    return record
+
+def fail_record(record, error):
+    record.update({'status': 'failed', 'error': error})
+    return record
+
+def success_result(filename, download_url, size, digest, **extra):
+    result = {
+        'success': True,
+        'url': download_url,
+        'filename': filename,
+        'size': size,
+        'digest': digest
+    }
+    result.update(extra)
+    return result
+
+def failure_result(filename, error, status_code=None, retryable=False):
+    """Result of a failed upload; the queue retries it when retryable or on a retryable status"""
+    return {
+        'success': False,
+        'error': error,
+        'filename': filename,
+        'status_code': status_code,
+        'retryable': retryable
+    }
+
+def error_result(error, filename):
+    """Result of an upload that raised"""
+    return failure_result(
+        filename,
+        f"Upload error: {str(error) or type(error).__name__}",
+        retryable=isinstance(error, retryable_errors())
+    )
+
+def print_results(results, action='uploaded'):
+    successful = sum(1 for r in results if r['success'])
+    total = len(results)
+    print(f"{'Upload' if action == 'uploaded' else 'Verification'} complete: "
+          f"{successful}/{total} files {action} successfully")
+    
+    for result in results:
+        if result['success']:
+            print(f"✓ {result['filename']}: {result['url']}")
+        else:
+            print(f"✗ {result['filename']}: {result['error']}")
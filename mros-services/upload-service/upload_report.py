@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Report
+Machine-readable batch results: a JSON Lines stream per file and a replayable JSON/CSV manifest
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from pathlib import Path
+
+MANIFEST_VERSION = 1
+
+# Columns of CSV manifests; timings go in as JSON text
+MANIFEST_FIELDS = ('index', 'path', 'filename', 'success', 'size', 'digest', 'url', 'error', 'retries', 'timings')
+
+def report_record(index, path, result):
+    """Flat record of one file's final result; index is its position in the batch"""
+    return {
+        'index': index,
+        'path': os.path.abspath(path),
+        'filename': result.get('filename'),
+        'success': bool(result.get('success')),
+        'size': result.get('size'),
+        'digest': result.get('digest'),
+        'url': result.get('url'),
+        'error': result.get('error'),
+        'retries': max(result.get('attempts', 1) - 1, 0),
+        'timings': result.get('timings'),
+        'finished': round(time.time(), 6)
+    }
+
+class ReportWriter:
+    """Streams a JSON line per finished file and keeps them for the manifest
+    
+    Every line is flushed as soon as it is written, so a consumer
+    tailing the report sees files as they finish.  '-' writes to stdout,
+    None only collects the records.
+    """
+    
+    def __init__(self, target):
+        self.target = target
+        # Only a file we opened is ours to close, stdout may be swapped meanwhile
+        self.owned = target not in (None, '-')
+        if self.owned:
+            self.stream = open(target, 'a', encoding='utf-8')
+        else:
+            self.stream = sys.stdout if target else None
+        self.records = []
+        self.started = time.time()
+        self.lock = threading.Lock()
+    
+    def add(self, index, path, result):
+        """Record a file's final result, an on_result callback for the service"""
+        record = report_record(index, path, result)
+        with self.lock:
+            self.records.append(record)
+            if self.stream is not None:
+                self.stream.write(json.dumps(record, default=str) + '\n')
+                self.stream.flush()
+        return record
+    
+    def summary(self):
+        succeeded = [record for record in self.records if record['success']]
+        return {
+            'files': len(self.records),
+            'succeeded': len(succeeded),
+            'failed': len(self.records) - len(succeeded),
+            'bytes': sum(record['size'] or 0 for record in succeeded),
+            'retries': sum(record['retries'] for record in self.records),
+            'started': round(self.started, 6),
+            'seconds': round(time.time() - self.started, 6)
+        }
+    
+    def close(self):
+        if self.owned:
+            self.stream.close()
+
+def write_manifest(path, records, summary=None):
+    """Write records as a manifest: CSV for a .csv path, JSON otherwise
+    
+    Records are put in batch order and written to a temporary name
+    first, so a manifest that exists is always complete.
+    """
+    path = Path(path)
+    records = sorted(records, key=lambda record: (record.get('index') is None, record.get('index') or 0))
+    temp_path = path.with_name(f'.{path.name}.tmp')
+    with open(temp_path, 'w', encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            for record in records:
+                row = dict(record)
+                row['timings'] = json.dumps(record['timings']) if record.get('timings') else ''
+                writer.writerow(row)
+        else:
+            json.dump({'version': MANIFEST_VERSION, 'summary': summary, 'files': records}, f, indent=2, default=str)
+            f.write('\n')
+    os.replace(temp_path, path)
+
+def load_manifest(path):
+    """Records of a JSON or CSV manifest, or of a JSON Lines report"""
+    path = Path(path)
+    with open(path, encoding='utf-8', newline='') as f:
+        if path.suffix.lower() == '.csv':
+            records = []
+            for row in csv.DictReader(f):
+                row['index'] = int(row['index']) if row.get('index') else None
+                row['success'] = row.get('success') == 'True'
+                row['size'] = int(row['size']) if row.get('size') else None
+                row['retries'] = int(row['retries']) if row.get('retries') else 0
+                row['timings'] = json.loads(row['timings']) if row.get('timings') else None
+                records.append({key: value if value != '' else None for key, value in row.items()})
+            return records
+        text = f.read()
+    try:
+        manifest = json.loads(text)
+    except ValueError:
+        manifest = None
+    if isinstance(manifest, dict) and 'files' in manifest:
+        return manifest['files']
+    # JSON Lines report; the newest line per path wins, a torn last line is ignored
+    records = {}
+    for line in text.splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and 'path' in record:
+            records[record['path']] = record
+    return list(records.values())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+mros-linux Resumable Uploads
+Checkpoint journal and chunked resumable transfer (tus-style ranged appends)
+"""
+
+import os
+import json
+import time
+import random
+import hashlib
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+
+from upload_stream import FileSlice, ProgressTracker
+
+DEFAULT_RESUMABLE_CHUNK_SIZE = 8 * 1024 * 1024
+TUS_VERSION = '1.0.0'
+
+class ResumableUploadError(Exception):
+    """Raised when a resumable transfer cannot make progress"""
+
+class CheckpointJournal:
+    """Per-file checkpoints stored as small JSON files
+    
+    A checkpoint records the server session, the acknowledged offset and
+    the SHA-256 of every acknowledged chunk.  It is rewritten atomically
+    after each chunk so a crash leaves either the old or the new state.
+    """
+    
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+    
+    def path_for(self, file_path):
+        key = hashlib.sha1(str(Path(file_path).resolve()).encode()).hexdigest()
+        return self.directory / f'{key}.json'
+    
+    def load(self, file_path, stat):
+        """Return the checkpoint for file_path if the file is unchanged"""
+        path = self.path_for(file_path)
+        try:
+            with open(path, 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if checkpoint.get('size') != stat.st_size or checkpoint.get('mtime_ns') != stat.st_mtime_ns:
+            # The file changed since the checkpoint was written
+            self.remove(file_path)
+            return None
+        return checkpoint
+    
+    def encryption_salt(self, file_path, signature):
+        """Salt of an interrupted encrypted transfer of the file, None unless its signature is unchanged"""
+        try:
+            with open(self.path_for(file_path), 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not checkpoint.get('salt') or checkpoint.get('signature') != list(signature):
+            return None
+        return bytes.fromhex(checkpoint['salt'])
+    
+    def save(self, checkpoint):
+        path = self.path_for(checkpoint['filepath'])
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(checkpoint, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    
+    def remove(self, file_path):
+        self.path_for(file_path).unlink(missing_ok=True)
+    
+    def list(self):
+        """Return all pending checkpoints"""
+        checkpoints = []
+        for path in sorted(self.directory.glob('*.json')):
+            try:
+                with open(path, 'r') as f:
+                    checkpoints.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return checkpoints
+
+class ResumableUploader:
+    """Uploads a file in chunks and resumes from the last acknowledged one"""
+    
+    def __init__(self, session_pool, endpoint, journal, chunk_size=DEFAULT_RESUMABLE_CHUNK_SIZE,
+                 max_attempts=5, timeout=300):
+        self.session_pool = session_pool
+        self.endpoint = endpoint
+        self.journal = journal
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+    
+    def create_session(self, file_path, stat, source=None):
+        response = self.session_pool.session().post(
+            self.endpoint,
+            headers={
+                'Tus-Resumable': TUS_VERSION,
+                'Upload-Length': str(source.size if source else stat.st_size),
+                'Upload-Filename': source.name if source else file_path.name
+            },
+            timeout=self.timeout
+        )
+        if response.status_code not in (200, 201) or 'Location' not in response.headers:
+            raise ResumableUploadError(f"Could not create upload session: HTTP {response.status_code}")
+        
+        session_url = urljoin(self.endpoint, response.headers['Location'])
+        checkpoint = {
+            'filepath': str(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'session_url': session_url,
+            'session_token': session_url.rstrip('/').rsplit('/', 1)[-1],
+            'chunk_size': self.chunk_size,
+            'offset': 0,
+            'chunk_hashes': [],
+            'source': None,
+            'created': time.time()
+        }
+        if source is not None:
+            checkpoint.update(source.checkpoint_fields())
+        self.journal.save(checkpoint)
+        return checkpoint
+    
+    def query_offset(self, checkpoint):
+        """Ask the server how many bytes it has, None if the session is gone"""
+        response = self.session_pool.session().head(
+            checkpoint['session_url'],
+            headers={'Tus-Resumable': TUS_VERSION},
+            timeout=self.timeout
+        )
+        if response.status_code in (404, 410):
+            return None
+        if response.status_code != 200:
+            raise ResumableUploadError(f"Could not query upload offset: HTTP {response.status_code}")
+        return int(response.headers['Upload-Offset'])
+    
+    def sync_checkpoint(self, checkpoint, server_offset):
+        """Trust the server offset and drop hashes for unacknowledged chunks"""
+        chunk_size = checkpoint['chunk_size']
+        checkpoint['offset'] = server_offset
+        del checkpoint['chunk_hashes'][server_offset // chunk_size:]
+    
+    def verify_last_chunk(self, file_path, checkpoint, source=None):
+        """Re-hash the last acknowledged chunk to catch in-place edits"""
+        hashes = checkpoint['chunk_hashes']
+        if not hashes:
+            return True
+        chunk_size = checkpoint['chunk_size']
+        index = len(hashes) - 1
+        with FileSlice(file_path, index * chunk_size, chunk_size, hasher=hashlib.sha256(),
+                       source=source) as piece:
+            while piece.read():
+                pass
+            return piece.hasher.hexdigest() == hashes[index]
+    
+    def upload(self, file_path, progress_callback=None, throttle=None, digest=None, source=None):
+        """Upload file_path, resuming an earlier attempt when possible
+        
+        Returns the download URL reported by the server.  throttle and
+        digest are passed on to the chunk bodies, see MultipartFileStream;
+        bytes acknowledged before a restart are read once more to bring
+        the digest up to the resume offset.  With a source (EncryptedFile)
+        its bytes are uploaded instead of the file's.
+        """
+        file_path = Path(file_path)
+        stat = file_path.stat()
+        size = source.size if source else stat.st_size
+        
+        checkpoint = self.journal.load(file_path, stat)
+        if checkpoint is not None and checkpoint.get('kind') == 'parts':
+            # Left by a multi-part transfer, whose parts we cannot continue
+            checkpoint = None
+        if checkpoint is not None and checkpoint.get('source') != (source.identity if source else None):
+            # Sent with another (or no) encryption
+            checkpoint = None
+        if checkpoint is not None:
+            server_offset = self.query_offset(checkpoint)
+            if server_offset is None:
+                checkpoint = None
+            else:
+                self.sync_checkpoint(checkpoint, server_offset)
+                if not self.verify_last_chunk(file_path, checkpoint, source):
+                    checkpoint = None
+        if checkpoint is None:
+            self.journal.remove(file_path)
+            checkpoint = self.create_session(file_path, stat, source)
+        
+        chunk_size = checkpoint['chunk_size']
+        progress = ProgressTracker(file_path.name, size, progress_callback, filepath=str(file_path))
+        progress.bytes_sent = checkpoint['offset']
+        
+        attempts = 0
+        download_url = None
+        while checkpoint['offset'] < size or download_url is None:
+            offset = checkpoint['offset']
+            # Realign to chunk boundaries after a partial acknowledgement
+            length = min(chunk_size - offset % chunk_size, size - offset)
+            try:
+                if digest is not None:
+                    digest.catch_up(file_path, offset, source=source)
+                with FileSlice(file_path, offset, length, progress=progress, hasher=hashlib.sha256(),
+                               throttle=throttle, digest=digest, source=source) as piece:
+                    response = self.session_pool.session().patch(
+                        checkpoint['session_url'],
+                        data=piece,
+                        headers={
+                            'Tus-Resumable': TUS_VERSION,
+                            'Upload-Offset': str(offset),
+                            'Content-Type': 'application/offset+octet-stream'
+                        },
+                        timeout=self.timeout
+                    )
+                    chunk_hash = piece.hasher.hexdigest()
+                
+                if response.status_code == 409:
+                    # Server and journal disagree, the server wins
+                    self.sync_checkpoint(checkpoint, int(response.headers['Upload-Offset']))
+                    progress.bytes_sent = checkpoint['offset']
+                    continue
+                if response.status_code not in (200, 204):
+                    raise ResumableUploadError(f"Chunk rejected: HTTP {response.status_code}")
+                
+                new_offset = int(response.headers['Upload-Offset'])
+                if offset % chunk_size == 0 and new_offset == offset + length:
+                    checkpoint['chunk_hashes'].append(chunk_hash)
+                checkpoint['offset'] = new_offset
+                self.journal.save(checkpoint)
+                attempts = 0
+                
+                if new_offset >= size:
+                    download_url = response.headers.get('Upload-Url') or checkpoint['session_url']
+            
+            except (requests.ConnectionError, requests.Timeout, ResumableUploadError) as e:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    raise ResumableUploadError(f"Giving up after {attempts} attempts: {e}")
+                
+                # Back off, then resynchronise with what the server acknowledged
+                time.sleep(min(30, 2 ** attempts) * random.uniform(0.5, 1.0))
+                try:
+                    server_offset = self.query_offset(checkpoint)
+                except (requests.ConnectionError, requests.Timeout, ResumableUploadError):
+                    continue
+                if server_offset is None:
+                    raise ResumableUploadError("Upload session expired on the server")
+                self.sync_checkpoint(checkpoint, server_offset)
+                progress.bytes_sent = checkpoint['offset']
+        
+        if digest is not None:
+            digest.catch_up(file_path, size, source=source)
+        self.journal.remove(file_path)
+        return download_url
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Sendfile
+Zero-copy fast path for raw file bodies: os.sendfile into plain HTTP connections and directories
+"""
+
+import os
+import sys
+import socket
+import threading
+import http.client
+from urllib.parse import urlparse
+
+from upload_metrics import RequestClock
+
+# Bytes per sendfile call; also how often throttle and progress run
+SENDFILE_BLOCK_SIZE = 1024 * 1024
+
+def sendfile_supported(url=None):
+    """Whether file bodies for url (None: local copies) can go out with sendfile
+    
+    Linux only, and not into TLS connections, whose encryption has to
+    happen in user space anyway.
+    """
+    if not (sys.platform.startswith('linux') and hasattr(os, 'sendfile')):
+        return False
+    return url is None or urlparse(url).scheme == 'http'
+
+def file_blocks(fd, offset, count, throttle=None, progress=None, digest=None, block_size=SENDFILE_BLOCK_SIZE):
+    """Yield (offset, size) blocks of a file range for the caller to send
+    
+    Before a block is handed out throttle is called and, when the digest
+    expects it, the block is read into a reused buffer and hashed; after
+    it was sent progress is updated.  Sending is left to the caller, so
+    file data only enters user space when it has to be hashed.
+    """
+    buffer = None
+    end = offset + count
+    while offset < end:
+        size = min(block_size, end - offset)
+        if throttle is not None:
+            throttle(size)
+        if digest is not None and digest.feeds(offset):
+            if buffer is None:
+                buffer = memoryview(bytearray(block_size))
+            if os.preadv(fd, [buffer[:size]], offset) < size:
+                raise IOError("File shrank during upload")
+            digest.update(buffer[:size])
+        yield offset, size
+        offset += size
+        if progress is not None:
+            progress.update(size)
+
+def copy_file(source_fd, target_fd, count, throttle=None, progress=None, digest=None):
+    """Copy the first count bytes of one file into another inside the kernel"""
+    for offset, size in file_blocks(source_fd, 0, count, throttle, progress, digest):
+        while size:
+            sent = os.sendfile(target_fd, source_fd, offset, size)
+            if not sent:
+                raise IOError("File shrank during upload")
+            offset += sent
+            size -= sent
+
+class SendfileResponse:
+    """Status, headers and body of a sendfile request
+    
+    Shaped like a requests response as far as the backends'
+    parse_response looks at it.
+    """
+    
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+    
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+class SendfileConnections:
+    """Keep-alive http.client connections per thread and host
+    
+    urllib3 does not hand out its sockets, so the fast path keeps
+    connections of its own.  They are never shared between threads.
+    """
+    
+    def __init__(self, timeout=300, user_agent='mros-upload-service'):
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.local = threading.local()
+    
+    def connection(self, netloc):
+        connections = getattr(self.local, 'connections', None)
+        if connections is None:
+            connections = self.local.connections = {}
+        if netloc not in connections:
+            parsed = urlparse(f'http://{netloc}')
+            connections[netloc] = http.client.HTTPConnection(parsed.hostname, parsed.port or 80,
+                                                             timeout=self.timeout)
+        return connections[netloc]
+    
+    def post(self, url, stream):
+        """POST a MultipartFileStream, sending the file part with sendfile
+        
+        The stream supplies the framing, the open file, throttle, digest
+        and progress tracker.  A reused connection that turns out to be
+        closed by the server is replaced once and the body sent again.
+        """
+        parsed = urlparse(url)
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        conn = self.connection(parsed.netloc)
+        
+        for attempt in range(2):
+            reused = conn.sock is not None
+            stream.progress.bytes_sent = 0
+            clock = RequestClock()
+            try:
+                if not reused:
+                    conn.connect()
+                    # The epilogue is a small write after the file; don't let Nagle hold it back
+                    conn.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                conn.putrequest('POST', path, skip_accept_encoding=True)
+                conn.putheader('User-Agent', self.user_agent)
+                conn.putheader('Accept-Encoding', 'identity')
+                conn.putheader('Content-Type', stream.content_type)
+                conn.putheader('Content-Length', str(len(stream)))
+                conn.endheaders(stream.preamble)
+                clock.mark(stream.preamble)
+                
+                fd = stream.file.fileno()
+                for offset, size in file_blocks(fd, 0, stream.file_size, stream.throttle,
+                                                stream.progress, stream.digest):
+                    if conn.sock.sendfile(stream.file, offset, size) < size:
+                        raise IOError(f"File shrank during upload: {stream.file_path}")
+                conn.send(stream.epilogue)
+                clock.mark(b'')
+                
+                response = conn.getresponse()
+                content = response.read()
+                clock.finish()
+                if response.will_close:
+                    conn.close()
+                return SendfileResponse(response.status, response.headers, content)
+            except (ConnectionError, http.client.HTTPException):
+                conn.close()
+                if not reused or attempt:
+                    raise
+            except BaseException:
+                conn.close()
+                raise
+    
+    def close(self):
+        for conn in getattr(self.local, 'connections', {}).values():
+            conn.close()
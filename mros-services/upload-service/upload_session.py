@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Session Pool
+Long-lived HTTP connection pool with keep-alive and retries for uploads
+"""
+
+import threading
+import weakref
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+class UploadSessionPool:
+    """Thread-safe source of requests sessions that share warm connections
+    
+    requests.Session is not guaranteed to be thread-safe, but the urllib3
+    pool manager inside an HTTPAdapter is.  Every thread therefore gets its
+    own lightweight Session while all of them mount the same adapter, so a
+    connection opened by one upload thread is reused by the next one.
+    """
+    
+    def __init__(self, pool_connections=4, pool_maxsize=16, max_retries=3,
+                 backoff_factor=0.5, user_agent='mros-upload-service'):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.user_agent = user_agent
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.generation = 0
+        self.sessions = weakref.WeakSet()
+        self.adapter = self.create_adapter()
+    
+    def create_adapter(self):
+        """Create the shared adapter with pool sizing and retry policy"""
+        # Connection errors are retried for every method because no body
+        # has been sent yet; read and status retries only apply to
+        # idempotent requests so an upload body is never replayed blindly.
+        retries = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=self.max_retries,
+            status=self.max_retries,
+            backoff_factor=self.backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status=False
+        )
+        return HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retries,
+            pool_block=False
+        )
+    
+    def session(self):
+        """Return the calling thread's session bound to the shared adapter"""
+        session = getattr(self.local, 'session', None)
+        if session is None or self.local.generation != self.generation:
+            with self.lock:
+                session = requests.Session()
+                session.headers['User-Agent'] = self.user_agent
+                session.headers['Connection'] = 'keep-alive'
+                session.mount('http://', self.adapter)
+                session.mount('https://', self.adapter)
+                self.sessions.add(session)
+                self.local.session = session
+                self.local.generation = self.generation
+        return session
+    
+    def ensure_capacity(self, pool_maxsize):
+        """Grow the per-host pool when a caller needs more connections"""
+        with self.lock:
+            if pool_maxsize <= self.pool_maxsize:
+                return
+            self.pool_maxsize = pool_maxsize
+            old_adapter = self.adapter
+            self.adapter = self.create_adapter()
+            self.generation += 1
+        old_adapter.close()
+    
+    def close(self):
+        """Close all pooled connections"""
+        with self.lock:
+            for session in list(self.sessions):
+                session.close()
+            self.sessions = weakref.WeakSet()
+            self.generation += 1
+            self.adapter.close()
+            self.adapter = self.create_adapter()
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+def get_shared_pool(pool_maxsize=16, **kwargs):
+    """Return the process-wide session pool, creating it on first use"""
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = UploadSessionPool(pool_maxsize=pool_maxsize, **kwargs)
+            return _shared_pool
+    _shared_pool.ensure_capacity(pool_maxsize)
+    return _shared_pool
@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Stand-in Server
+Local HTTP server that mimics the upload host for offline testing
+"""
+
+import sys
+import os
+import json
+import re
+import random
+import threading
+import time
+import uuid
+import email.parser
+import email.policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import quote, unquote, urlparse
+
+TUS_VERSION = '1.0.0'
+
+class StandinRequestHandler(BaseHTTPRequestHandler):
+    """Handles plain multipart uploads, tus-style resumable uploads, downloads and deletes"""
+    
+    protocol_version = 'HTTP/1.1'
+    server_version = 'mros-upload-standin'
+    
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+    
+    # Helpers
+    
+    def send_text(self, status, text='', headers=None):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+    
+    def pace(self, received):
+        """Sleep so the body is not read faster than the configured bandwidth"""
+        if not self.server.bandwidth:
+            return
+        ahead = received / self.server.bandwidth - (time.monotonic() - self.body_started)
+        if ahead > 0:
+            time.sleep(ahead)
+    
+    def simulate(self):
+        """Apply the configured latency, True when this request should fail"""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        return self.server.error_rate and self.server.random.random() < self.server.error_rate
+    
+    def read_body(self, sink=None):
+        """Read the request body, copying it to sink when given"""
+        self.body_started = time.monotonic()
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            return self.read_chunked_body(sink)
+        
+        length = int(self.headers.get('Content-Length') or 0)
+        read_size = 64 * 1024 if self.server.bandwidth else 1024 * 1024
+        data = []
+        remaining = length
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, read_size))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            self.pace(length - remaining)
+            if sink:
+                sink.write(chunk)
+            else:
+                data.append(chunk)
+        return length - remaining, b''.join(data)
+    
+    def read_chunked_body(self, sink=None):
+        """Decode a Transfer-Encoding: chunked request body"""
+        data = []
+        received = 0
+        while True:
+            size_line = self.rfile.readline(65537)
+            if not size_line:
+                break
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # Skip optional trailers up to the blank line
+                while self.rfile.readline(65537) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunk = self.rfile.read(size)
+            self.rfile.read(2)
+            received += len(chunk)
+            self.pace(received)
+            if sink:
+                sink.write(chunk)
+            else:
+                data.append(chunk)
+        return received, b''.join(data)
+    
+    def public_url(self, name):
+        host = self.headers.get('Host') or f'{self.server.server_address[0]}:{self.server.server_port}'
+        return f'http://{host}/{quote(name)}'
+    
+    def requested_object(self):
+        """Stored file named by the request path, None if there is none"""
+        return self.server.object_path(unquote(urlparse(self.path).path).lstrip('/'))
+    
+    # Plain uploads
+    
+    def do_POST(self):
+        if self.path.rstrip('/') == '/files':
+            return self.create_resumable()
+        
+        if self.server.discard:
+            return self.discard_upload()
+        
+        # Multipart form upload, answered with the download URL like bashupload
+        content_type = self.headers.get('Content-Type', '')
+        _, body = self.read_body()
+        if self.simulate():
+            return self.send_text(503, 'injected failure\n')
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1') + b'\r\n\r\n' + body
+        )
+        
+        if not message.is_multipart():
+            return self.send_text(400, 'expected multipart/form-data\n')
+        
+        for part in message.iter_parts():
+            filename = part.get_filename()
+            if filename is None:
+                continue
+            name = self.server.store_object(filename, part.get_payload(decode=True))
+            return self.send_text(200, self.public_url(name) + '\n')
+        
+        self.send_text(400, 'no file field\n')
+    
+    def discard_upload(self):
+        """Sink mode: count the body, keep only the file name from its head"""
+        sink = DiscardSink()
+        received, _ = self.read_body(sink=sink)
+        if self.simulate():
+            return self.send_text(503, 'injected failure\n')
+        match = re.search(rb'filename="([^"\r\n]*)"', sink.head)
+        filename = match.group(1).decode('utf-8', 'replace') if match else 'upload.bin'
+        with self.server.lock:
+            self.server.bytes_received += received
+            self.server.uploads_received += 1
+        self.send_text(200, self.public_url(f'{uuid.uuid4().hex[:8]}-{Path(filename).name}') + '\n')
+    
+    # Resumable uploads (tus 1.0 core, creation, termination and concatenation)
+    
+    def do_OPTIONS(self):
+        self.send_text(204, headers={
+            'Tus-Resumable': TUS_VERSION,
+            'Tus-Version': TUS_VERSION,
+            'Tus-Extension': 'creation,termination,concatenation'
+        })
+    
+    def create_resumable(self):
+        concat = self.headers.get('Upload-Concat', '')
+        if concat.startswith('final;'):
+            return self.concatenate(concat[len('final;'):].split())
+        
+        try:
+            length = int(self.headers['Upload-Length'])
+        except (TypeError, ValueError):
+            return self.send_text(400, 'Upload-Length required\n')
+        
+        self.read_body()
+        filename = self.headers.get('Upload-Filename') or 'upload.bin'
+        token = self.server.create_session(filename, length, partial=concat == 'partial')
+        self.send_text(201, headers={
+            'Location': f'/files/{token}',
+            'Tus-Resumable': TUS_VERSION,
+            'Upload-Offset': 0
+        })
+    
+    def concatenate(self, part_urls):
+        """Join finished partial uploads, in the given order, into one object"""
+        self.read_body()
+        sessions = []
+        for url in part_urls:
+            session = self.lookup_session(urlparse(url).path)
+            if session is None or not session.get('partial'):
+                return self.send_text(404, f'unknown partial upload {url}\n')
+            if session['offset'] < session['length']:
+                return self.send_text(400, f'partial upload {url} is incomplete\n')
+            sessions.append(session)
+        if self.simulate():
+            return self.send_text(503, 'injected failure\n')
+        
+        filename = self.headers.get('Upload-Filename') or 'upload.bin'
+        name = self.server.concatenate_sessions(sessions, filename)
+        self.send_text(201, headers={
+            'Location': self.public_url(name),
+            'Tus-Resumable': TUS_VERSION,
+            'Upload-Url': self.public_url(name)
+        })
+    
+    def do_HEAD(self):
+        session = self.lookup_session()
+        if session is not None:
+            return self.send_text(200, headers={
+                'Upload-Offset': session['offset'],
+                'Upload-Length': session['length'],
+                'Tus-Resumable': TUS_VERSION,
+                'Cache-Control': 'no-store'
+            })
+        if self.path.startswith('/files/'):
+            return self.send_text(404)
+        self.send_object(head=True)
+    
+    def do_PATCH(self):
+        session = self.lookup_session()
+        if session is None:
+            self.read_body()
+            return self.send_text(404, 'unknown upload session\n')
+        
+        with session['lock']:
+            try:
+                offset = int(self.headers['Upload-Offset'])
+            except (TypeError, ValueError):
+                self.read_body()
+                return self.send_text(400, 'Upload-Offset required\n')
+            
+            if offset != session['offset']:
+                self.read_body()
+                return self.send_text(409, 'offset mismatch\n', {'Upload-Offset': session['offset']})
+            
+            if self.simulate():
+                self.read_body()
+                return self.send_text(503, 'injected failure\n')
+            
+            with open(session['path'], 'r+b') as f:
+                f.seek(offset)
+                received, _ = self.read_body(sink=f)
+            
+            session['offset'] = min(offset + received, session['length'])
+            self.server.save_session(session)
+            
+            headers = {'Upload-Offset': session['offset'], 'Tus-Resumable': TUS_VERSION}
+            # Partial uploads wait for the final concatenation request
+            if session['offset'] >= session['length'] and not session.get('partial'):
+                name = self.server.finish_session(session)
+                headers['Upload-Url'] = self.public_url(name)
+            self.send_text(204, headers=headers)
+    
+    def lookup_session(self, path=None):
+        match = re.fullmatch(r'/files/([0-9a-f]+)', path or self.path)
+        return self.server.sessions.get(match.group(1)) if match else None
+    
+    # Deletes
+    
+    def do_DELETE(self):
+        session = self.lookup_session()
+        if session is not None:
+            # tus termination: drop an unfinished upload
+            self.server.finish_session(session, keep=False)
+            return self.send_text(204)
+        
+        path = self.requested_object()
+        if path is None:
+            return self.send_text(404, 'not found\n')
+        path.unlink(missing_ok=True)
+        self.send_text(204)
+    
+    # Downloads
+    
+    def do_GET(self):
+        self.send_object()
+    
+    def send_object(self, head=False):
+        path = self.requested_object()
+        if path is None:
+            return self.send_text(404, 'not found\n')
+        
+        size = path.stat().st_size
+        start, end = 0, size - 1
+        status = 200
+        match = re.fullmatch(r'bytes=(\d*)-(\d*)', self.headers.get('Range', ''))
+        if match and size:
+            if match.group(1):
+                start = int(match.group(1))
+                end = int(match.group(2)) if match.group(2) else size - 1
+            else:
+                start = max(size - int(match.group(2)), 0)
+            end = min(end, size - 1)
+            if start > end:
+                return self.send_text(416, headers={'Content-Range': f'bytes */{size}'})
+            status = 206
+        
+        self.send_response(status)
+        self.send_header('Content-Length', str(max(end - start + 1, 0)))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if head or not size:
+            return
+        
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 1024 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+class DiscardSink:
+    """Write target that keeps the first few KB and drops the rest"""
+    
+    def __init__(self, keep=4096):
+        self.keep = keep
+        self.head = b''
+    
+    def write(self, data):
+        if len(self.head) < self.keep:
+            self.head += data[:self.keep - len(self.head)]
+
+class UploadStandinServer(ThreadingHTTPServer):
+    """Threaded stand-in server storing uploads in a local directory
+    
+    For benchmarks it can simulate a worse network: latency seconds
+    added to every upload request, bandwidth (bytes/s) caps how fast
+    each request body is read, and error_rate is the share of uploads
+    answered with 503.  With discard=True plain uploads are only counted,
+    not stored.
+    """
+    
+    daemon_threads = True
+    request_queue_size = 128
+    
+    def __init__(self, address=('127.0.0.1', 0), storage_dir=None, verbose=False,
+                 latency=0.0, bandwidth=0, error_rate=0.0, discard=False, seed=None):
+        super().__init__(address, StandinRequestHandler)
+        if storage_dir is None:
+            import tempfile
+            storage_dir = tempfile.mkdtemp(prefix='mros-standin-')
+        self.storage_dir = Path(storage_dir)
+        self.sessions_dir = self.storage_dir / '.sessions'
+        self.sessions_dir.mkdir(parents=True, exist_ok=True)
+        self.verbose = verbose
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.discard = discard
+        self.random = random.Random(seed)
+        self.bytes_received = 0
+        self.uploads_received = 0
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.load_sessions()
+    
+    @property
+    def url(self):
+        return f'http://{self.server_address[0]}:{self.server_port}'
+    
+    def object_path(self, name):
+        if not name or '/' in name or name.startswith('.'):
+            return None
+        path = self.storage_dir / name
+        return path if path.is_file() else None
+    
+    def store_object(self, filename, data):
+        """Store a complete object and return its public name"""
+        name = f'{uuid.uuid4().hex[:8]}-{Path(filename).name}'
+        with open(self.storage_dir / name, 'wb') as f:
+            f.write(data)
+        return name
+    
+    def create_session(self, filename, length, partial=False):
+        token = uuid.uuid4().hex
+        path = self.sessions_dir / f'{token}.part'
+        with open(path, 'wb') as f:
+            f.truncate(length)
+        session = {
+            'token': token,
+            'filename': Path(filename).name,
+            'length': length,
+            'offset': 0,
+            'partial': partial,
+            'path': path,
+            'lock': threading.Lock()
+        }
+        with self.lock:
+            self.sessions[token] = session
+        self.save_session(session)
+        return token
+    
+    def save_session(self, session):
+        state = {k: v for k, v in session.items() if k not in ('lock', 'path')}
+        with open(self.sessions_dir / f"{session['token']}.json", 'w') as f:
+            json.dump(state, f)
+    
+    def load_sessions(self):
+        # Sessions survive a stand-in restart so resume can be exercised
+        for state_file in self.sessions_dir.glob('*.json'):
+            try:
+                with open(state_file, 'r') as f:
+                    session = json.load(f)
+            except (OSError, ValueError):
+                continue
+            session['path'] = self.sessions_dir / f"{session['token']}.part"
+            session['lock'] = threading.Lock()
+            if session['path'].exists():
+                self.sessions[session['token']] = session
+    
+    def finish_session(self, session, keep=True):
+        name = f"{session['token'][:8]}-{session['filename']}"
+        if keep:
+            os.replace(session['path'], self.storage_dir / name)
+        else:
+            session['path'].unlink(missing_ok=True)
+        (self.sessions_dir / f"{session['token']}.json").unlink(missing_ok=True)
+        with self.lock:
+            self.sessions.pop(session['token'], None)
+        return name
+    
+    def concatenate_sessions(self, sessions, filename):
+        """Move the first part into place, append the others and drop them"""
+        first = sessions[0]
+        with open(first['path'], 'ab') as f:
+            for session in sessions[1:]:
+                with open(session['path'], 'rb') as part:
+                    while chunk := part.read(1024 * 1024):
+                        f.write(chunk)
+        first['filename'] = Path(filename).name
+        name = self.finish_session(first)
+        for session in sessions[1:]:
+            self.finish_session(session, keep=False)
+        return name
+
+def main():
+    """Run the stand-in server from the command line"""
+    args = sys.argv[1:]
+    if '--help' in args:
+        print("Usage: upload_standin.py [--port <port>] [--dir <storage_dir>] [--verbose]")
+        print("                         [--latency <s>] [--bandwidth <bytes/s>] [--error-rate <0..1>] [--discard]")
+        return
+    
+    port = 8080
+    storage_dir = None
+    if '--port' in args:
+        port = int(args[args.index('--port') + 1])
+    if '--dir' in args:
+        storage_dir = args[args.index('--dir') + 1]
+    
+    def option(name, cast):
+        return cast(args[args.index(name) + 1]) if name in args else cast(0)
+    
+    server = UploadStandinServer(
+        ('127.0.0.1', port),
+        storage_dir,
+        verbose='--verbose' in args,
+        latency=option('--latency', float),
+        bandwidth=option('--bandwidth', int),
+        error_rate=option('--error-rate', float),
+        discard='--discard' in args
+    )
+    print(f"Upload stand-in listening on {server.url}, storing in {server.storage_dir}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Stream
+Streaming multipart/form-data encoder with byte-level progress reporting
+"""
+
+import os
+import time
+import uuid
+
+DEFAULT_CHUNK_SIZE = 256 * 1024
+
+class ProgressTracker:
+    """Turns byte counts into progress events with rate and ETA"""
+    
+    def __init__(self, filename, total, callback=None, interval=0.25, filepath=None):
+        self.filename = filename
+        self.filepath = filepath or filename
+        self.total = total
+        self.callback = callback
+        self.interval = interval
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self.last_report = 0.0
+        self.rate = 0.0
+    
+    def update(self, nbytes):
+        """Account for nbytes more sent and report if the interval elapsed"""
+        self.bytes_sent += nbytes
+        if not self.callback:
+            return
+        
+        now = time.monotonic()
+        finished = self.total is not None and self.bytes_sent >= self.total
+        if now - self.last_report >= self.interval or finished:
+            self.last_report = now
+            self.report(now)
+    
+    def report(self, now=None):
+        """Send the current progress to the callback"""
+        now = now or time.monotonic()
+        elapsed = max(now - self.started, 1e-6)
+        current_rate = self.bytes_sent / elapsed
+        # Smooth the rate so the ETA does not jump around on bursty links
+        self.rate = current_rate if not self.rate else 0.7 * self.rate + 0.3 * current_rate
+        eta = None
+        if self.total is not None and self.rate > 0:
+            eta = max(self.total - self.bytes_sent, 0) / self.rate
+        
+        self.callback({
+            'filename': self.filename,
+            'filepath': self.filepath,
+            'bytes_sent': self.bytes_sent,
+            'total': self.total,
+            'rate': self.rate,
+            'eta': eta,
+            'elapsed': elapsed
+        })
+
+class MultipartFileStream:
+    """File-like multipart body that reads the file one chunk at a time
+    
+    requests uses len() for the Content-Length header and then calls
+    read() repeatedly, so only one chunk of the file is ever in memory.
+    throttle(nbytes), when given, is called before each chunk is handed
+    out and may block to enforce a bandwidth cap.  digest, a
+    StreamDigest, is fed the file's bytes on their way out.
+    """
+    
+    def __init__(self, file_path, field_name='file', filename=None, mime_type=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE, progress_callback=None, throttle=None, digest=None):
+        self.file_path = str(file_path)
+        self.filename = filename or os.path.basename(self.file_path)
+        self.mime_type = mime_type or 'application/octet-stream'
+        self.chunk_size = chunk_size
+        self.throttle = throttle
+        self.digest = digest
+        self.boundary = uuid.uuid4().hex
+        
+        safe_name = self.filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+        self.preamble = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+            f'Content-Type: {self.mime_type}\r\n'
+            '\r\n'
+        ).encode('utf-8')
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        
+        self.file = open(self.file_path, 'rb')
+        self.file_size = os.fstat(self.file.fileno()).st_size
+        self.length = len(self.preamble) + self.file_size + len(self.epilogue)
+        self.position = 0
+        self.progress = ProgressTracker(
+            self.filename,
+            self.file_size,
+            progress_callback,
+            filepath=self.file_path
+        )
+    
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+    
+    def __len__(self):
+        return self.length
+    
+    def read(self, size=-1):
+        """Return the next slice of the multipart body"""
+        if size is None or size < 0:
+            size = self.chunk_size
+        
+        preamble_end = len(self.preamble)
+        file_end = preamble_end + self.file_size
+        
+        if self.position < preamble_end:
+            data = self.preamble[self.position:self.position + size]
+        elif self.position < file_end:
+            data = self.file.read(min(size, self.chunk_size, file_end - self.position))
+            if not data:
+                raise IOError(f"File shrank during upload: {self.file_path}")
+            if self.throttle:
+                self.throttle(len(data))
+            if self.digest is not None and self.digest.feeds(self.position - preamble_end):
+                self.digest.update(data)
+            self.progress.update(len(data))
+        else:
+            offset = self.position - file_end
+            data = self.epilogue[offset:offset + size]
+        
+        self.position += len(data)
+        return data
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class MultipartChunkStream:
+    """Multipart body around an iterable of chunks of unknown total size
+    
+    Has no len(), so requests sends it with chunked transfer encoding.
+    """
+    
+    def __init__(self, chunks, filename, field_name='file', mime_type=None,
+                 progress_callback=None, total=None, throttle=None):
+        self.chunks = chunks
+        self.throttle = throttle
+        self.filename = filename
+        self.boundary = uuid.uuid4().hex
+        safe_name = filename.replace('"', '%22').replace('\r', '').replace('\n', '')
+        self.preamble = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{safe_name}"\r\n'
+            f'Content-Type: {mime_type or "application/octet-stream"}\r\n'
+            '\r\n'
+        ).encode('utf-8')
+        self.epilogue = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.progress = ProgressTracker(filename, total, progress_callback)
+    
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.boundary}'
+    
+    def __iter__(self):
+        yield self.preamble
+        for chunk in self.chunks:
+            if chunk:
+                if self.throttle:
+                    self.throttle(len(chunk))
+                self.progress.update(len(chunk))
+                yield chunk
+        if self.progress.callback:
+            self.progress.report()
+        yield self.epilogue
+
+class FileSlice:
+    """File-like view of bytes [offset, offset + length) of a file
+    
+    Used for resumable chunks and multi-part ranges: the slice is read in
+    chunk_size pieces, optionally fed to a hash object, the file's
+    StreamDigest and the progress tracker as it goes.  With a source
+    (an EncryptedFile) the slice is of the bytes that source produces.
+    """
+    
+    def __init__(self, file_path, offset, length, chunk_size=DEFAULT_CHUNK_SIZE,
+                 progress=None, hasher=None, throttle=None, digest=None, source=None):
+        self.file_path = str(file_path)
+        self.source = source
+        self.file = open(file_path, 'rb')
+        self.file.seek(offset)
+        self.offset = offset
+        self.length = length
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.hasher = hasher
+        self.throttle = throttle
+        self.digest = digest
+    
+    def __len__(self):
+        return self.length
+    
+    def read(self, size=-1):
+        """Return the next piece of the slice"""
+        if self.remaining <= 0:
+            return b''
+        if size is None or size < 0:
+            size = self.chunk_size
+        
+        size = min(size, self.chunk_size, self.remaining)
+        if self.source is not None:
+            data = self.source.pread(self.offset + self.length - self.remaining, size, self.file.fileno())
+        else:
+            data = self.file.read(size)
+        if not data:
+            raise IOError(f"File shrank during upload: {self.file_path}")
+        
+        self.remaining -= len(data)
+        if self.throttle is not None:
+            self.throttle(len(data))
+        if self.hasher is not None:
+            self.hasher.update(data)
+        if self.digest is not None and self.digest.feeds(self.offset + self.length - self.remaining - len(data)):
+            self.digest.update(data)
+        if self.progress is not None:
+            self.progress.update(len(data))
+        return data
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
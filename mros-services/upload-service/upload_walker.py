@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Walker
+Streaming parallel directory walker with include/exclude and ignore files
+"""
+
+import os
+import re
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_IGNORE_FILES = ('.gitignore', '.mrosignore')
+
+def translate_pattern(pattern):
+    """Translate a gitignore-style glob into a regular expression"""
+    i = 0
+    regex = ''
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += '(?:/.*)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if c == '*':
+            regex += '[^/]*'
+        elif c == '?':
+            regex += '[^/]'
+        elif c == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(c)
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += f'[{body}]'
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(c)
+        i += 1
+    return re.compile(regex + r'\Z')
+
+class IgnoreRule:
+    """One line of an ignore file, relative to the directory it came from"""
+    
+    def __init__(self, pattern, base):
+        self.base = base
+        self.negate = pattern.startswith('!')
+        if self.negate:
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # Patterns containing a slash are anchored to the base directory
+        self.anchored = '/' in pattern
+        self.regex = translate_pattern(pattern.lstrip('/'))
+    
+    def matches(self, rel_path, name, is_dir):
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            if self.base:
+                if not rel_path.startswith(self.base + '/'):
+                    return False
+                rel_path = rel_path[len(self.base) + 1:]
+            return bool(self.regex.match(rel_path))
+        return bool(self.regex.match(name))
+
+class IgnoreRules:
+    """Ordered ignore rules; the last matching rule decides, like git"""
+    
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+    
+    @classmethod
+    def from_patterns(cls, patterns, base=''):
+        return cls(IgnoreRule(p, base) for p in patterns)
+    
+    def extend_from_file(self, file_path, base):
+        """Return new rules with the patterns of an ignore file appended"""
+        try:
+            with open(file_path, 'r', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return self
+        
+        rules = list(self.rules)
+        for line in lines:
+            line = line.rstrip()
+            if not line or line.startswith('#'):
+                continue
+            if line.startswith('\\#') or line.startswith('\\!'):
+                line = line[1:]
+            rules.append(IgnoreRule(line, base))
+        return IgnoreRules(rules)
+    
+    def matches(self, rel_path, name, is_dir):
+        result = False
+        for rule in self.rules:
+            if rule.matches(rel_path, name, is_dir):
+                result = not rule.negate
+        return result
+
+def walk_files(root, include=None, exclude=None, ignore_files=DEFAULT_IGNORE_FILES,
+               workers=4, follow_symlinks=False, max_buffered=64):
+    """Yield paths (str) of files under root as soon as they are found
+    
+    Directories are scanned with os.scandir, reusing the dirent type so
+    no extra stat call is needed, and subtrees fan out over a small
+    thread pool whenever a worker is idle.  include/exclude are gitignore-style globs matched
+    against the path relative to root; ignore_files found in any
+    directory apply to that directory and below.  Files come out in
+    discovery order, not sorted.
+    """
+    root = os.fspath(root)
+    include_rules = IgnoreRules.from_patterns(include or ())
+    base_rules = IgnoreRules.from_patterns(exclude or ())
+    
+    found = queue.Queue(maxsize=max_buffered)
+    stop = threading.Event()
+    pending = [1]
+    pending_lock = threading.Lock()
+    done = object()
+    
+    def put(item):
+        # Bounded put that gives up once the consumer went away
+        while not stop.is_set():
+            try:
+                found.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def scan_tree(executor, directory, rel_dir, rules):
+        # Depth-first over a local stack; subdirectories are only handed to
+        # the pool while it has idle workers, so thread handoffs stay rare
+        stack = [(directory, rel_dir, rules)]
+        batch = []
+        flushed = time.monotonic()
+        try:
+            while stack and not stop.is_set():
+                directory, rel_dir, rules = stack.pop()
+                for ignore_file in ignore_files:
+                    ignore_path = os.path.join(directory, ignore_file)
+                    if os.path.isfile(ignore_path):
+                        rules = rules.extend_from_file(ignore_path, rel_dir)
+                
+                try:
+                    entries = os.scandir(directory)
+                except OSError:
+                    continue
+                
+                with entries:
+                    for entry in entries:
+                        rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                            is_file = not is_dir and entry.is_file(follow_symlinks=follow_symlinks)
+                        except OSError:
+                            continue
+                        
+                        if rules.matches(rel_path, entry.name, is_dir):
+                            continue
+                        
+                        if is_dir:
+                            with pending_lock:
+                                hand_off = pending[0] < workers
+                                if hand_off:
+                                    pending[0] += 1
+                            if hand_off:
+                                executor.submit(scan_tree, executor, entry.path, rel_path, rules)
+                            else:
+                                stack.append((entry.path, rel_path, rules))
+                        elif is_file:
+                            if include and not include_rules.matches(rel_path, entry.name, False):
+                                continue
+                            batch.append(entry.path)
+                
+                # Flush often enough that the first uploads start right away
+                now = time.monotonic()
+                if len(batch) >= 256 or (batch and now - flushed > 0.02):
+                    if not put(batch):
+                        return
+                    batch = []
+                    flushed = now
+            
+            if batch:
+                put(batch)
+        finally:
+            with pending_lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                put(done)
+    
+    workers = max(1, workers)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mros-walk')
+    executor.submit(scan_tree, executor, root, '', base_rules)
+    try:
+        while True:
+            batch = found.get()
+            if batch is done:
+                break
+            yield from batch
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,443 @@
+#!/usr/bin/env python3
+"""
+mros-linux Upload Watch
+Watch-folder mode: inotify (or polling) change detection, write debouncing and a persistent cursor
+"""
+
+import os
+import stat
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import sqlite3
+import threading
+
+from upload_walker import IgnoreRules, DEFAULT_IGNORE_FILES
+
+DEFAULT_DEBOUNCE = 1.0
+DEFAULT_POLL_INTERVAL = 30.0
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+
+def signature(st):
+    """What identifies a version of a file: (size, mtime, inode)"""
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+class Inotify:
+    """Minimal inotify binding over libc with ctypes
+    
+    Raises OSError when the kernel or libc has no inotify, in which
+    case watchers poll instead.
+    """
+    
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.libc = libc
+        self.libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"inotify_init1: {os.strerror(error)}")
+    
+    def fileno(self):
+        return self.fd
+    
+    def add_watch(self, path, mask=WATCH_MASK):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        return wd
+    
+    def remove_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+    
+    def read_events(self):
+        """Events waiting on the descriptor as (wd, mask, cookie, name) tuples"""
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                events.append((wd, mask, cookie, name))
+    
+    def close(self):
+        os.close(self.fd)
+
+class WatchState:
+    """SQLite cursor of watched folders: the last uploaded version of every file
+    
+    A file is only recorded once its upload succeeded, so anything that
+    changed, failed or was still queued when the watcher stopped is
+    picked up by comparing stat results on the next start; nothing is
+    re-read or re-uploaded otherwise.
+    """
+    
+    def __init__(self, db_path):
+        self.db_path = str(db_path)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS watched_files (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                uploaded_at REAL NOT NULL,
+                PRIMARY KEY (root, path)
+            );
+        """)
+        self.db.commit()
+    
+    def signatures(self, root):
+        """{path: signature} of everything uploaded from root"""
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT path, size, mtime_ns, inode FROM watched_files WHERE root = ?', (root,)
+            ).fetchall()
+        return {path: (size, mtime_ns, inode) for path, size, mtime_ns, inode in rows}
+    
+    def record(self, root, path, sig):
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO watched_files VALUES (?, ?, ?, ?, ?, ?)',
+                (root, path, *sig, time.time())
+            )
+            self.db.commit()
+    
+    def forget(self, root, paths):
+        with self.lock:
+            self.db.executemany(
+                'DELETE FROM watched_files WHERE root = ? AND path = ?',
+                [(root, path) for path in paths]
+            )
+            self.db.commit()
+    
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class FolderWatcher:
+    """Turns changes under a folder into batches of files ready to upload
+    
+    With inotify every directory gets a watch and a file becomes a
+    candidate when it is created, written or moved in; it is ready once
+    the writer closed it, or sent no write for debounce seconds (hard
+    links, mmap writes), and nothing touched it for debounce seconds.
+    Without inotify (or with poll_interval set) the tree is rescanned
+    every poll_interval seconds and a file is ready once its stat stayed
+    the same for debounce seconds.  Either way files whose size, mtime
+    and inode match the cursor are skipped, and include/exclude and
+    ignore files apply as for --folder.
+    """
+    
+    def __init__(self, root, state, include=None, exclude=None, ignore_files=DEFAULT_IGNORE_FILES,
+                 debounce=DEFAULT_DEBOUNCE, poll_interval=None):
+        self.root = os.path.abspath(root)
+        self.state = state
+        self.include = include
+        self.include_rules = IgnoreRules.from_patterns(include or ())
+        self.base_rules = IgnoreRules.from_patterns(exclude or ())
+        self.ignore_files = ignore_files
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.rules_cache = {}
+        self.lock = threading.Lock()
+        self.known = {}
+        self.pending = {}
+        self.in_flight = {}
+        # Files open for writing, with the time of their last write event
+        self.writing = {}
+        self.inotify = None
+        self.watches = {}
+        self.mode = None
+    
+    def start(self):
+        """Set up change detection and compare the tree with the cursor"""
+        self.known = self.state.signatures(self.root)
+        if self.poll_interval is None:
+            try:
+                self.inotify = Inotify()
+                self.mode = 'inotify'
+            except OSError as e:
+                self.fall_back(f"inotify unavailable ({e})")
+        else:
+            self.mode = 'poll'
+        self.rescan()
+    
+    def fall_back(self, reason):
+        print(f"Watch: {reason}, polling every {self.poll_interval or DEFAULT_POLL_INTERVAL:g} s")
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+        self.watches = {}
+        self.poll_interval = self.poll_interval or DEFAULT_POLL_INTERVAL
+        self.mode = 'poll'
+    
+    def close(self):
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+    
+    # Filtering
+    
+    def rules_for(self, rel_dir):
+        """Rules in effect inside rel_dir, None when the directory itself is excluded"""
+        if rel_dir in self.rules_cache:
+            return self.rules_cache[rel_dir]
+        if not rel_dir:
+            rules = self.base_rules
+        else:
+            parent, _, name = rel_dir.rpartition('/')
+            rules = self.rules_for(parent)
+            if rules is not None and rules.matches(rel_dir, name, True):
+                rules = None
+        if rules is not None:
+            directory = os.path.join(self.root, rel_dir)
+            for ignore_file in self.ignore_files:
+                rules = rules.extend_from_file(os.path.join(directory, ignore_file), rel_dir)
+        self.rules_cache[rel_dir] = rules
+        return rules
+    
+    def accepts(self, rel_path):
+        rel_dir, _, name = rel_path.rpartition('/')
+        rules = self.rules_for(rel_dir)
+        if rules is None or rules.matches(rel_path, name, False):
+            return False
+        return not self.include or self.include_rules.matches(rel_path, name, False)
+    
+    # Candidates
+    
+    def consider(self, path):
+        """Note a possibly changed file; it is uploaded once it settles"""
+        try:
+            st = os.lstat(path)
+        except OSError:
+            with self.lock:
+                self.pending.pop(path, None)
+                self.writing.pop(path, None)
+            return
+        if not stat.S_ISREG(st.st_mode):
+            return
+        sig = signature(st)
+        with self.lock:
+            if self.known.get(path) == sig or self.in_flight.get(path) == sig:
+                self.pending.pop(path, None)
+                self.writing.pop(path, None)
+                return
+            previous = self.pending.get(path)
+            if previous is None or previous[1] != sig:
+                self.pending[path] = (time.monotonic() + self.debounce, sig)
+    
+    def forget(self, path, tree=False):
+        """Drop a deleted or moved away file (or directory) from the cursor"""
+        prefix = path + os.sep
+        matches = (lambda p: p == path or p.startswith(prefix)) if tree else (lambda p: p == path)
+        with self.lock:
+            gone = [p for p in self.known if matches(p)]
+            for p in gone:
+                del self.known[p]
+            for p in [p for p in self.pending if matches(p)]:
+                del self.pending[p]
+            self.writing = {p: t for p, t in self.writing.items() if not matches(p)}
+        if gone:
+            self.state.forget(self.root, gone)
+    
+    def uploaded(self, path, result):
+        """Move the cursor past a file whose upload finished"""
+        with self.lock:
+            sig = self.in_flight.pop(path, None)
+            if sig is None or not result.get('success'):
+                return
+            self.known[path] = sig
+        self.state.record(self.root, path, sig)
+    
+    def settles_at(self, path, deadline):
+        """When a pending file may go out, debounce seconds after its last write event"""
+        last_write = self.writing.get(path)
+        return deadline if last_write is None else max(deadline, last_write + self.debounce)
+    
+    def collect_ready(self):
+        """Pending files that stopped changing, now in flight"""
+        now = time.monotonic()
+        ready = []
+        with self.lock:
+            # A file goes out again only after its previous upload finished
+            due = [path for path, (deadline, _) in self.pending.items()
+                   if self.settles_at(path, deadline) <= now and path not in self.in_flight]
+        for path in due:
+            try:
+                sig = signature(os.lstat(path))
+            except OSError:
+                sig = None
+            with self.lock:
+                entry = self.pending.get(path)
+                if entry is None:
+                    continue
+                if sig is None:
+                    del self.pending[path]
+                elif sig != entry[1]:
+                    self.pending[path] = (now + self.debounce, sig)
+                else:
+                    del self.pending[path]
+                    self.writing.pop(path, None)
+                    self.in_flight[path] = sig
+                    ready.append(path)
+        return ready
+    
+    # Scanning
+    
+    def scan(self, rel_dir=''):
+        """Consider every file under rel_dir, watching its directories; returns the paths seen"""
+        seen = set()
+        stack = [rel_dir]
+        while stack:
+            rel_dir = stack.pop()
+            if self.rules_for(rel_dir) is None:
+                continue
+            directory = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            if self.inotify is not None:
+                self.add_watch(directory, rel_dir)
+            try:
+                entries = os.scandir(directory)
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    rel_path = f'{rel_dir}/{entry.name}' if rel_dir else entry.name
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        is_file = not is_dir and entry.is_file(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if is_dir:
+                        stack.append(rel_path)
+                    elif is_file and self.accepts(rel_path):
+                        seen.add(entry.path)
+                        self.consider(entry.path)
+        return seen
+    
+    def rescan(self):
+        """Compare the whole tree with the cursor; files gone since are forgotten"""
+        seen = self.scan()
+        vanished = [path for path in list(self.known) if path not in seen]
+        for path in vanished:
+            self.forget(path)
+    
+    def add_watch(self, directory, rel_dir):
+        try:
+            wd = self.inotify.add_watch(directory)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:
+                self.fall_back("inotify watch limit reached (fs.inotify.max_user_watches)")
+            return
+        self.watches[wd] = rel_dir
+    
+    def unwatch(self, rel_dir):
+        prefix = rel_dir + '/'
+        for wd, watched in list(self.watches.items()):
+            if watched == rel_dir or watched.startswith(prefix):
+                self.inotify.remove_watch(wd)
+                del self.watches[wd]
+    
+    def handle_events(self, events):
+        for wd, mask, cookie, name in events:
+            if mask & IN_Q_OVERFLOW:
+                # Events were lost, only a rescan can tell what changed
+                self.rescan()
+                continue
+            rel_dir = self.watches.get(wd)
+            if rel_dir is None:
+                continue
+            if mask & IN_IGNORED:
+                del self.watches[wd]
+                continue
+            if not name:
+                continue
+            rel_path = f'{rel_dir}/{name}' if rel_dir else name
+            path = os.path.join(self.root, rel_path)
+            if name in self.ignore_files:
+                self.rules_cache.clear()
+            
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    # Files may have landed before the watch did
+                    self.scan(rel_path)
+                elif mask & (IN_MOVED_FROM | IN_DELETE):
+                    if self.inotify is not None:
+                        self.unwatch(rel_path)
+                    self.forget(path, tree=True)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.forget(path)
+            elif self.accepts(rel_path):
+                with self.lock:
+                    if mask & (IN_CREATE | IN_MODIFY):
+                        self.writing[path] = time.monotonic()
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        self.writing.pop(path, None)
+                self.consider(path)
+    
+    # Main loop
+    
+    def next_timeout(self, next_poll):
+        now = time.monotonic()
+        timeout = 1.0
+        with self.lock:
+            for path, (deadline, _) in self.pending.items():
+                if path not in self.in_flight:
+                    timeout = min(timeout, self.settles_at(path, deadline) - now)
+        if next_poll is not None:
+            timeout = min(timeout, next_poll - now)
+        return max(timeout, 0)
+    
+    def batches(self, stop):
+        """Yield lists of files ready to upload until stop is set"""
+        self.start()
+        next_poll = None
+        while not stop.is_set():
+            if self.inotify is None and next_poll is None:
+                next_poll = time.monotonic() + self.poll_interval
+            timeout = self.next_timeout(next_poll)
+            if self.inotify is not None:
+                readable, _, _ = select.select([self.inotify], [], [], timeout)
+                if readable:
+                    self.handle_events(self.inotify.read_events())
+            else:
+                stop.wait(timeout)
+                if time.monotonic() >= next_poll:
+                    self.rescan()
+                    next_poll = None
+            ready = self.collect_ready()
+            if ready:
+                yield ready
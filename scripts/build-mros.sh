@@ -292,7 +292,7 @@ EOF
     cat <<'EOF' | sudo tee "$CHROOT_DIR/usr/bin/mros-upload-service"
 #!/bin/bash
 cd /usr/share/mros/services/upload-service
-python3 upload-service.py "$@"
+python3 upload_client.py "$@"
 EOF
     
     # Make launchers executable
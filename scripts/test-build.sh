@@ -59,6 +59,33 @@ test_python_syntax() {
         "mros-apps/file-manager/file-manager.py"
         "mros-apps/upload-manager/upload-manager.py"
         "mros-services/upload-service/upload-service.py"
+        "mros-services/upload-service/upload_engine.py"
+        "mros-services/upload-service/upload_session.py"
+        "mros-services/upload-service/upload_stream.py"
+        "mros-services/upload-service/upload_resume.py"
+        "mros-services/upload-service/upload_standin.py"
+        "mros-services/upload-service/upload_dedup.py"
+        "mros-services/upload-service/upload_history.py"
+        "mros-services/upload-service/upload_walker.py"
+        "mros-services/upload-service/upload_codecs.py"
+        "mros-services/upload-service/upload_pack.py"
+        "mros-services/upload-service/upload_notify.py"
+        "mros-services/upload-service/upload_async.py"
+        "mros-services/upload-service/upload_client.py"
+        "mros-services/upload-service/upload_daemon.py"
+        "mros-services/upload-service/upload_queue.py"
+        "mros-services/upload-service/upload_bandwidth.py"
+        "mros-services/upload-service/upload_backends.py"
+        "mros-services/upload-service/upload_bench.py"
+        "mros-services/upload-service/upload_metrics.py"
+        "mros-services/upload-service/upload_parts.py"
+        "mros-services/upload-service/upload_sendfile.py"
+        "mros-services/upload-service/upload_crypto.py"
+        "mros-services/upload-service/upload_fetch.py"
+        "mros-services/upload-service/upload_report.py"
+        "mros-services/upload-service/upload_watch.py"
+        "mros-services/upload-service/upload_records.py"
+        "mros-services/upload-service/upload_pipeline.py"
     )
     
     for file in "${python_files[@]}"; do